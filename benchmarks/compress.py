@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the pelican_tools.compress profiles: bytes saved against CPU.
+
+Generates a synthetic output directory (HTML pages, feeds, CSS and
+JavaScript) and writes its sidecars with each profile, reporting the bytes
+saved by each format and the CPU time spent, then runs the ``max`` profile
+again on a fresh copy to show the effect of its content cache::
+
+    python benchmarks/compress.py --pages 500 --jobs 4
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from pelican_tools.compress import (PROFILES, Precompressor,
+                                    extension_options)
+
+PARAGRAPH = ('<p>Lorem ipsum dolor sit amet, <em>consectetur</em> adipiscing '
+             'elit, sed do eiusmod tempor incididunt ut labore et dolore '
+             'magna aliqua. Ut enim ad minim veniam, quis nostrud '
+             '<a href="/article-{n}.html">exercitation</a> ullamco.</p>\n')
+
+PAGE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <title>Article {n} - Synthetic site</title>
+  <link rel="stylesheet" href="/theme/css/main.css">
+</head>
+<body>
+  <header><h1><a href="/">Synthetic site</a></h1>
+    <nav><ul>{menu}</ul></nav></header>
+  <article>
+    <h2>Article {n}</h2>
+    <time datetime="2020-01-{day:02d}">2020-01-{day:02d}</time>
+    {body}
+    <pre><code>def article_{n}():
+    return {n}</code></pre>
+  </article>
+  <footer>Proudly powered by Pelican.</footer>
+  <script src="/theme/js/site.js"></script>
+</body>
+</html>
+'''
+
+CSS = ('.article-{n} {{ margin: {n}px auto; padding: 0 1em; '
+       'color: #{n:06x}; }}\n'
+       '.article-{n} h2 {{ font: bold 1.{n}em/1.2 Georgia, serif; }}\n')
+
+JS = '''function article{n}(element) {{
+  var node = document.querySelector('.article-{n}');
+  if (node) {{ node.addEventListener('click', function () {{
+    element.classList.toggle('open-{n}'); }}); }}
+}}
+'''
+
+
+def generate(path, pages, paragraphs):
+    menu = ''.join('<li><a href="/category/c%d.html">Category %d</a></li>'
+                   % (c, c) for c in range(10))
+    for n in range(pages):
+        body = ''.join(PARAGRAPH.format(n=(n + p) % pages)
+                       for p in range(paragraphs))
+        write(os.path.join(path, 'article-%d.html' % n),
+              PAGE.format(n=n, day=n % 28 + 1, menu=menu, body=body))
+    entries = ''.join('<entry><title>Article %d</title><id>tag:%d</id>'
+                      '<summary>%s</summary></entry>\n'
+                      % (n, n, PARAGRAPH.format(n=n)) for n in range(pages))
+    write(os.path.join(path, 'feeds', 'all.atom.xml'),
+          '<?xml version="1.0"?><feed>%s</feed>' % entries)
+    write(os.path.join(path, 'theme', 'css', 'main.css'),
+          ''.join(CSS.format(n=n) for n in range(pages)))
+    write(os.path.join(path, 'theme', 'js', 'site.js'),
+          ''.join(JS.format(n=n) for n in range(pages)))
+
+
+def write(path, text):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def run(source, workdir, name, profile, jobs, settings):
+    output = os.path.join(workdir, name)
+    shutil.copytree(source, output)
+    compressor = Precompressor(output, extension_options(settings, profile),
+                               os.path.join(workdir, name + '.json'), jobs)
+    cpu, wall = cpu_time(), time.time()
+    compressor.run()
+    cpu, wall = cpu_time() - cpu, time.time() - wall
+    row = [name, wall, cpu]
+    for fmt in ('gz', 'br'):
+        original, compressed = compressor.sizes[fmt]
+        row.append(original - compressed)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=300,
+                        help='Number of HTML pages (default: %(default)s).')
+    parser.add_argument('--paragraphs', type=int, default=12,
+                        help='Paragraphs per page (default: %(default)s).')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes (default: %(default)s).')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='pelican-tools-bench-')
+    try:
+        source = os.path.join(workdir, 'site')
+        generate(source, args.pages, args.paragraphs)
+        size = sum(os.path.getsize(os.path.join(d, f))
+                   for d, _, files in os.walk(source) for f in files)
+        settings = {'PRECOMPRESS_CONTENT_CACHE_PATH':
+                    os.path.join(workdir, 'content-cache')}
+        rows = [run(source, workdir, profile, profile, args.jobs, settings)
+                for profile in PROFILES]
+        rows.append(run(source, workdir, 'max (cached)', 'max', args.jobs,
+                        settings))
+
+        print('%d files, %d bytes, %d processes' % (
+            args.pages + 3, size, args.jobs))
+        print('%-14s %8s %8s %12s %12s %14s' % (
+            'profile', 'wall (s)', 'CPU (s)', 'gz saved', 'br saved',
+            'saved/CPU s'))
+        for name, wall, cpu, gz, br in rows:
+            print('%-14s %8.2f %8.2f %12d %12d %14.0f' % (
+                name, wall, cpu, gz, br, (gz + br) / cpu if cpu else 0))
+        default, best = rows[0], rows[1]
+        print('max sidecars are %.1f%% (gz) and %.1f%% (br) smaller and '
+              'save %d more bytes, for %.1fx the CPU time' % (
+                  100.0 * (best[3] - default[3]) / (size - default[3]),
+                  100.0 * (best[4] - default[4]) / (size - default[4]),
+                  best[3] + best[4] - default[3] - default[4],
+                  best[2] / default[2] if default[2] else 0))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
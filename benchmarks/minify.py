@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the pelican_tools.minify HTML minifier throughput in MB/s.
+
+Generates synthetic HTML pages and minifies them in memory (whole pages,
+then fed by 64 KB chunks), then in place with a pool of processes for each
+number of processes given::
+
+    python benchmarks/minify.py --pages 1000 --jobs 1 2 4
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from pelican_tools.minify import HTMLMinifier, minify, minify_files
+
+from compress import generate
+
+CHUNK = 64 * 1024
+
+
+def minify_chunked(html):
+    minifier = HTMLMinifier()
+    out = [minifier.feed(html[i:i + CHUNK])
+           for i in range(0, len(html), CHUNK)]
+    out.append(minifier.close())
+    return ''.join(out)
+
+
+def in_memory(pages, func):
+    start = time.time()
+    size = sum(len(func(page)) for page in pages)
+    return time.time() - start, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=500,
+                        help='Number of HTML pages (default: %(default)s).')
+    parser.add_argument('--paragraphs', type=int, default=12,
+                        help='Paragraphs per page (default: %(default)s).')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4],
+                        help='Numbers of processes (default: %(default)s).')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='pelican-tools-bench-')
+    try:
+        source = os.path.join(workdir, 'site')
+        generate(source, args.pages, args.paragraphs)
+        paths = [os.path.join(source, name) for name in os.listdir(source)
+                 if name.endswith('.html')]
+        pages = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                pages.append(f.read().decode('utf-8'))
+        size = sum(len(page.encode('utf-8')) for page in pages)
+        print('%d pages, %d bytes' % (len(pages), size))
+        print('%-22s %8s %8s %10s' % ('run', 'time (s)', 'MB/s', 'saved'))
+
+        for name, func in (('in memory', minify),
+                           ('in memory, chunked', minify_chunked)):
+            elapsed, minified = in_memory(pages, func)
+            print('%-22s %8.2f %8.1f %9.1f%%' % (
+                name, elapsed, size / 1e6 / elapsed,
+                100.0 * (size - minified) / size))
+
+        for jobs in args.jobs:
+            output = os.path.join(workdir, 'jobs-%d' % jobs)
+            shutil.copytree(source, output)
+            files = [path.replace(source, output, 1) for path in paths]
+            start = time.time()
+            before, after = minify_files(files, jobs)
+            elapsed = time.time() - start
+            print('%-22s %8.2f %8.1f %9.1f%%' % (
+                'files, %d processes' % jobs, elapsed,
+                before / 1e6 / elapsed, 100.0 * (before - after) / before))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
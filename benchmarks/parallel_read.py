@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Benchmark pelican_tools.parallel_read against the number of processes.
+
+Generates a synthetic corpus of Markdown and reStructuredText articles and
+parses it serially and with 1, 2, 4, ... processes (up to the number of
+cores, or the values given with ``--jobs``)::
+
+    python benchmarks/parallel_read.py --files 4000 --jobs 1,2,4,8,16,32
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import copy
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from pelican.readers import Readers
+from pelican.settings import DEFAULT_CONFIG
+
+from pelican_tools.parallel_read import default_jobs, read_files
+
+PARAGRAPH = ('Lorem ipsum dolor sit amet, *consectetur* adipiscing elit, sed '
+             'do eiusmod tempor incididunt ut labore et dolore magna aliqua. '
+             'Ut enim ad minim veniam, quis nostrud exercitation ullamco. ')
+
+MARKDOWN = '''Title: Article {n}
+Date: 2020-01-{day:02d} 10:{minute:02d}
+Tags: tag{tag}, common
+Category: category{category}
+
+{body}
+
+    :::python
+    def article_{n}():
+        return {n}
+
+- first item
+- second item with a [link](https://example.com/{n})
+'''
+
+RST = '''{title}
+{underline}
+
+:date: 2020-01-{day:02d} 10:{minute:02d}
+:tags: tag{tag}, common
+:category: category{category}
+
+{body}
+
+.. code-block:: python
+
+    def article_{n}():
+        return {n}
+
+- first item
+- second item with a `link <https://example.com/{n}>`_
+'''
+
+
+def generate(path, count, paragraphs):
+    for n in range(count):
+        template, ext = (MARKDOWN, 'md') if n % 2 else (RST, 'rst')
+        text = template.format(n=n, day=n % 28 + 1, minute=n % 60,
+                               tag=n % 50, category=n % 10,
+                               title='Article %d' % n,
+                               underline='#' * len('Article %d' % n),
+                               body='\n\n'.join([PARAGRAPH] * paragraphs))
+        with io.open(os.path.join(path, 'article%d.%s' % (n, ext)), 'w',
+                     encoding='utf-8') as f:
+            f.write(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=2000,
+                        help='Number of articles (default: %(default)s).')
+    parser.add_argument('--paragraphs', type=int, default=10,
+                        help='Paragraphs per article (default: %(default)s).')
+    parser.add_argument('--jobs', default=None,
+                        help='Comma separated numbers of processes.')
+    args = parser.parse_args()
+    if args.jobs:
+        jobs = [int(j) for j in args.jobs.split(',')]
+    else:
+        jobs, j = [], 1
+        while j <= default_jobs():
+            jobs.append(j)
+            j *= 2
+
+    path = tempfile.mkdtemp(prefix='pelican-tools-bench-')
+    try:
+        generate(path, args.files, args.paragraphs)
+        settings = copy.deepcopy(DEFAULT_CONFIG)
+        settings['PATH'] = path
+        files = sorted(os.path.join(path, f) for f in os.listdir(path))
+
+        readers = Readers(settings)
+        start = time.time()
+        for f in files:
+            readers.readers[os.path.splitext(f)[1][1:]].read(f)
+        serial = time.time() - start
+
+        print('%d files on %d cores' % (len(files), default_jobs()))
+        print('%8s %10s %10s %8s' % ('jobs', 'seconds', 'files/s', 'speedup'))
+        print('%8s %10.2f %10.0f %8.2f' % ('serial', serial,
+                                           len(files) / serial, 1))
+        for j in jobs:
+            start = time.time()
+            results = read_files(files, settings, j)
+            elapsed = time.time() - start
+            assert all(result is not None for _, result in results)
+            print('%8d %10.2f %10.0f %8.2f' % (j, elapsed,
+                                               len(files) / elapsed,
+                                               serial / elapsed))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
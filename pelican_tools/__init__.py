@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""Tools developed for the Pelican static site generator."""
+from __future__ import unicode_literals
+
+__version__ = '1.0.0'
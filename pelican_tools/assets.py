@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""Bundle, minify and fingerprint the CSS and JavaScript of the theme.
+
+Add ``pelican_tools.assets`` to ``PLUGINS`` to write, next to the theme
+static files, copies whose names hold a hash of their content
+(``theme/css/main.3f2a9c1e0b7d.css``): their URL changes with their content,
+so they can be served with ``Cache-Control: public, max-age=31536000,
+immutable``. References to the original files in the rendered HTML are
+rewritten to the fingerprinted ones.
+
+By default every CSS and JavaScript file of the theme is fingerprinted on
+its own. ``ASSET_BUNDLES`` concatenates files instead, names being relative
+to the theme static directory::
+
+    ASSET_BUNDLES = {
+        'css/site.css': ['css/reset.css', 'css/main.css'],
+        'js/site.js': ['js/menu.js', 'js/search.js'],
+    }
+
+Local ``@import`` rules of CSS files are inlined and relative ``url()``
+references are rebased. Bundles are minified unless ``ASSET_MINIFY`` is
+False: CSS comments and whitespace are removed, and so are the blank lines,
+trailing whitespace and full-line comments of JavaScript files without
+template literals.
+
+The mapping of original to fingerprinted paths (relative to the output
+directory) is written to ``theme/manifest.json`` and given to the templates
+as ``ASSETS``. A bundle is only built again when one of its files changed
+since the last build (see ``ASSET_CACHE_PATH``).
+"""
+from __future__ import unicode_literals
+
+import io
+import logging
+import os
+import posixpath
+import re
+
+from pelican.writers import Writer
+
+from pelican_tools.utils import (atomic_write, cache_path, dump_json,
+                                 iter_files, load_json, sha256_bytes,
+                                 stat_key)
+
+logger = logging.getLogger(__name__)
+
+#: Bumped when the output of the bundler changes for the same input.
+CACHE_VERSION = 1
+
+#: Characters of the content hash put in the file names.
+HASH_LENGTH = 12
+
+EXTENSIONS = ('css', 'js')
+
+_css_token = re.compile(r'''
+      ("(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')         # 1: string
+    | (/\*!.*?\*/)                                      # 2: kept comment
+    | /\*.*?\*/
+    | [ \t\n\r\f]*(;?[ \t\n\r\f]*\}|[{};,>])[ \t\n\r\f]*  # 3: punctuation
+    | (:)[ \t\n\r\f]+                                   # 4: colon
+    | ([ \t\n\r\f]+)                                    # 5: whitespace
+''', re.S | re.X)
+_css_import = re.compile(r'''@import\s+(?:url\(\s*)?(["']?)([^"')\s]+)\1\s*
+                             \)?\s*([^;]*);[ \t]*\n?''', re.X)
+_css_url = re.compile(r'''url\(\s*(["']?)([^"')]+)\1\s*\)''')
+_placeholder = re.compile(r'\0(\d+)\0')
+_js_comment = re.compile(r'^\s*//.*$')
+_reference = re.compile(r'''(\b(?:href|src)\s*=\s*["'])([^"'?#]+)''', re.I)
+
+
+def _is_local(url):
+    return not (':' in url or url.startswith(('/', '#')) or
+                url.startswith('data:'))
+
+
+def minify_css(css):
+    def replace(m):
+        if m.group(1) or m.group(2):
+            return m.group()
+        if m.group(3):
+            return '}' if m.group(3).endswith('}') else m.group(3)
+        if m.group(4):
+            return ':'
+        return ' ' if m.group(5) else ''
+    return _css_token.sub(replace, css).strip()
+
+
+def minify_js(js):
+    """Remove the blank lines, trailing whitespace and full-line comments
+    of ``js``.
+
+    Lines are otherwise kept as they are: their indentation may be part of
+    a string continued with a backslash, and automatic semicolon insertion
+    depends on where they end.
+    """
+    if '`' in js:
+        # whitespace is part of template literals
+        return js
+    lines = []
+    continued = False
+    for line in js.split('\n'):
+        line = line.rstrip(' \t\r')
+        if not continued and (not line or _js_comment.match(line)):
+            continue
+        lines.append(line)
+        # the next line is still in the string
+        continued = line.endswith('\\')
+    return '\n'.join(lines)
+
+
+class Bundle(object):
+    """Files concatenated into the asset ``name``, relative to the theme
+    static directory."""
+
+    def __init__(self, name, members):
+        self.name = name
+        self.members = members
+        self.ext = name.rpartition('.')[2].lower()
+
+    def fingerprinted(self, digest):
+        root, ext = posixpath.splitext(self.name)
+        return '%s.%s%s' % (root, digest[:HASH_LENGTH], ext)
+
+    def build(self, sources, minify=True):
+        """Return the content of the bundle and the paths of the files read,
+        ``sources`` mapping the names relative to the theme static directory
+        to the paths of the files."""
+        inputs = []
+        parts = []
+        imports = []
+        seen = set()
+        for member in self.members:
+            if member not in sources:
+                raise ValueError('%s: no %s file in the theme' % (
+                    self.name, member))
+            if self.ext == 'css':
+                if member not in seen:
+                    parts.append(self._css(member, sources, inputs, imports,
+                                           seen))
+            else:
+                inputs.append(sources[member])
+                parts.append(_read(sources[member]))
+        if self.ext == 'css':
+            text = '\n'.join(imports + parts)
+            if minify:
+                text = minify_css(text)
+        else:
+            if minify:
+                parts = [minify_js(part) for part in parts]
+            text = ';\n'.join(part.rstrip().rstrip(';') for part in parts)
+        return text + '\n', inputs
+
+    def _css(self, name, sources, inputs, imports, seen):
+        """Return the CSS of ``name`` with its local imports inlined and its
+        URLs made relative to the bundle, adding the imports left to
+        ``imports``."""
+        path = sources[name]
+        inputs.append(path)
+        seen.add(name)
+        directory = posixpath.dirname(name)
+
+        def rebase(url):
+            if not _is_local(url):
+                return url
+            target = posixpath.normpath(posixpath.join(directory, url))
+            return posixpath.relpath(target,
+                                     posixpath.dirname(self.name) or '.')
+
+        inlined = []
+
+        def inline(m):
+            url, media = m.group(2), m.group(3).strip()
+            target = posixpath.normpath(posixpath.join(directory, url))
+            if _is_local(url) and not media and target in sources:
+                if target in seen:
+                    return ''
+                inlined.append(self._css(target, sources, inputs, imports,
+                                         seen))
+                return '\0%d\0' % (len(inlined) - 1)
+            imports.append('@import url("%s")%s;' % (
+                rebase(url), ' ' + media if media else ''))
+            return ''
+
+        css = _css_import.sub(inline, _read(path))
+        # the URLs of the inlined files are already rebased
+        css = _css_url.sub(lambda m: 'url("%s")' % rebase(m.group(2)), css)
+        return _placeholder.sub(lambda m: inlined[int(m.group(1))], css)
+
+
+def _read(path):
+    with io.open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def theme_sources(settings):
+    """Return the files of the theme static directory, by name relative to
+    it, like Pelican copies them."""
+    sources = {}
+    for static in settings.get('THEME_STATIC_PATHS', ['static']):
+        root = os.path.join(settings['THEME'], static)
+        if os.path.isfile(root):
+            sources[os.path.basename(root)] = root
+            continue
+        for path in iter_files(root):
+            rel = os.path.relpath(path, root).replace(os.sep, '/')
+            sources[rel] = path
+    return sources
+
+
+def configured_bundles(settings, sources):
+    bundles = settings.get('ASSET_BUNDLES')
+    if bundles is None:
+        return [Bundle(name, [name]) for name in sorted(sources)
+                if name.rpartition('.')[2].lower() in EXTENSIONS]
+    return [Bundle(name, list(members))
+            for name, members in sorted(bundles.items())]
+
+
+class AssetPipeline(object):
+    """Builds the bundles of the theme into ``output_path``.
+
+    The cache records, per bundle, the ``[mtime_ns, size]`` of the files it
+    was built from and the fingerprinted file written: bundles whose files
+    did not change are not read again.
+    """
+
+    def __init__(self, settings, output_path):
+        self.settings = settings
+        self.output_path = output_path
+        self.static_dir = settings.get('THEME_STATIC_DIR', 'theme')
+        self.cache_file = settings.get('ASSET_CACHE_PATH') or cache_path(
+            settings, 'assets.json')
+        self.minify = settings.get('ASSET_MINIFY', True)
+        self.built = self.reused = 0
+
+    def output(self, name):
+        return os.path.join(self.output_path, self.static_dir,
+                            *name.split('/'))
+
+    def run(self):
+        """Build the bundles, returning the asset manifest."""
+        data = load_json(self.cache_file, {})
+        previous = {}
+        if data.get('version') == CACHE_VERSION and \
+                data.get('minify') == self.minify:
+            previous = data.get('bundles', {})
+        sources = theme_sources(self.settings)
+        entries = {}
+        manifest = {}
+        for bundle in configured_bundles(self.settings, sources):
+            entry = previous.get(bundle.name)
+            if not self.is_fresh(bundle, entry, sources):
+                entry = self.build(bundle, sources, entry)
+            else:
+                self.reused += 1
+            entries[bundle.name] = entry
+            manifest[posixpath.join(self.static_dir, bundle.name)] = \
+                posixpath.join(self.static_dir, entry['output'])
+        for name, entry in previous.items():
+            if name not in entries:
+                _remove(self.output(entry['output']))
+        dump_json(self.cache_file, {'version': CACHE_VERSION,
+                                    'minify': self.minify,
+                                    'bundles': entries})
+        dump_json(os.path.join(self.output_path, self.static_dir,
+                               'manifest.json'), manifest)
+        return manifest
+
+    def is_fresh(self, bundle, entry, sources):
+        if entry is None or entry['members'] != bundle.members or \
+                not os.path.exists(self.output(entry['output'])):
+            return False
+        try:
+            return all(stat_key(path) == stat
+                       for path, stat in entry['inputs'])
+        except OSError:
+            return False
+
+    def build(self, bundle, sources, previous=None):
+        text, inputs = bundle.build(sources, self.minify)
+        data = text.encode('utf-8')
+        name = bundle.fingerprinted(sha256_bytes(data))
+        atomic_write(self.output(name), data)
+        if previous and previous['output'] != name:
+            _remove(self.output(previous['output']))
+        self.built += 1
+        logger.debug('Built %s as %s', bundle.name, name)
+        return {'members': bundle.members, 'output': name,
+                'inputs': [[path, stat_key(path)] for path in inputs]}
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def rewrite(html, manifest, page, siteurl=''):
+    """Return ``html`` with the ``href`` and ``src`` attributes pointing to
+    a file of ``manifest`` pointing to its fingerprinted copy instead.
+
+    ``page`` is the path of the page relative to the output directory,
+    against which relative URLs are resolved.
+    """
+    siteurl = siteurl.rstrip('/')
+    site_path = re.sub(r'^[a-z][a-z0-9+.-]*://[^/]*', '', siteurl)
+    directory = posixpath.dirname(page)
+
+    def replace(m):
+        url = m.group(2)
+        if siteurl and url.startswith(siteurl + '/'):
+            target = url[len(siteurl) + 1:]
+        elif url.startswith('/') and not url.startswith('//'):
+            if site_path and not url.startswith(site_path + '/'):
+                return m.group()
+            target = url[len(site_path) + 1:]
+        elif _is_local(url):
+            target = posixpath.normpath(posixpath.join(directory, url))
+        else:
+            return m.group()
+        fingerprinted = manifest.get(target)
+        if fingerprinted is None:
+            return m.group()
+        return m.group(1) + url[:url.rfind('/') + 1] + \
+            posixpath.basename(fingerprinted)
+    return _reference.sub(replace, html)
+
+
+class _RewrittenFile(io.StringIO):
+    """Collects a page, written to ``target`` with its asset references
+    rewritten on close."""
+
+    def __init__(self, target, manifest, page, siteurl):
+        super(_RewrittenFile, self).__init__()
+        self.target = target
+        self.manifest = manifest
+        self.page = page
+        self.siteurl = siteurl
+
+    def close(self):
+        if not self.closed:
+            html = self.getvalue()
+            super(_RewrittenFile, self).close()
+            try:
+                self.target.write(rewrite(html, self.manifest, self.page,
+                                          self.siteurl))
+            finally:
+                self.target.close()
+
+
+class AssetWriter(Writer):
+    """Writer rewriting the references to the theme assets of HTML
+    pages."""
+
+    writer_priority = 12
+
+    def _open_w(self, filename, encoding, override=False):
+        f = super(AssetWriter, self)._open_w(filename, encoding,
+                                             override=override)
+        manifest = self.settings.get('ASSETS')
+        if manifest and filename.rpartition('.')[2].lower() in \
+                ('html', 'htm'):
+            page = os.path.relpath(filename, self.output_path)
+            return _RewrittenFile(f, manifest, page.replace(os.sep, '/'),
+                                  self.settings.get('SITEURL', ''))
+        return f
+
+
+def build_assets(generators):
+    if not generators:
+        return
+    generator = generators[0]
+    pipeline = AssetPipeline(generator.settings, generator.output_path)
+    manifest = pipeline.run()
+    logger.info('Assets: %d bundles built, %d unchanged', pipeline.built,
+                pipeline.reused)
+    # as a setting, the manifest is an input of every page for the
+    # incremental writer
+    generator.settings['ASSETS'] = manifest
+    generator.context['ASSETS'] = manifest
+
+
+def register():
+    from pelican import signals
+    from pelican_tools import writer
+    writer.use(AssetWriter)
+    signals.all_generators_finalized.connect(build_assets)
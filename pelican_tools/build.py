@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Build the site, optionally as a new release switched to atomically.
+
+With ``--atomic``, the output directory is a symbolic link to the current
+release in a releases directory (``OUTPUT_PATH-releases`` by default, see
+``ATOMIC_RELEASES_PATH``). The site is built in ``.staging`` there, seeded
+with hard links to the files of the current release so that the build only
+writes what changed, then the staging directory becomes a new release and
+the link is replaced in a single rename: a web server serving the output
+directory never sees a partially written site.
+
+The last ``--keep`` releases are kept (``ATOMIC_KEEP_RELEASES``, 5 by
+default) and ``--rollback`` switches back to the previous one.
+
+Since the staging directory always has the same path, the caches of the
+other pelican-tools plugins stay valid between releases. Files shared with
+the current release are removed before Pelican rewrites them, see
+:mod:`pelican_tools.cas`.
+"""
+from __future__ import print_function, unicode_literals
+
+import logging
+import os
+import shutil
+import time
+
+from pelican_tools.compat import replace
+from pelican_tools.utils import (add_settings_arguments, enable_plugins,
+                                 makedirs, read_settings, run_pelican,
+                                 settings_source)
+
+logger = logging.getLogger(__name__)
+
+STAGING = '.staging'
+
+
+def link_tree(source, destination):
+    """Make ``destination`` a copy of the ``source`` directory made of hard
+    links, copying the files which cannot be linked."""
+    for dirpath, dirnames, filenames in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(dirpath, source))
+        makedirs(target)
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(target, name))
+                if name in dirnames:
+                    dirnames.remove(name)
+            elif name in filenames:
+                try:
+                    os.link(path, os.path.join(target, name))
+                except OSError:
+                    shutil.copy2(path, os.path.join(target, name))
+
+
+def release_key(name):
+    """Sort key of the release ``name``: releases made in the same second
+    are numbered from 2 (``20240101T120000-2``), in order."""
+    base, dash, suffix = name.rpartition('-')
+    if dash and suffix.isdigit():
+        return base, int(suffix)
+    return name, 1
+
+
+class Releases(object):
+    """Releases of the output directory ``output``, kept in ``directory``."""
+
+    def __init__(self, output, directory=None):
+        self.output = os.path.abspath(output).rstrip(os.sep)
+        self.directory = os.path.abspath(directory or
+                                         self.output + '-releases')
+        self.staging = os.path.join(self.directory, STAGING)
+
+    def list(self):
+        """Return the names of the releases, oldest first."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted((name for name in names if not name.startswith('.') and
+                       os.path.isdir(os.path.join(self.directory, name))),
+                      key=release_key)
+
+    def current(self):
+        """Return the name of the release the output links to, or None."""
+        if not os.path.islink(self.output):
+            return None
+        target = os.path.realpath(self.output)
+        if os.path.dirname(target) != os.path.realpath(self.directory):
+            return None
+        return os.path.basename(target)
+
+    def stage(self):
+        """Return a staging directory holding links to the current
+        output."""
+        if os.path.lexists(self.staging):
+            logger.info('Removing the staging directory of an interrupted '
+                        'build')
+            shutil.rmtree(self.staging)
+        makedirs(self.directory)
+        if os.path.isdir(self.output):
+            start = time.time()
+            link_tree(os.path.realpath(self.output), self.staging)
+            logger.info('Seeded %s in %.2fs', self.staging,
+                        time.time() - start)
+        else:
+            makedirs(self.staging)
+        return self.staging
+
+    def _new_name(self):
+        name = base = time.strftime('%Y%m%dT%H%M%S')
+        suffix = 1
+        while os.path.exists(os.path.join(self.directory, name)):
+            suffix += 1
+            name = '%s-%d' % (base, suffix)
+        return name
+
+    def publish(self):
+        """Make the staging directory a release and switch to it, returning
+        its name."""
+        if os.path.isdir(self.output) and not os.path.islink(self.output):
+            # a directory cannot be replaced by a link atomically: keep it
+            # as the first release
+            first = self._new_name()
+            logger.warning('Moving the output directory to %s',
+                           os.path.join(self.directory, first))
+            os.rename(self.output, os.path.join(self.directory, first))
+        name = self._new_name()
+        os.rename(self.staging, os.path.join(self.directory, name))
+        self.switch(name)
+        return name
+
+    def switch(self, name):
+        """Point the output to the release ``name`` in one rename."""
+        link = os.path.join(os.path.dirname(self.output),
+                            '.tmp-%s' % os.path.basename(self.output))
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.relpath(os.path.join(self.directory, name),
+                                   os.path.dirname(self.output)), link)
+        replace(link, self.output)
+
+    def prune(self, keep):
+        """Remove the releases but the ``keep`` last ones and the current
+        one, returning their names."""
+        current = self.current()
+        removed = []
+        for name in self.list()[:-keep] if keep > 0 else self.list():
+            if name != current:
+                shutil.rmtree(os.path.join(self.directory, name))
+                removed.append(name)
+        return removed
+
+    def rollback(self):
+        """Switch to the release before the current one, returning its
+        name."""
+        names = self.list()
+        current = self.current()
+        if current not in names or names.index(current) == 0:
+            raise ValueError('No release before %s' % current)
+        name = names[names.index(current) - 1]
+        self.switch(name)
+        return name
+
+
+def register():
+    # the files of the staging directory are links to the current release
+    from pelican import signals
+    from pelican_tools import cas, writer
+    writer.use(cas.UnsharingWriter)
+    signals.all_generators_finalized.connect(cas.unshare_static)
+
+
+def setup_parser(parser):
+    add_settings_arguments(parser)
+    parser.add_argument('--atomic', action='store_true',
+                        help='Build a new release and switch the output '
+                        'directory to it when done.')
+    parser.add_argument('--releases',
+                        help='Releases directory (default: '
+                        'ATOMIC_RELEASES_PATH or OUTPUT_PATH-releases).')
+    parser.add_argument('--keep', type=int,
+                        help='Number of releases to keep (default: '
+                        'ATOMIC_KEEP_RELEASES or 5).')
+    parser.add_argument('--rollback', action='store_true',
+                        help='Switch back to the previous release, without '
+                        'building.')
+    parser.set_defaults(func=command)
+
+
+def command(args):
+    config, overrides = settings_source(args)
+    settings = read_settings(config, overrides)
+    if not (args.atomic or args.rollback):
+        run_pelican(settings)
+        return 0
+
+    releases = Releases(settings['OUTPUT_PATH'], args.releases or
+                        settings.get('ATOMIC_RELEASES_PATH'))
+    if args.rollback:
+        try:
+            name = releases.rollback()
+        except ValueError as e:
+            logger.error('%s', e)
+            return 1
+        print('Switched %s to %s' % (releases.output, name))
+        return 0
+
+    # settings derived from the output path must see the staging directory
+    overrides['OUTPUT_PATH'] = releases.stage()
+    settings = enable_plugins(read_settings(config, overrides),
+                              'pelican_tools.build')
+    try:
+        run_pelican(settings)
+    except Exception:
+        logger.error('Build failed, %s still points to %s', releases.output,
+                     releases.current())
+        raise
+    name = releases.publish()
+    print('Switched %s to %s' % (releases.output, name))
+    keep = args.keep if args.keep is not None else settings.get(
+        'ATOMIC_KEEP_RELEASES', 5)
+    for removed in releases.prune(keep):
+        logger.info('Removed release %s', removed)
+    return 0
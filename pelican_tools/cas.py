@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""Store identical output files once, as links to a content-addressed store.
+
+Multilingual sites and sites built with copies of the same theme have many
+byte-identical output files. ``pelican-tools dedupe`` replaces the files of
+existing output directories by hard links (or reflinks, copy-on-write clones
+on Btrfs, XFS and APFS-like filesystems) to blobs stored once under their
+SHA-256 in ``cache/pelican-tools/blobs``; adding ``pelican_tools.cas`` to
+``PLUGINS`` does it for the output of every build.
+
+Hard links share their content: a program truncating and rewriting one of
+the files in place would change all of them. The plugin makes Pelican
+remove the linked files it is about to write or copy first, and the
+pelican-tools writers replace files instead of rewriting them, but other
+tools writing to the output directory should use ``CAS_LINK = 'reflink'``,
+whose clones are independent files.
+
+The digests of the output files are kept in ``cache/pelican-tools/cas.json``,
+so unchanged files are not read again.
+"""
+from __future__ import print_function, unicode_literals
+
+import errno
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from pelican.writers import Writer
+
+from pelican_tools.compat import replace
+from pelican_tools.utils import (HashCache, cache_path, iter_files, makedirs,
+                                 sha256_file, stat_key)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LINK_MODES = ('hardlink', 'reflink')
+
+#: ``ioctl`` request cloning a file on Linux.
+FICLONE = 0x40049409
+
+
+def reflink(source, destination):
+    """Make ``destination`` a copy-on-write clone of ``source``."""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported')
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except (IOError, OSError):
+                os.remove(destination)
+                raise
+
+
+def _temporary(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.tmp-cas-%d-%s' % (os.getpid(), name))
+
+
+class BlobStore(object):
+    """Files named after their SHA-256, in subdirectories named after its
+    first two characters."""
+
+    def __init__(self, directory, mode='hardlink'):
+        if mode not in LINK_MODES:
+            raise ValueError('Unknown link mode %r' % mode)
+        self.directory = directory
+        self.mode = mode
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _clone(self, source, destination):
+        tmp = _temporary(destination)
+        if self.mode == 'hardlink':
+            os.link(source, tmp)
+        else:
+            reflink(source, tmp)
+        try:
+            replace(tmp, destination)
+        except OSError:
+            os.remove(tmp)
+            raise
+
+    def is_linked(self, path, digest):
+        """Return True if ``path`` is a hard link to the blob ``digest``."""
+        try:
+            return os.path.samefile(path, self.path(digest))
+        except OSError:
+            return False
+
+    def link(self, path, digest):
+        """Make ``path`` share the blob ``digest``, storing its content if
+        the blob does not exist yet.
+
+        Return True if an existing blob was used.
+        """
+        blob = self.path(digest)
+        if not os.path.exists(blob):
+            makedirs(os.path.dirname(blob))
+            self._clone(path, blob)
+            return False
+        if self.mode == 'hardlink' and os.path.samefile(path, blob):
+            return False
+        st = os.stat(path)
+        self._clone(blob, path)
+        if self.mode == 'reflink':
+            os.utime(path, (st.st_atime, st.st_mtime))
+        return True
+
+    def prune(self):
+        """Remove the hard-linked blobs which are not linked from anywhere
+        any more, returning their number and size."""
+        count = size = 0
+        if self.mode != 'hardlink':
+            return count, size
+        for path in iter_files(self.directory):
+            if len(os.path.basename(path)) != 64:
+                continue  # not a blob
+            st = os.stat(path)
+            if st.st_nlink == 1:
+                os.remove(path)
+                count += 1
+                size += st.st_size
+        return count, size
+
+
+class Deduplicator(object):
+    """Links the files of output directories to a :class:`BlobStore`."""
+
+    def __init__(self, store, cache_file=None, jobs=None, min_size=1):
+        self.store = store
+        self.hashes = HashCache(cache_file)
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.min_size = min_size
+        self.stats = dict.fromkeys(('files', 'linked', 'stored', 'shared',
+                                    'errors', 'bytes_saved'), 0)
+
+    def is_fresh(self, path, key):
+        """Return True if ``path`` is known to share its blob already."""
+        entry = self.hashes.entries.get(path)
+        if entry is None or entry[:2] != key:
+            return False
+        return self.store.mode == 'reflink' or \
+            self.store.is_linked(path, entry[2])
+
+    def run(self, roots):
+        pending = []
+        for root in roots:
+            root = os.path.abspath(root)
+            for path in iter_files(root):
+                if path.startswith(os.path.join(self.store.directory, '')):
+                    continue
+                self.stats['files'] += 1
+                try:
+                    key = stat_key(path)
+                except OSError:
+                    continue
+                if key[1] < self.min_size:
+                    continue
+                if self.is_fresh(path, key):
+                    self.stats['shared'] += 1
+                else:
+                    pending.append((path, key))
+        with ThreadPoolExecutor(self.jobs) as pool:
+            digests = pool.map(lambda item: self._digest(*item), pending)
+            for (path, key), digest in zip(pending, digests):
+                if digest is not None:
+                    self._link(path, key, digest)
+        return self.stats
+
+    def _digest(self, path, key):
+        entry = self.hashes.entries.get(path)
+        if entry is not None and entry[:2] == key:
+            return entry[2]
+        try:
+            return sha256_file(path)
+        except (IOError, OSError) as e:
+            logger.warning('Cannot read %s: %s', path, e)
+            self.stats['errors'] += 1
+            return None
+
+    def _link(self, path, key, digest):
+        try:
+            if self.store.link(path, digest):
+                self.stats['linked'] += 1
+                self.stats['bytes_saved'] += key[1]
+            else:
+                self.stats['stored'] += 1
+            self.hashes.entries[path] = stat_key(path) + [digest]
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                raise RuntimeError('The store %s must be on the same '
+                                   'filesystem as %s' % (
+                                       self.store.directory, path))
+            logger.warning('Cannot link %s: %s', path, e)
+            self.stats['errors'] += 1
+
+    def forget_missing(self):
+        for path in list(self.hashes.entries):
+            if not os.path.exists(path):
+                self.hashes.discard(path)
+
+    def save(self):
+        if self.hashes.path:
+            self.hashes.save()
+
+    def summary(self):
+        return ('%(files)d files: %(linked)d linked to existing blobs '
+                '(%(bytes_saved)d bytes saved), %(stored)d new blobs, '
+                '%(shared)d already shared' % self.stats)
+
+
+def store_path(settings):
+    return os.path.abspath(settings.get('CAS_PATH') or
+                           cache_path(settings, 'blobs'))
+
+
+def get_deduplicator(settings):
+    store = BlobStore(store_path(settings),
+                      settings.get('CAS_LINK', 'hardlink'))
+    return Deduplicator(
+        store,
+        settings.get('CAS_CACHE_PATH') or cache_path(settings, 'cas.json'),
+        settings.get('CAS_JOBS'), settings.get('CAS_MIN_SIZE', 1))
+
+
+def unshare(path):
+    """Remove ``path`` if it is a hard link, so that writing it does not
+    change the other links."""
+    try:
+        if os.lstat(path).st_nlink > 1:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+class UnsharingWriter(Writer):
+    """Writer removing hard-linked output files before writing them."""
+
+    writer_priority = 30
+
+    def _open_w(self, filename, encoding, override=False):
+        unshare(filename)
+        return super(UnsharingWriter, self)._open_w(filename, encoding,
+                                                    override=override)
+
+
+def unshare_static(generators):
+    """Remove the hard-linked theme and static files Pelican will copy
+    over."""
+    if not generators:
+        return
+    from pelican_tools.assets import theme_sources
+    settings = generators[0].settings
+    output_path = generators[0].output_path
+    static_dir = settings.get('THEME_STATIC_DIR', 'theme')
+    for name in theme_sources(settings):
+        unshare(os.path.join(output_path, static_dir, *name.split('/')))
+    for generator in generators:
+        if not hasattr(generator, '_file_update_required'):
+            continue
+        for staticfile in generator.context.get('staticfiles', ()):
+            if generator._file_update_required(staticfile):
+                unshare(os.path.join(output_path, staticfile.save_as))
+
+
+def deduplicate(pelican):
+    from pelican_tools import writer
+    writer.drain()
+    deduplicator = get_deduplicator(pelican.settings)
+    deduplicator.run([pelican.output_path])
+    deduplicator.forget_missing()
+    deduplicator.save()
+    logger.info('Deduplicated the output: %s', deduplicator.summary())
+
+
+def register():
+    from pelican import signals
+    from pelican_tools import writer
+    writer.use(UnsharingWriter)
+    signals.all_generators_finalized.connect(unshare_static)
+    signals.finalized.connect(deduplicate)
+
+
+def setup_parser(parser):
+    parser.add_argument('outputs', nargs='+', metavar='OUTPUT',
+                        help='Output directories.')
+    parser.add_argument('--store',
+                        help='Blob store directory, on the same filesystem '
+                        'as the output directories (default: '
+                        'cache/pelican-tools/blobs).')
+    parser.add_argument('--reflink', action='store_const', const='reflink',
+                        dest='mode', default='hardlink',
+                        help='Make copy-on-write clones instead of hard '
+                        'links.')
+    parser.add_argument('--min-size', type=int, default=1,
+                        help='Leave smaller files alone (default: '
+                        '%(default)s byte).')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Number of hashing threads (default: the '
+                        'number of cores).')
+    parser.add_argument('--prune', action='store_true',
+                        help='Then remove the blobs no file links to.')
+    parser.set_defaults(func=command)
+
+
+def command(args):
+    store = BlobStore(os.path.abspath(args.store or
+                                      cache_path({}, 'blobs')), args.mode)
+    deduplicator = Deduplicator(store, os.path.join(store.directory,
+                                                    'cas.json'),
+                                args.jobs, args.min_size)
+    try:
+        deduplicator.run(args.outputs)
+    except RuntimeError as e:
+        logger.error('%s', e)
+        return 1
+    deduplicator.forget_missing()
+    deduplicator.save()
+    print(deduplicator.summary())
+    if args.prune:
+        print('%d unused blobs removed (%d bytes)' % store.prune())
+    return 1 if deduplicator.stats['errors'] else 0
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""The ``pelican-tools`` command, giving access to the tools as
+sub-commands."""
+from __future__ import unicode_literals
+
+import argparse
+import importlib
+import logging
+import sys
+
+#: Sub-command name and the module implementing it. Each module provides a
+#: ``setup_parser(parser)`` function setting ``func`` as parser default.
+COMMANDS = [
+    ('build', 'pelican_tools.build'),
+    ('dedupe', 'pelican_tools.cas'),
+    ('depgraph', 'pelican_tools.depgraph'),
+    ('gc', 'pelican_tools.gc'),
+    ('index', 'pelican_tools.index'),
+    ('minify', 'pelican_tools.minify'),
+    ('read', 'pelican_tools.parallel_read'),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pelican-tools',
+        description='Tools for the Pelican static site generator.')
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        const=logging.INFO, dest='verbosity',
+                        default=logging.WARNING, help='Show all messages.')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    for name, module_name in COMMANDS:
+        module = importlib.import_module(module_name)
+        summary = module.__doc__.strip().splitlines()[0]
+        module.setup_parser(subparsers.add_parser(
+            name, help=summary, description=module.__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter))
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 2
+    logging.basicConfig(level=args.verbosity,
+                        format='%(levelname)s: %(message)s')
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
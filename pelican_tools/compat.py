@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Small helpers smoothing over Python 2 / Python 3 differences."""
+from __future__ import unicode_literals
+
+import os
+import sys
+
+PY2 = sys.version_info[0] == 2
+
+if PY2:  # pragma: no cover
+    import Queue as queue  # noqa: F401
+    text_type = unicode  # noqa: F821
+    string_types = (str, unicode)  # noqa: F821
+else:
+    import queue  # noqa: F401
+    text_type = str
+    string_types = (str,)
+
+#: Atomically move ``src`` over ``dst`` (``os.rename`` is atomic on POSIX).
+replace = getattr(os, 'replace', os.rename)
+
+
+def mtime_ns(st):
+    """Return the modification time of a ``stat`` result in nanoseconds."""
+    try:
+        return st.st_mtime_ns
+    except AttributeError:  # pragma: no cover
+        return int(st.st_mtime * 1e9)
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""Write precompressed ``.gz`` and ``.br`` sidecars of output files.
+
+Web servers such as nginx (``gzip_static`` and ``brotli_static``) serve
+``page.html.gz`` instead of compressing ``page.html`` on every request.
+``pelican-precompress`` writes these sidecars for the text files of an
+output directory in a pool of processes, or the ``pelican_tools.compress``
+plugin does it at the end of every build.
+
+The SHA-256 of every compressed file and the compression settings are
+recorded in ``cache/pelican-tools/compress.json``: files whose sidecars were
+made from the same content with the same settings are skipped, and files
+are only read again when their size or modification time changed. Files
+smaller than ``min_size`` get no sidecar, and neither do those for which
+the sidecar would not be smaller than ``max_ratio`` times the original.
+
+Options can be set per extension with the ``PRECOMPRESS`` setting::
+
+    PRECOMPRESS = {
+        'html': {'min_size': 512},
+        'svg': {'formats': ['gz']},
+        'woff2': None,           # never compress
+    }
+
+Brotli sidecars need the ``brotli`` package.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import gzip
+import io
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pelican_tools.compat import mtime_ns
+from pelican_tools.utils import (atomic_write, cache_path, dump_json,
+                                 iter_files, load_json, sha256_bytes)
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+#: Bumped when the cache format changes.
+CACHE_VERSION = 1
+
+#: Options used for every extension, unless overridden.
+DEFAULT_OPTIONS = {
+    'formats': ['gz', 'br'],
+    'min_size': 256,
+    'max_ratio': 0.95,
+    'gzip_level': 9,
+    'brotli_quality': 9,
+}
+
+#: Extensions compressed by default.
+DEFAULT_EXTENSIONS = ('html', 'htm', 'css', 'js', 'mjs', 'json', 'xml',
+                      'atom', 'rss', 'svg', 'txt', 'map', 'ico', 'wasm')
+
+#: Number of files sent to a worker process at once.
+CHUNK_SIZE = 16
+
+
+def compress_gzip(data, options):
+    if options.get('gzip') == 'zopfli':
+        from pelican_tools.compress_max import zopfli_gzip
+        return zopfli_gzip(data, options)
+    f = io.BytesIO()
+    # no file name and a null timestamp, for reproducible sidecars
+    with gzip.GzipFile(filename='', mode='wb', fileobj=f,
+                       compresslevel=options['gzip_level'], mtime=0) as gz:
+        gz.write(data)
+    return f.getvalue()
+
+
+def gzip_key(options, size):
+    if options.get('gzip') == 'zopfli':
+        from pelican_tools.compress_max import zopfli_iterations
+        return 'zopfli-%d' % zopfli_iterations(options, size)
+    return 'gzip-%d' % options['gzip_level']
+
+
+def compress_brotli(data, options):
+    return brotli.compress(data, quality=options['brotli_quality'],
+                           lgwin=options.get('brotli_window', 22))
+
+
+def brotli_key(options, size):
+    key = 'brotli-%d' % options['brotli_quality']
+    if 'brotli_window' in options:
+        key += '-w%d' % options['brotli_window']
+    return key
+
+
+#: Sidecar extension to ``(compress(data, options), settings_key(options,
+#: size))``. The key identifies the options changing the output of the
+#: compressor for a file of ``size`` bytes.
+COMPRESSORS = {
+    'gz': (compress_gzip, gzip_key),
+    'br': (compress_brotli, brotli_key),
+}
+
+#: Compression profiles: ``max`` trades CPU time for smaller sidecars, see
+#: :mod:`pelican_tools.compress_max`.
+PROFILES = ('default', 'max')
+
+
+def available_formats():
+    formats = set(COMPRESSORS)
+    if brotli is None:
+        formats.discard('br')
+    return formats
+
+
+def profile_options(settings, profile):
+    if profile not in PROFILES:
+        raise ValueError('Unknown compression profile %r' % profile)
+    if profile == 'default':
+        return {}
+    from pelican_tools import compress_max
+    options = dict(compress_max.MAX_OPTIONS,
+                   content_cache=compress_max.content_cache_path(settings))
+    if compress_max.zopfli is None:
+        logger.warning('zopfli is not installed, using zlib for the gzip '
+                       'sidecars')
+        del options['gzip']
+    return options
+
+
+def extension_options(settings=None, profile=None):
+    """Return the options of each compressed extension, from the
+    compression ``profile`` (``PRECOMPRESS_PROFILE`` by default) and the
+    ``PRECOMPRESS_DEFAULTS`` and ``PRECOMPRESS`` settings."""
+    settings = settings or {}
+    defaults = dict(DEFAULT_OPTIONS)
+    defaults.update(profile_options(
+        settings, profile or settings.get('PRECOMPRESS_PROFILE', 'default')))
+    defaults.update(settings.get('PRECOMPRESS_DEFAULTS') or {})
+    options = dict((ext, dict(defaults)) for ext in DEFAULT_EXTENSIONS)
+    for ext, overrides in (settings.get('PRECOMPRESS') or {}).items():
+        ext = ext.lstrip('.').lower()
+        if overrides is None:
+            options.pop(ext, None)
+        else:
+            options[ext] = dict(defaults, **overrides)
+    available = available_formats()
+    for ext, opts in options.items():
+        missing = set(opts['formats']) - available
+        if missing:
+            logger.debug('Not writing %s sidecars of .%s files: %s',
+                         ', '.join(sorted(missing)), ext,
+                         'brotli is not installed' if 'br' in missing
+                         else 'unknown format')
+            opts['formats'] = [f for f in opts['formats'] if f in available]
+    return options
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [mtime_ns(st), st.st_size]
+
+
+def compress_file(path, options, previous=None):
+    """Write the sidecars of ``path`` and return its new cache entry.
+
+    ``previous`` is the cache entry of the last run: sidecars made from
+    the same content with the same settings, and left untouched since, are
+    kept. The entry holds the source ``[mtime_ns, size]``, its SHA-256 and,
+    per format, ``[settings key, sidecar stat]`` (the stat being None when
+    no sidecar is kept for the file).
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    st = os.stat(path)
+    digest = sha256_bytes(data)
+    entry = {'stat': [mtime_ns(st), st.st_size], 'sha256': digest,
+             'sidecars': {}, 'bytes': {}}
+    previous = previous or {}
+    same_content = previous.get('sha256') == digest
+    for fmt in options['formats']:
+        compress, settings_key = COMPRESSORS[fmt]
+        key = settings_key(options, len(data))
+        sidecar = '%s.%s' % (path, fmt)
+        recorded = previous.get('sidecars', {}).get(fmt)
+        if same_content and recorded and recorded[0] == key and \
+                recorded[1] == _stat(sidecar):
+            if recorded[1] is not None and \
+                    recorded[1][0] != entry['stat'][0]:
+                # the file was touched: follow its modification time
+                os.utime(sidecar, (st.st_atime, st.st_mtime))
+                recorded = [key, _stat(sidecar)]
+            entry['sidecars'][fmt] = recorded
+            entry['bytes'][fmt] = None  # unchanged
+            continue
+        if len(data) < options['min_size']:
+            compressed = None
+        else:
+            compressed = _compress(compress, data, digest, key, options)
+            if len(compressed) > len(data) * options['max_ratio']:
+                compressed = None
+        if compressed is None:
+            _remove(sidecar)
+            entry['sidecars'][fmt] = [key, None]
+            entry['bytes'][fmt] = (0, 0)
+            continue
+        atomic_write(sidecar, compressed)
+        # serve the sidecar with the modification time of the original
+        os.utime(sidecar, (st.st_atime, st.st_mtime))
+        entry['sidecars'][fmt] = [key, _stat(sidecar)]
+        entry['bytes'][fmt] = (len(data), len(compressed))
+    return entry
+
+
+def _compress(compress, data, digest, key, options):
+    """Compress ``data``, through the content cache if the options have
+    one."""
+    if not options.get('content_cache'):
+        return compress(data, options)
+    from pelican_tools.compress_max import ContentCache
+    cache = ContentCache(options['content_cache'])
+    compressed = cache.get(digest, key)
+    if compressed is None:
+        compressed = compress(data, options)
+        cache.put(digest, key, compressed)
+    return compressed
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _compress_chunk(items):
+    results = []
+    for rel, path, options, previous in items:
+        try:
+            results.append((rel, compress_file(path, options, previous)))
+        except (IOError, OSError) as e:
+            logger.warning('Cannot compress %s: %s', path, e)
+            results.append((rel, None))
+    return results
+
+
+class Precompressor(object):
+    """Writes the sidecars of the files of ``output_path`` which need
+    them, recording what was done in the JSON cache ``cache_file``."""
+
+    def __init__(self, output_path, options, cache_file, jobs=None):
+        self.output_path = os.path.abspath(output_path)
+        self.options = options
+        self.cache_file = cache_file
+        self.jobs = jobs or multiprocessing.cpu_count()
+        data = load_json(cache_file, {}) if cache_file else {}
+        if data.get('version') == CACHE_VERSION and \
+                data.get('output_path') == self.output_path:
+            self.entries = data.get('files', {})
+        else:
+            self.entries = {}
+        self.stats = dict.fromkeys(('compressed', 'unchanged', 'skipped',
+                                    'removed', 'errors'), 0)
+        self.sizes = dict((fmt, [0, 0]) for fmt in COMPRESSORS)
+
+    def is_fresh(self, rel, path, options):
+        """Return True if the sidecars of ``path`` are up to date, without
+        reading it."""
+        entry = self.entries.get(rel)
+        if entry is None or entry['stat'] != _stat(path):
+            return False
+        sidecars = entry['sidecars']
+        if sorted(sidecars) != sorted(options['formats']):
+            return False
+        for fmt, (key, stat) in sidecars.items():
+            if key != COMPRESSORS[fmt][1](options, entry['stat'][1]) or \
+                    stat != _stat('%s.%s' % (path, fmt)):
+                return False
+        return True
+
+    def pending(self):
+        """Return the ``(rel, path, options, previous entry)`` of the files
+        to compress, forgetting the files which disappeared."""
+        seen = set()
+        items = []
+        extensions = set(self.options)
+        for path in iter_files(self.output_path, extensions):
+            options = self.options[path.rpartition('.')[2]]
+            rel = os.path.relpath(path, self.output_path)
+            seen.add(rel)
+            if not options['formats']:
+                continue
+            if self.is_fresh(rel, path, options):
+                self.stats['unchanged'] += 1
+                continue
+            items.append((rel, path, options, self.entries.get(rel)))
+        for rel in set(self.entries) - seen:
+            entry = self.entries.pop(rel)
+            path = os.path.join(self.output_path, rel)
+            for fmt, (key, stat) in entry['sidecars'].items():
+                sidecar = '%s.%s' % (path, fmt)
+                if stat is not None and stat == _stat(sidecar):
+                    _remove(sidecar)
+            self.stats['removed'] += 1
+        return items
+
+    def run(self):
+        items = self.pending()
+        chunks = [items[i:i + CHUNK_SIZE]
+                  for i in range(0, len(items), CHUNK_SIZE)]
+        if self.jobs > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(self.jobs) as pool:
+                for results in pool.map(_compress_chunk, chunks):
+                    self._record(results)
+        else:
+            for chunk in chunks:
+                self._record(_compress_chunk(chunk))
+        if self.cache_file:
+            dump_json(self.cache_file, {'version': CACHE_VERSION,
+                                        'output_path': self.output_path,
+                                        'files': self.entries})
+        return self.stats
+
+    def _record(self, results):
+        for rel, entry in results:
+            if entry is None:
+                self.entries.pop(rel, None)
+                self.stats['errors'] += 1
+                continue
+            sizes = entry.pop('bytes')
+            self.entries[rel] = entry
+            written = [s for s in sizes.values() if s is not None and s[1]]
+            if written:
+                self.stats['compressed'] += 1
+            elif all(s is None for s in sizes.values()):
+                self.stats['unchanged'] += 1
+            else:
+                self.stats['skipped'] += 1
+            for fmt, size in sizes.items():
+                if size is not None and size[1]:
+                    self.sizes[fmt][0] += size[0]
+                    self.sizes[fmt][1] += size[1]
+
+    def summary(self):
+        lines = ['%(compressed)d files compressed, %(unchanged)d up to date, '
+                 '%(skipped)d too small or incompressible, %(removed)d '
+                 'removed' % self.stats]
+        for fmt, (original, compressed) in sorted(self.sizes.items()):
+            if original:
+                lines.append('%s: %d bytes compressed to %d (%.1f%%)' % (
+                    fmt, original, compressed, 100.0 * compressed / original))
+        return lines
+
+
+def compress_cache_path(settings):
+    return settings.get('PRECOMPRESS_CACHE_PATH') or cache_path(
+        settings, 'compress.json')
+
+
+def precompress(pelican):
+    from pelican_tools import writer
+    writer.drain()
+    settings = pelican.settings
+    start = time.time()
+    compressor = Precompressor(pelican.output_path,
+                               extension_options(settings),
+                               compress_cache_path(settings),
+                               settings.get('PRECOMPRESS_JOBS'))
+    compressor.run()
+    logger.info('Precompressed the output in %.2fs: %s', time.time() - start,
+                '; '.join(compressor.summary()))
+
+
+def register():
+    from pelican import signals
+    signals.finalized.connect(precompress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pelican-precompress',
+        description='Write .gz and .br sidecars of the text files of a '
+        'Pelican output directory, for web servers serving precompressed '
+        'files.')
+    parser.add_argument('output', nargs='?',
+                        help='Output directory (default: OUTPUT_PATH of the '
+                        'settings, or output).')
+    parser.add_argument('-s', '--settings',
+                        help='Pelican settings file to read the PRECOMPRESS '
+                        'settings and the output and cache paths from.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Number of processes (default: the number of '
+                        'cores).')
+    parser.add_argument('--profile', choices=PROFILES,
+                        help='Compression profile: max uses zopfli and '
+                        'brotli quality 11 (default: PRECOMPRESS_PROFILE or '
+                        'default).')
+    parser.add_argument('--formats',
+                        help='Comma separated sidecar formats (default: '
+                        'gz,br).')
+    parser.add_argument('--min-size', type=int,
+                        help='Do not compress smaller files (bytes).')
+    parser.add_argument('--max-ratio', type=float,
+                        help='Do not keep sidecars larger than this ratio '
+                        'of the original size.')
+    parser.add_argument('--cache',
+                        help='Cache file (default: compress.json in the '
+                        'pelican-tools cache directory).')
+    parser.add_argument('--force', action='store_true',
+                        help='Compress every file again.')
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        const=logging.INFO, dest='verbosity',
+                        default=logging.WARNING, help='Show all messages.')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.verbosity,
+                        format='%(levelname)s: %(message)s')
+
+    settings = {}
+    if args.settings:
+        from pelican_tools.utils import read_settings
+        settings = read_settings(args.settings)
+    overrides = dict(settings.get('PRECOMPRESS_DEFAULTS') or {})
+    if args.formats:
+        overrides['formats'] = [f.strip() for f in args.formats.split(',')
+                                if f.strip()]
+        unknown = set(overrides['formats']) - set(COMPRESSORS)
+        if unknown:
+            parser.error('unknown formats: %s' % ', '.join(sorted(unknown)))
+    if args.min_size is not None:
+        overrides['min_size'] = args.min_size
+    if args.max_ratio is not None:
+        overrides['max_ratio'] = args.max_ratio
+    settings = dict(settings, PRECOMPRESS_DEFAULTS=overrides)
+
+    output = args.output or settings.get('OUTPUT_PATH') or 'output'
+    if not os.path.isdir(output):
+        parser.error('%s is not a directory' % output)
+    cache_file = args.cache or compress_cache_path(settings)
+    if args.force and os.path.exists(cache_file):
+        os.remove(cache_file)
+
+    start = time.time()
+    compressor = Precompressor(output,
+                               extension_options(settings, args.profile),
+                               cache_file, args.jobs)
+    stats = compressor.run()
+    for line in compressor.summary():
+        print(line)
+    print('Done in %.2fs with %d processes' % (
+        time.time() - start, compressor.jobs))
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
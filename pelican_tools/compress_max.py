@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Maximum-ratio compression for release builds.
+
+The ``max`` profile of :mod:`pelican_tools.compress` (``pelican-precompress
+--profile max`` or ``PRECOMPRESS_PROFILE = 'max'``) writes gzip sidecars
+with zopfli and brotli sidecars at quality 11 with a 16 MB window. They are
+typically 2-5% (gzip) and 5-12% (brotli) smaller than the default ones but
+take about a hundred times more CPU time (see ``benchmarks/compress.py``),
+so the compressed data is also stored in a content-addressed cache
+(``cache/pelican-tools/compressed``, see ``PRECOMPRESS_CONTENT_CACHE_PATH``):
+a file is only compressed again when its content was never compressed with
+the same settings, even if its sidecars or the output directory were
+deleted in the meantime.
+
+zopfli sidecars need the ``zopfli`` package.
+"""
+from __future__ import unicode_literals
+
+import errno
+import io
+import os
+
+from pelican_tools.utils import atomic_write, cache_path
+
+try:
+    import zopfli.gzip
+except ImportError:  # pragma: no cover
+    zopfli = None
+
+#: Options of the ``max`` profile.
+MAX_OPTIONS = {
+    'gzip': 'zopfli',
+    'zopfli_iterations': 15,
+    'brotli_quality': 11,
+    'brotli_window': 24,
+}
+
+#: Files above this size get fewer zopfli iterations, which would otherwise
+#: take minutes for multi-megabyte files.
+LARGE_FILE = 4 * 1024 * 1024
+
+
+def zopfli_iterations(options, size):
+    """Return the number of zopfli iterations used for ``size`` bytes."""
+    iterations = options.get('zopfli_iterations', 15)
+    if size > LARGE_FILE:
+        iterations = min(iterations, 5)
+    return iterations
+
+
+def zopfli_gzip(data, options):
+    """Return ``data`` compressed in a gzip container by zopfli."""
+    if zopfli is None:
+        raise RuntimeError('zopfli is not installed')
+    return zopfli.gzip.compress(
+        data, numiterations=zopfli_iterations(options, len(data)))
+
+
+class ContentCache(object):
+    """Compressed data stored by SHA-256 of the original content and
+    compression settings key.
+
+    Entries are files named after the digest, in subdirectories named after
+    its first two characters. They are written atomically, so processes can
+    share the cache.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest, key):
+        return os.path.join(self.directory, digest[:2],
+                            '%s.%s' % (digest, key))
+
+    def get(self, digest, key):
+        """Return the data stored for ``digest`` and ``key``, or None."""
+        try:
+            with io.open(self.path(digest, key), 'rb') as f:
+                return f.read()
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+    def put(self, digest, key, data):
+        atomic_write(self.path(digest, key), data)
+
+
+def content_cache_path(settings):
+    return settings.get('PRECOMPRESS_CONTENT_CACHE_PATH') or cache_path(
+        settings, 'compressed')
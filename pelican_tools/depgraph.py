@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""Dependency graph between build inputs and output files.
+
+Inputs are identified by node names of the form ``<kind>:<name>``:
+
+* ``source:<path>``: a content source file,
+* ``template:<name>``: a theme template (``template:*`` stands for all of
+  them, when a template loads others dynamically),
+* ``setting:<NAME>``: a setting referenced by a template (``setting:*``
+  stands for all the settings not referenced by any template),
+* ``context:<name>``: a global context variable, such as the list of
+  ``articles`` shown in a sidebar,
+* ``file:<path>``: another file whose data an output shows, such as the
+  size of an image, fingerprinted by its modification time and size.
+
+The graph remembers the fingerprint of every input as of the last build, so
+that it can tell which inputs changed and which outputs they affect.
+"""
+from __future__ import print_function, unicode_literals
+
+import logging
+import os
+
+from pelican_tools.utils import cache_path, dump_json, load_json, sha256_bytes
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('source', 'template', 'setting', 'context', 'file')
+
+
+def node(kind, name):
+    """Return the node name of the input ``name`` of the given ``kind``."""
+    if kind not in KINDS:
+        raise ValueError('Unknown input kind %r' % kind)
+    return '%s:%s' % (kind, name)
+
+
+def split_node(name):
+    kind, _, rest = name.partition(':')
+    return kind, rest
+
+
+class DependencyGraph(object):
+    """Records which inputs each output file was rendered from.
+
+    Fingerprints recorded during a build are kept apart from those of the
+    previous build until :meth:`save`, so that every output rendered in the
+    build can tell which of its inputs changed.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.fingerprints = {}
+        self.outputs = {}
+        self.reasons = {}
+        self._current = {}
+        self._dependents = None
+        if path:
+            self._load(load_json(path, {}))
+
+    def _load(self, data):
+        names = data.get('nodes', [])
+        self.fingerprints = dict(zip(names, data.get('fingerprints', [])))
+        self.outputs = dict((output, [names[i] for i in ids])
+                            for output, ids in data.get('outputs', {}).items())
+        self.reasons = data.get('reasons', {})
+
+    def save(self, path=None):
+        """Store the graph as JSON, node names being interned as indexes."""
+        self.fingerprints.update(self._current)
+        self._current = {}
+        names = sorted(set(self.fingerprints).union(
+            *[set(nodes) for nodes in self.outputs.values()]))
+        index = dict((name, i) for i, name in enumerate(names))
+        dump_json(path or self.path, {
+            'nodes': names,
+            'fingerprints': [self.fingerprints.get(n) for n in names],
+            'outputs': dict((output, [index[n] for n in nodes])
+                            for output, nodes in self.outputs.items()),
+            'reasons': self.reasons,
+        })
+
+    def record(self, output, inputs):
+        """Record that ``output`` was rendered from ``inputs``, a mapping of
+        node name to fingerprint, and return the inputs which changed since
+        it was last rendered."""
+        previous = self.outputs.get(output)
+        if previous is None:
+            changed = ['(new output)']
+        else:
+            changed = sorted(
+                (set(inputs) ^ set(previous)) |
+                set(n for n, fp in inputs.items()
+                    if self.fingerprints.get(n) != fp))
+        self.outputs[output] = sorted(inputs)
+        self.reasons[output] = changed
+        self._current.update(inputs)
+        self._dependents = None
+        return changed
+
+    def add_inputs(self, output, inputs):
+        """Add ``inputs`` to those of ``output``, found while it was written
+        after :meth:`record`."""
+        changed = set(n for n, fp in inputs.items()
+                      if self.fingerprints.get(n) != fp)
+        reasons = self.reasons.get(output, [])
+        if changed and reasons != ['(new output)']:
+            self.reasons[output] = sorted(changed.union(reasons))
+        self.outputs[output] = sorted(set(self.outputs.get(output, ()))
+                                      .union(inputs))
+        self._current.update(inputs)
+        self._dependents = None
+
+    def forget(self, output):
+        self.outputs.pop(output, None)
+        self.reasons.pop(output, None)
+        self._dependents = None
+
+    def inputs(self, output):
+        """Return the inputs of ``output``, grouped by kind."""
+        grouped = dict((kind, []) for kind in KINDS)
+        for name in self.outputs.get(output, ()):
+            kind, rest = split_node(name)
+            grouped.setdefault(kind, []).append(rest)
+        return grouped
+
+    def dependents(self, name):
+        """Return the outputs rendered from the input ``name``."""
+        if self._dependents is None:
+            self._dependents = {}
+            for output, nodes in self.outputs.items():
+                for n in nodes:
+                    self._dependents.setdefault(n, set()).add(output)
+        return set(self._dependents.get(name, ()))
+
+    def changed_inputs(self, fingerprints):
+        """Return the nodes of ``fingerprints`` whose fingerprint differs
+        from the one recorded by the last build."""
+        return sorted(n for n, fp in fingerprints.items()
+                      if self.fingerprints.get(n) != fp)
+
+    def affected(self, changed):
+        """Return the minimal set of outputs to render again when the inputs
+        ``changed`` (node names) change.
+
+        Source paths may be given without the ``source:`` prefix. A changed
+        template affects the outputs of templates loading it dynamically.
+        """
+        outputs = set()
+        for name in changed:
+            kind, rest = split_node(name)
+            if kind not in KINDS:
+                name = node('source', os.path.abspath(name))
+                kind = 'source'
+            outputs |= self.dependents(name)
+            if kind == 'template':
+                outputs |= self.dependents(node('template', '*'))
+            elif kind == 'setting':
+                outputs |= self.dependents(node('setting', '*'))
+        return outputs
+
+    def explain(self, output):
+        """Return the lines describing the inputs of ``output`` and why it
+        was last rendered."""
+        if output not in self.outputs:
+            return ['%s: not recorded by the last build' % output]
+        lines = [output]
+        for kind, names in sorted(self.inputs(output).items()):
+            if names:
+                lines.append('  %s:' % kind)
+                lines.extend('    %s' % name for name in sorted(names))
+        reasons = self.reasons.get(output)
+        if reasons:
+            lines.append('  last rendered because of:')
+            lines.extend('    %s' % reason for reason in reasons)
+        return lines
+
+
+def analyse_template(env, source):
+    """Return the names of the templates referenced by the template
+    ``source`` (None for dynamic references) and of the variables it reads
+    from the context."""
+    from jinja2 import meta
+    ast = env.parse(source)
+    return (list(meta.find_referenced_templates(ast)),
+            sorted(meta.find_undeclared_variables(ast)))
+
+
+def template_dependencies(env, name, analyses=None, _seen=None):
+    """Return ``(templates, variables)`` for the Jinja2 template ``name``:
+    the templates it extends, includes or imports, recursively (``*`` if one
+    of them is loaded dynamically), and the names of the variables they read
+    from the context.
+
+    ``analyses`` maps the SHA-256 of template sources to the result of
+    :func:`analyse_template`, to avoid parsing a template twice.
+    """
+    analyses = analyses if analyses is not None else {}
+    seen = _seen if _seen is not None else set()
+    templates, variables = set([name]), set()
+    if name in seen:
+        return templates, variables
+    seen.add(name)
+    source = env.loader.get_source(env, name)[0]
+    digest = sha256_bytes(source.encode('utf-8'))
+    if digest not in analyses:
+        analyses[digest] = analyse_template(env, source)
+    references, names = analyses[digest]
+    variables.update(names)
+    for ref in references:
+        if ref is None:
+            templates.add('*')
+            continue
+        sub_templates, sub_variables = template_dependencies(
+            env, ref, analyses, seen)
+        templates |= sub_templates
+        variables |= sub_variables
+    return templates, variables
+
+
+def graph_path(settings):
+    return settings.get('DEPGRAPH_PATH') or cache_path(settings,
+                                                       'depgraph.json')
+
+
+def setup_parser(parser):
+    from pelican_tools.utils import add_settings_arguments
+    add_settings_arguments(parser)
+    parser.add_argument('--graph', help='Path of the dependency graph, '
+                        'by default read from the site settings.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--explain', metavar='OUTPUT', nargs='+',
+                       help='Show the inputs of OUTPUT (relative to the '
+                       'output directory) and why it was last rendered.')
+    group.add_argument('--affected', metavar='INPUT', nargs='+',
+                       help='List the outputs rendered from INPUT, a source '
+                       'path or a node such as template:base.html or '
+                       'setting:SITENAME.')
+    parser.set_defaults(func=command)
+
+
+def command(args):
+    if args.graph:
+        path = args.graph
+    else:
+        from pelican_tools.utils import settings_from_args
+        path = graph_path(settings_from_args(args))
+    if not os.path.exists(path):
+        logger.error('No dependency graph at %s, build the site with '
+                     'pelican_tools.incremental first', path)
+        return 1
+    graph = DependencyGraph(path)
+    if args.explain:
+        for output in args.explain:
+            print('\n'.join(graph.explain(output)))
+    else:
+        for output in sorted(graph.affected(args.affected)):
+            print(output)
+    return 0
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""Atom and RSS feeds written incrementally, one entry at a time.
+
+Pelican builds every feed as a list of entries in memory and writes all of
+them on every build, although a build usually changes a handful of
+articles. Add ``pelican_tools.feeds`` to ``PLUGINS`` to write the feeds
+with :class:`FeedWriter` instead: the entries are rendered and streamed to
+the output file one after the other, and each feed keeps a small state file
+in ``cache/pelican-tools/feeds`` (see ``FEED_STATE_PATH``) recording the key
+of its entry set, computed from the settings and from the source, URL,
+metadata, rendered content and summary of each entry, which also change
+when the URLs of the contents an entry links to change. Feeds whose key did
+not change are not rendered again.
+
+``FEED_PAGE_SIZE`` splits the feeds into paged feeds (RFC 5005): the feed
+itself holds the newest entries, between ``FEED_PAGE_SIZE`` and twice as
+many, and links with ``rel="next"`` to archive pages of ``FEED_PAGE_SIZE``
+older entries each, such as ``feeds/all.atom-3.xml``. Archive pages are
+numbered from the oldest one, so that a new article only changes the feed
+itself and, once in a while, adds an archive page. Paged feeds hold every
+entry: ``FEED_MAX_ITEMS`` only applies to feeds which are not paged.
+
+The output is the same as Pelican's. Receivers of the ``feed_generated``
+signal expect the complete feed object, so feeds are left to Pelican when
+another plugin listens to it. Receivers of ``feed_written`` get the feed
+with its entries, for unchanged feeds too: the entries are then kept in
+memory.
+"""
+from __future__ import print_function, unicode_literals
+
+import logging
+import os
+import posixpath
+
+from feedgenerator import Atom1Feed, Rss201rev2Feed
+from feedgenerator.django.utils.xmlutils import SimplerXMLGenerator
+from pelican.utils import (get_relative_path, path_to_url, sanitised_join,
+                           set_date_tzinfo)
+from pelican.writers import Writer
+
+from pelican_tools.incremental.cache import (content_fingerprint, fingerprint,
+                                             settings_fingerprint)
+from pelican_tools.utils import cache_path, dump_json, load_json, stat_key
+
+logger = logging.getLogger(__name__)
+
+#: Bump when the way feed keys are computed changes.
+STATE_VERSION = 2
+
+stats = {'written': 0, 'skipped': 0}
+
+
+class _StreamedFeed(object):
+    """Feed whose latest date is known before its entries are added."""
+
+    latest = None
+
+    def latest_post_date(self):
+        if self.latest is not None:
+            return self.latest
+        return super(_StreamedFeed, self).latest_post_date()
+
+
+class StreamedAtomFeed(_StreamedFeed, Atom1Feed):
+    pass
+
+
+class StreamedRssFeed(_StreamedFeed, Rss201rev2Feed):
+    pass
+
+
+def page_name(path, number):
+    """Return the path of the archive page ``number`` of the feed
+    ``path``."""
+    root, ext = posixpath.splitext(path)
+    return '%s-%d%s' % (root, number, ext)
+
+
+def paginate(elements, size):
+    """Split ``elements``, newest first, into the entries of the feed and
+    of its archive pages, oldest page first."""
+    if not size or len(elements) < 2 * size:
+        return list(elements), []
+    archives = len(elements) // size - 1
+    oldest = list(reversed(elements))
+    pages = [list(reversed(oldest[i * size:(i + 1) * size]))
+             for i in range(archives)]
+    return list(elements[:len(elements) - archives * size]), pages
+
+
+def state_path(settings, path):
+    root = settings.get('FEED_STATE_PATH') or cache_path(settings, 'feeds')
+    return os.path.join(root, *(path + '.json').split('/'))
+
+
+class FeedWriter(Writer):
+    """Writer streaming the feeds and skipping the unchanged ones."""
+
+    writer_priority = 5
+
+    def __init__(self, output_path, settings=None):
+        super(FeedWriter, self).__init__(output_path, settings=settings)
+        self._settings_key = None
+        self._entry_keys = {}
+        stats.update(written=0, skipped=0)
+
+    def write_feed(self, elements, context, path=None, url=None,
+                   feed_type='atom', override_output=False, feed_title=None):
+        from pelican import signals
+        if not path or signals.feed_generated.receivers:
+            return super(FeedWriter, self).write_feed(
+                elements, context, path, url, feed_type, override_output,
+                feed_title)
+        path = path.replace(os.sep, '/')
+        url = url or path
+        self.site_url = context.get(
+            'SITEURL', path_to_url(get_relative_path(path)))
+        self.feed_domain = context.get('FEED_DOMAIN')
+
+        size = self.settings.get('FEED_PAGE_SIZE')
+        if not size:
+            elements = elements[:self.settings['FEED_MAX_ITEMS']]
+        entries, archives = paginate(elements, size)
+        first = self.urljoiner(self.feed_domain, url)
+        urls = [self.urljoiner(self.feed_domain, page_name(url, n))
+                for n in range(1, len(archives) + 1)]
+        # (path, url, entries, links) of the feed and of its archive pages
+        pages = [(path, first, entries,
+                  [('next', urls[-1])] if archives else [])]
+        for i, page in enumerate(archives):
+            links = [('first', first), ('last', urls[0]),
+                     ('previous', urls[i + 1] if i + 1 < len(urls)
+                      else first)]
+            if i:
+                links.append(('next', urls[i - 1]))
+            pages.append((page_name(path, i + 1), urls[i], page, links))
+
+        state_file = state_path(self.settings, path)
+        state = load_json(state_file, {})
+        if state.get('version') != STATE_VERSION:
+            state = {}
+        previous = state.get('pages', {})
+        keys = {}
+        for page_path, page_url, page, links in pages:
+            key = self.page_key(feed_type, feed_title, context, page_url,
+                                page, links)
+            keys[page_path] = key
+            complete_path = sanitised_join(self.output_path, page_path)
+            if previous.get(page_path) == key and \
+                    os.path.exists(complete_path):
+                self._written_files.add(complete_path)
+                stats['skipped'] += 1
+                if signals.feed_written.receivers:
+                    feed = self.new_feed(feed_type, feed_title, context,
+                                         page_url, page)
+                    for entry in page:
+                        self._add_item_to_the_feed(feed, entry)
+                    signals.feed_written.send(complete_path, context=context,
+                                              feed=feed)
+                continue
+            feed = self.write_page(complete_path, feed_type, feed_title,
+                                   context, page_url, page, links,
+                                   override_output)
+            signals.feed_written.send(complete_path, context=context,
+                                      feed=feed)
+            stats['written'] += 1
+        for page_path in set(previous) - set(keys):
+            try:
+                os.remove(sanitised_join(self.output_path, page_path))
+            except OSError:
+                pass
+        if keys != previous:
+            dump_json(state_file, {'version': STATE_VERSION, 'pages': keys})
+
+    def page_key(self, feed_type, feed_title, context, url, entries, links):
+        """Return the key of a feed page from its entries and settings."""
+        if self._settings_key is None:
+            self._settings_key = settings_fingerprint(self.settings)
+        return fingerprint(
+            self._settings_key, feed_type, feed_title, self.site_url,
+            context.get('SITENAME'), context.get('SITESUBTITLE'), url, links,
+            [self.entry_key(entry) for entry in entries])
+
+    def entry_key(self, entry):
+        # the content is rendered with the site URL of the feed
+        cache_key = (id(entry), self.site_url)
+        key = self._entry_keys.get(cache_key)
+        if key is None:
+            try:
+                source = stat_key(entry.source_path)
+            except (AttributeError, OSError):
+                source = None
+            # links to other contents are only resolved in the rendered
+            # content, which is cached by Pelican for the feed pages
+            rendered = fingerprint(entry.get_content(self.site_url),
+                                   getattr(entry, 'summary', None))
+            key = self._entry_keys[cache_key] = [
+                source, content_fingerprint(entry), rendered]
+        return key
+
+    def new_feed(self, feed_type, feed_title, context, url, entries):
+        """Return the feed of a page, without its entries."""
+        self.feed_url = url
+        feed = self._create_new_feed(feed_type, feed_title, context)
+        feed.__class__ = (StreamedRssFeed if feed_type == 'rss'
+                          else StreamedAtomFeed)
+        timezone = self.settings.get('TIMEZONE')
+        dates = [set_date_tzinfo(date, timezone) for entry in entries
+                 for date in (getattr(entry, 'modified', None), entry.date)
+                 if date]
+        if dates:
+            feed.latest = max(dates)
+        return feed
+
+    def write_page(self, complete_path, feed_type, feed_title, context, url,
+                   entries, links, override_output):
+        """Stream a feed page to ``complete_path``, rendering one entry at
+        a time, and return the feed, with its entries if receivers of the
+        ``feed_written`` signal need them."""
+        from pelican import signals
+        rss = feed_type == 'rss'
+        feed = self.new_feed(feed_type, feed_title, context, url, entries)
+        keep = bool(signals.feed_written.receivers)
+        items = []
+
+        directory = os.path.dirname(complete_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._open_w(complete_path, 'utf-8', override_output) as fp:
+            handler = SimplerXMLGenerator(fp, 'utf-8',
+                                          short_empty_elements=True)
+            handler.startDocument()
+            if rss:
+                feed.add_stylesheets(handler)
+                handler.startElement('rss', feed.rss_attributes())
+                handler.startElement('channel', feed.root_attributes())
+            else:
+                handler.startElement('feed', feed.root_attributes())
+            feed.add_root_elements(handler)
+            for rel, href in links:
+                handler.addQuickElement('atom:link' if rss else 'link', '',
+                                        {'rel': rel, 'href': href})
+            for entry in entries:
+                self._add_item_to_the_feed(feed, entry)
+                feed.write_items(handler)
+                if keep:
+                    items.extend(feed.items)
+                del feed.items[:]
+            if rss:
+                feed.endChannelElement(handler)
+                handler.endElement('rss')
+            else:
+                handler.endElement('feed')
+            logger.info('Writing "%s"', complete_path)
+        feed.items = items
+        return feed
+
+
+def log_stats(pelican):
+    logger.info('Feeds: %(written)d pages written, %(skipped)d unchanged',
+                stats)
+
+
+def register():
+    from pelican import signals
+    from pelican_tools import writer
+    writer.use(FeedWriter)
+    signals.finalized.connect(log_stats)
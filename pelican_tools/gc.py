@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Remove the output files left behind by deleted or renamed content.
+
+Pelican never removes output files, unless ``DELETE_OUTPUT_DIRECTORY``
+makes every build start from an empty output directory. Add
+``pelican_tools.gc`` to ``PLUGINS`` to record the list of the files each
+build writes or copies in ``cache/pelican-tools/outputs.json`` (see
+``GC_OUTPUTS_PATH``): the files of the previous list which the new build did
+not produce are orphans, kept in the list until ``pelican-tools gc`` removes
+them from the output directory, together with the directories left empty.
+
+The removed paths are appended, one per line and relative to the output
+directory, to the tombstones file (``cache/pelican-tools/tombstones.txt``,
+see ``GC_TOMBSTONES_PATH``), from which a deploy step can delete them on the
+server before removing the file.
+
+Only files recorded as outputs of an earlier build are ever removed: files
+written by other tools, or before the plugin was enabled, are left alone.
+"""
+from __future__ import print_function, unicode_literals
+
+import io
+import logging
+import os
+import weakref
+
+from pelican.writers import Writer
+
+from pelican_tools.utils import (add_settings_arguments, cache_path,
+                                 dump_json, load_json, makedirs,
+                                 settings_from_args)
+
+logger = logging.getLogger(__name__)
+
+_writers = weakref.WeakSet()
+_static = set()
+
+
+def outputs_path(settings):
+    return settings.get('GC_OUTPUTS_PATH') or cache_path(settings,
+                                                         'outputs.json')
+
+
+def tombstones_path(settings):
+    return settings.get('GC_TOMBSTONES_PATH') or cache_path(
+        settings, 'tombstones.txt')
+
+
+class OutputList(object):
+    """Outputs of the last build, and orphans of the earlier ones, by path
+    relative to the output directory."""
+
+    def __init__(self, path):
+        self.path = path
+        data = load_json(path, {})
+        self.outputs = set(data.get('outputs', ()))
+        self.orphans = set(data.get('orphans', ()))
+
+    def update(self, outputs):
+        """Replace the outputs, the former ones missing from ``outputs``
+        becoming orphans; return the number of new orphans."""
+        outputs = set(outputs)
+        orphans = (self.orphans | self.outputs) - outputs
+        added = len(orphans - self.orphans)
+        self.outputs, self.orphans = outputs, orphans
+        return added
+
+    def save(self):
+        dump_json(self.path, {'outputs': sorted(self.outputs),
+                              'orphans': sorted(self.orphans)})
+
+
+def collect(output_path, orphans, dry_run=False):
+    """Remove the ``orphans`` of ``output_path`` and the directories they
+    leave empty, returning the sorted orphans."""
+    root = os.path.abspath(output_path)
+    orphans = sorted(orphans)
+    if dry_run:
+        return orphans
+    directories = set()
+    for rel in orphans:
+        path = os.path.join(root, *rel.split('/'))
+        if not os.path.abspath(path).startswith(os.path.join(root, '')):
+            continue
+        try:
+            if os.path.islink(path) or os.path.isfile(path):
+                os.remove(path)
+                logger.info('Removed %s', rel)
+        except OSError as e:
+            logger.warning('Cannot remove %s: %s', path, e)
+            continue
+        directories.add(os.path.dirname(path))
+    # deepest first, so that parents are empty when reached
+    for directory in sorted(directories, key=len, reverse=True):
+        while directory != root and directory.startswith(root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break  # not empty, or already removed
+            logger.info('Removed empty directory %s',
+                        os.path.relpath(directory, root))
+            directory = os.path.dirname(directory)
+    return orphans
+
+
+def add_tombstones(path, paths):
+    """Append ``paths`` to the tombstones file ``path``."""
+    if not paths:
+        return
+    makedirs(os.path.dirname(path) or os.curdir)
+    with io.open(path, 'a', encoding='utf-8') as f:
+        for rel in paths:
+            f.write('%s\n' % rel)
+
+
+class OutputListWriter(Writer):
+    """Writer whose written files are the outputs of the build."""
+
+    writer_priority = 40
+
+    def __init__(self, output_path, settings=None):
+        super(OutputListWriter, self).__init__(output_path, settings=settings)
+        _writers.add(self)
+
+
+def record_static(generators):
+    """Record the theme and static files Pelican copies."""
+    _static.clear()
+    if not generators:
+        return
+    from pelican_tools.assets import theme_sources
+    settings = generators[0].settings
+    static_dir = settings.get('THEME_STATIC_DIR', 'theme').strip('/')
+    for name in theme_sources(settings):
+        _static.add('%s/%s' % (static_dir, name))
+    for generator in generators:
+        for staticfile in generator.context.get('staticfiles', ()):
+            _static.add(staticfile.save_as.replace(os.sep, '/'))
+
+
+def record_outputs(pelican):
+    from pelican_tools import writer
+    writer.drain()
+    root = os.path.abspath(pelican.output_path)
+    outputs = set(_static)
+    for w in list(_writers):
+        for path in w._written_files:
+            rel = os.path.relpath(os.path.abspath(path), root)
+            if rel.split(os.sep)[0] != os.pardir:
+                outputs.add(rel.replace(os.sep, '/'))
+        _writers.discard(w)
+    output_list = OutputList(outputs_path(pelican.settings))
+    added = output_list.update(outputs)
+    output_list.save()
+    logger.info('Recorded %d outputs, %d new orphans (%d in total)',
+                len(outputs), added, len(output_list.orphans))
+
+
+def register():
+    from pelican import signals
+    from pelican_tools import writer
+    writer.use(OutputListWriter)
+    signals.all_generators_finalized.connect(record_static)
+    signals.finalized.connect(record_outputs)
+
+
+def setup_parser(parser):
+    add_settings_arguments(parser)
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='Only list the orphans.')
+    parser.add_argument('--tombstones',
+                        help='File to which the removed paths are appended, '
+                        '"-" for the standard output (default: '
+                        'GC_TOMBSTONES_PATH or tombstones.txt in the '
+                        'pelican-tools cache directory).')
+    parser.set_defaults(func=command)
+
+
+def command(args):
+    settings = settings_from_args(args)
+    output_list = OutputList(outputs_path(settings))
+    if not output_list.outputs:
+        logger.warning('No outputs recorded in %s: add pelican_tools.gc to '
+                       'PLUGINS and build the site first', output_list.path)
+    removed = collect(settings['OUTPUT_PATH'], output_list.orphans,
+                      args.dry_run)
+    if args.dry_run:
+        for rel in removed:
+            print(rel)
+        return 0
+    if args.tombstones == '-':
+        for rel in removed:
+            print(rel)
+    else:
+        add_tombstones(args.tombstones or tombstones_path(settings), removed)
+    output_list.orphans.clear()
+    output_list.save()
+    logger.info('Collected %d orphans', len(removed))
+    return 0
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""Resized copies of the images of a site, for responsive ``srcset``s.
+
+``pelican-images`` (or the ``pelican_tools.images`` plugin, at the end of
+every build) writes, for every image of the ``IMAGE_PATHS`` directories of
+the content (``images`` by default), a copy per width of ``IMAGE_WIDTHS``
+and per format of ``IMAGE_FORMATS`` next to the copy Pelican makes of the
+image: ``images/photo.jpg`` gets ``images/photo-640w.jpg``,
+``images/photo-640w.webp``, and so on. Images are never enlarged, so widths
+larger than the source are left out. Images are resized with Pillow in a
+pool of processes (``IMAGE_JOBS``).
+
+Derivatives are kept in ``cache/pelican-tools/images`` (see
+``IMAGE_STORE_PATH``) under the SHA-256 of the source bytes and of the
+transform parameters, and linked into the output directory: a clean build,
+a renamed image or a theme change reusing the same sizes costs no resizing.
+The stat of every source and derivative is recorded in
+``cache/pelican-tools/images.json`` (``IMAGE_CACHE_PATH``), so sources that
+did not change are neither read nor hashed again.
+
+Formats are ``original`` (the format of the source), ``jpeg``, ``png`` and
+``webp``; ``IMAGE_QUALITY`` (82) is the quality of JPEG and WebP
+derivatives. This needs the ``Pillow`` package.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pelican_tools.compat import mtime_ns, replace
+from pelican_tools.utils import (atomic_write, cache_path, dump_json,
+                                 iter_files, load_json, makedirs,
+                                 sha256_bytes)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+#: Bumped when the cache format or the way derivatives are made changes.
+CACHE_VERSION = 1
+
+#: Extensions of the source images.
+EXTENSIONS = ('jpg', 'jpeg', 'png', 'webp')
+
+#: Pillow format name to derivative extension.
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+DEFAULT_WIDTHS = [320, 640, 1280]
+DEFAULT_FORMATS = ['original']
+DEFAULT_QUALITY = 82
+
+#: Number of images sent to a worker process at once.
+CHUNK_SIZE = 4
+
+
+def source_format(path):
+    ext = path.rpartition('.')[2].lower()
+    return 'JPEG' if ext in ('jpg', 'jpeg') else ext.upper()
+
+
+def derivatives(rel, widths, formats, quality):
+    """Return the ``(name, params)`` of the derivatives of the source
+    ``rel``, ``name`` being relative to the output directory."""
+    stem = rel.rpartition('.')[0]
+    result = []
+    for fmt in formats:
+        fmt = source_format(rel if fmt == 'original' else '.' + fmt)
+        for width in widths:
+            params = {'width': width, 'format': fmt}
+            if fmt in ('JPEG', 'WEBP'):
+                params['quality'] = quality
+            result.append(('%s-%dw.%s' % (stem, width,
+                                          FORMAT_EXTENSIONS[fmt]), params))
+    return result
+
+
+def params_key(params):
+    return json.dumps([CACHE_VERSION, params], sort_keys=True)
+
+
+def derivative_key(digest, params):
+    """Return the name in the store of a derivative of the source whose
+    SHA-256 is ``digest``."""
+    return hashlib.sha256(
+        ('%s:%s' % (digest, params_key(params))).encode('utf-8')).hexdigest()
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [mtime_ns(st), st.st_size]
+
+
+def render(image, params):
+    """Return the bytes of ``image`` resized and encoded as in
+    ``params``."""
+    width = params['width']
+    height = max(1, int(round(image.height * float(width) / image.width)))
+    resized = image.resize((width, height), Image.LANCZOS)
+    fmt = params['format']
+    options = {}
+    if fmt == 'JPEG':
+        if resized.mode not in ('RGB', 'L'):
+            resized = resized.convert('RGB')
+        options = {'quality': params['quality'], 'optimize': True,
+                   'progressive': True}
+    elif fmt == 'WEBP':
+        options = {'quality': params['quality'], 'method': 4}
+    elif fmt == 'PNG':
+        options = {'optimize': True}
+    f = io.BytesIO()
+    resized.save(f, fmt, **options)
+    return f.getvalue()
+
+
+def link(source, destination):
+    """Make ``destination`` a hard link to ``source``, or a copy of it."""
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+    makedirs(os.path.dirname(destination))
+    tmp = os.path.join(os.path.dirname(destination),
+                       '.tmp-%d-%s' % (os.getpid(),
+                                       os.path.basename(destination)))
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)
+    replace(tmp, destination)
+
+
+def make_derivatives(path, output_path, store, items):
+    """Write the derivatives ``items`` (``(name, params)`` pairs) of the
+    image ``path`` and return its cache entry.
+
+    Derivatives found in the ``store`` are linked without decoding the
+    source. The entry holds the source ``[mtime_ns, size]``, its SHA-256
+    and, per derivative name, ``[params key, stat]``, the stat being None
+    for widths larger than the source.
+    """
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = sha256_bytes(data)
+    entry = {'stat': [mtime_ns(st), st.st_size], 'sha256': digest,
+             'outputs': {}, 'rendered': 0}
+    image = None
+    for name, params in items:
+        key = derivative_key(digest, params)
+        blob = os.path.join(store, key[:2], key)
+        if not os.path.exists(blob):
+            if image is None:
+                image = Image.open(io.BytesIO(data))
+                image = ImageOps.exif_transpose(image)
+                image.load()
+            if params['width'] >= image.width:
+                entry['outputs'][name] = [params_key(params), None]
+                continue
+            atomic_write(blob, render(image, params))
+            entry['rendered'] += 1
+        destination = os.path.join(output_path, *name.split('/'))
+        link(blob, destination)
+        entry['outputs'][name] = [params_key(params), _stat(destination)]
+    return entry
+
+
+def _process_chunk(chunk):
+    results = []
+    for rel, path, output_path, store, items in chunk:
+        try:
+            results.append((rel, make_derivatives(path, output_path, store,
+                                                  items)))
+        except Exception as e:
+            # Pillow raises many kinds of errors for broken images
+            logger.warning('Cannot resize %s: %s', path, e)
+            results.append((rel, None))
+    return results
+
+
+class ImageProcessor(object):
+    """Writes the derivatives of the images of ``source_paths`` (pairs of
+    directory and name of that directory in the output) to
+    ``output_path``."""
+
+    def __init__(self, source_paths, output_path, store, cache_file,
+                 widths=None, formats=None, quality=DEFAULT_QUALITY,
+                 jobs=None):
+        self.source_paths = source_paths
+        self.output_path = os.path.abspath(output_path)
+        self.store = os.path.abspath(store)
+        self.cache_file = cache_file
+        self.widths = sorted(widths or DEFAULT_WIDTHS)
+        self.formats = formats or DEFAULT_FORMATS
+        self.quality = quality
+        self.jobs = jobs or multiprocessing.cpu_count()
+        data = load_json(cache_file, {}) if cache_file else {}
+        if data.get('version') == CACHE_VERSION and \
+                data.get('output_path') == self.output_path:
+            self.entries = data.get('files', {})
+        else:
+            self.entries = {}
+        self.stats = dict.fromkeys(('processed', 'unchanged', 'rendered',
+                                    'removed', 'errors'), 0)
+
+    def is_fresh(self, rel, path, items):
+        """Return True if the derivatives of ``path`` are up to date, from
+        stat calls only."""
+        entry = self.entries.get(rel)
+        if entry is None or entry['stat'] != _stat(path):
+            return False
+        outputs = entry['outputs']
+        if len(outputs) != len(items):
+            return False
+        for name, params in items:
+            recorded = outputs.get(name)
+            if recorded is None or recorded[0] != params_key(params):
+                return False
+            if recorded[1] is not None and recorded[1] != _stat(
+                    os.path.join(self.output_path, *name.split('/'))):
+                return False
+        return True
+
+    def pending(self):
+        """Return the images whose derivatives must be written, removing
+        the derivatives of the images which disappeared."""
+        seen = set()
+        items = []
+        for root, prefix in self.source_paths:
+            for path in iter_files(root, EXTENSIONS):
+                rel = os.path.relpath(path, root).replace(os.sep, '/')
+                if prefix:
+                    rel = '%s/%s' % (prefix, rel)
+                seen.add(rel)
+                wanted = derivatives(rel, self.widths, self.formats,
+                                     self.quality)
+                if self.is_fresh(rel, path, wanted):
+                    self.stats['unchanged'] += 1
+                    continue
+                items.append((rel, path, self.output_path, self.store,
+                              wanted))
+        for rel in set(self.entries) - seen:
+            self._remove_outputs(self.entries.pop(rel)['outputs'])
+            self.stats['removed'] += 1
+        return items
+
+    def _remove_outputs(self, outputs, keep=()):
+        for name, (key, stat) in outputs.items():
+            if name in keep or stat is None:
+                continue
+            path = os.path.join(self.output_path, *name.split('/'))
+            if _stat(path) == stat:
+                os.remove(path)
+
+    def run(self):
+        items = self.pending()
+        chunks = [items[i:i + CHUNK_SIZE]
+                  for i in range(0, len(items), CHUNK_SIZE)]
+        if self.jobs > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(self.jobs) as pool:
+                for results in pool.map(_process_chunk, chunks):
+                    self._record(results)
+        else:
+            for chunk in chunks:
+                self._record(_process_chunk(chunk))
+        if self.cache_file:
+            dump_json(self.cache_file, {'version': CACHE_VERSION,
+                                        'output_path': self.output_path,
+                                        'files': self.entries})
+        return self.stats
+
+    def _record(self, results):
+        for rel, entry in results:
+            previous = self.entries.pop(rel, None)
+            if entry is None:
+                self.stats['errors'] += 1
+                continue
+            if previous is not None:
+                # derivatives of sizes or formats no longer configured
+                self._remove_outputs(previous['outputs'],
+                                     keep=entry['outputs'])
+            self.stats['processed'] += 1
+            self.stats['rendered'] += entry.pop('rendered')
+            self.entries[rel] = entry
+
+    def summary(self):
+        return ('%(processed)d images processed (%(rendered)d derivatives '
+                'rendered), %(unchanged)d unchanged, %(removed)d removed' %
+                self.stats)
+
+
+def source_paths(settings):
+    """Return the image directories of the site, with their path in the
+    output directory."""
+    content = settings.get('PATH', 'content')
+    return [(os.path.join(content, name), name.strip('/').replace(os.sep,
+                                                                  '/'))
+            for name in settings.get('IMAGE_PATHS', ['images'])]
+
+
+def get_processor(settings, jobs=None):
+    return ImageProcessor(
+        source_paths(settings), settings.get('OUTPUT_PATH', 'output'),
+        settings.get('IMAGE_STORE_PATH') or cache_path(settings, 'images'),
+        settings.get('IMAGE_CACHE_PATH') or cache_path(settings,
+                                                       'images.json'),
+        settings.get('IMAGE_WIDTHS'), settings.get('IMAGE_FORMATS'),
+        settings.get('IMAGE_QUALITY', DEFAULT_QUALITY),
+        jobs or settings.get('IMAGE_JOBS'))
+
+
+def process_images(pelican):
+    if Image is None:
+        logger.warning('Pillow is not installed, no image derivatives')
+        return
+    start = time.time()
+    processor = get_processor(pelican.settings)
+    processor.output_path = os.path.abspath(pelican.output_path)
+    processor.run()
+    logger.info('Image derivatives in %.2fs: %s', time.time() - start,
+                processor.summary())
+
+
+def register():
+    from pelican import signals
+    signals.finalized.connect(process_images)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pelican-images',
+        description='Write resized copies of the images of a Pelican site '
+        'to its output directory.')
+    parser.add_argument('-s', '--settings',
+                        help='Pelican settings file to read the IMAGE_* '
+                        'settings and the content, output and cache paths '
+                        'from.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Number of processes (default: IMAGE_JOBS or '
+                        'the number of cores).')
+    parser.add_argument('--widths',
+                        help='Comma separated widths (default: '
+                        'IMAGE_WIDTHS or %s).' % ','.join(
+                            '%d' % w for w in DEFAULT_WIDTHS))
+    parser.add_argument('--formats',
+                        help='Comma separated formats, among original, '
+                        'jpeg, png and webp (default: IMAGE_FORMATS or '
+                        'original).')
+    parser.add_argument('--force', action='store_true',
+                        help='Check every image again.')
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        const=logging.INFO, dest='verbosity',
+                        default=logging.WARNING, help='Show all messages.')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.verbosity,
+                        format='%(levelname)s: %(message)s')
+    if Image is None:
+        logger.error('pelican-images needs Pillow')
+        return 1
+
+    settings = {}
+    if args.settings:
+        from pelican_tools.utils import read_settings
+        settings = read_settings(args.settings)
+    if args.widths:
+        settings['IMAGE_WIDTHS'] = [int(w) for w in args.widths.split(',')]
+    if args.formats:
+        formats = [f.strip().lower() for f in args.formats.split(',')]
+        unknown = set(formats) - set(['original', 'jpeg', 'png', 'webp'])
+        if unknown:
+            parser.error('unknown formats: %s' % ', '.join(sorted(unknown)))
+        settings['IMAGE_FORMATS'] = formats
+    processor = get_processor(settings, args.jobs)
+    if args.force:
+        processor.entries = {}
+
+    start = time.time()
+    stats = processor.run()
+    print(processor.summary())
+    print('Done in %.2fs with %d processes' % (
+        time.time() - start, processor.jobs))
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""``width`` and ``height`` attributes for the images of every page.
+
+Browsers reserve the space of images whose size is given in the page,
+instead of moving the content around when they load. Add
+``pelican_tools.imgsize`` to ``PLUGINS`` to add the ``width`` and
+``height`` attributes to the ``<img>`` tags which have neither, as pages are
+written, in a single pass over their HTML.
+
+Sizes are read from the first bytes of PNG, JPEG, GIF and WebP files,
+without decoding the images, and kept in ``cache/pelican-tools/imgsize.json``
+(see ``IMGSIZE_CACHE_PATH``) by path, with the modification time and size of
+the file: an image is only read again when it changed, and only checked
+once per build however many pages show it. The rotation recorded in the
+EXIF metadata of JPEG images, which browsers apply, is taken into account.
+
+Images are looked up in the static files and the theme, which Pelican
+copies after writing the pages, then in the output directory. With
+``pelican_tools.incremental``, the images are inputs of the pages showing
+them: a page is rendered again when one of its images changes.
+"""
+from __future__ import unicode_literals
+
+import io
+import logging
+import os
+import re
+import struct
+import threading
+
+from pelican.writers import Writer
+
+from pelican_tools.incremental.writer import add_file_input
+from pelican_tools.utils import (cache_path, dump_json, load_json, stat_key,
+                                 url_target)
+
+try:
+    from html import unescape
+except ImportError:  # pragma: no cover
+    from HTMLParser import HTMLParser
+    unescape = HTMLParser().unescape
+
+logger = logging.getLogger(__name__)
+
+#: Bumped when the way sizes are read changes.
+CACHE_VERSION = 1
+
+EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'webp')
+
+#: JPEG markers of the frame headers holding the size of the image.
+SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - frozenset([0xC4, 0xC8, 0xCC])
+
+#: EXIF orientations turning the image by a quarter.
+ROTATED = frozenset([5, 6, 7, 8])
+
+
+def _png_size(f, head):
+    if head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+    return None
+
+
+def _gif_size(f, head):
+    return struct.unpack('<HH', head[6:10])
+
+
+def _webp_size(f, head):
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L' and head[20:21] == b'\x2f':
+        bits = struct.unpack('<I', head[21:25])[0]
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8X':
+        width = struct.unpack('<I', head[24:27] + b'\0')[0] + 1
+        height = struct.unpack('<I', head[27:30] + b'\0')[0] + 1
+        return width, height
+    return None
+
+
+def _exif_orientation(data):
+    """Return the orientation of the TIFF structure of an EXIF segment."""
+    if data[:2] not in (b'II', b'MM'):
+        return None
+    order = '<' if data[:2] == b'II' else '>'
+    try:
+        offset = struct.unpack(order + 'I', data[4:8])[0]
+        count = struct.unpack(order + 'H', data[offset:offset + 2])[0]
+        for i in range(count):
+            start = offset + 2 + i * 12
+            tag, kind = struct.unpack(order + 'HH', data[start:start + 4])
+            if tag == 0x0112 and kind == 3:
+                return struct.unpack(order + 'H',
+                                     data[start + 8:start + 10])[0]
+    except struct.error:
+        pass
+    return None
+
+
+def _jpeg_size(f, head):
+    f.seek(2)
+    orientation = None
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)  # garbage between segments
+        while byte == b'\xff':
+            byte = f.read(1)  # fill bytes
+        if not byte:
+            return None
+        marker = ord(byte)
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            continue  # no length
+        if marker == 0xD9:
+            return None
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack('>xHH', f.read(5))
+            if orientation in ROTATED:
+                return height, width
+            return width, height
+        if marker == 0xE1 and orientation is None:
+            data = f.read(length - 2)
+            if data[:6] == b'Exif\0\0':
+                orientation = _exif_orientation(data[6:])
+        else:
+            f.seek(length - 2, io.SEEK_CUR)
+
+
+#: Magic bytes to the function reading the size of the image.
+READERS = [
+    (b'\x89PNG\r\n\x1a\n', _png_size),
+    (b'\xff\xd8', _jpeg_size),
+    (b'GIF87a', _gif_size),
+    (b'GIF89a', _gif_size),
+]
+
+
+def image_size(path):
+    """Return the ``(width, height)`` of the image ``path`` read from its
+    header, or None if it is not a PNG, JPEG, GIF or WebP image."""
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            reader = _webp_size
+        else:
+            reader = None
+            for magic, function in READERS:
+                if head.startswith(magic):
+                    reader = function
+                    break
+        if reader is None:
+            return None
+        try:
+            size = reader(f, head)
+        except struct.error:
+            return None
+    return tuple(size) if size and all(size) else None
+
+
+class SizeIndex(object):
+    """Sizes of images, by path, read again when their stat changes."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.read = 0
+        self._checked = {}
+        self._lock = threading.Lock()
+        if path:
+            data = load_json(path, {})
+            if data.get('version') == CACHE_VERSION:
+                self.entries = data.get('images', {})
+
+    def size(self, path):
+        """Return the size of the image ``path``, or None."""
+        if path in self._checked:
+            return self._checked[path]
+        try:
+            key = stat_key(path)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if entry is not None and entry[:2] == key:
+            size = tuple(entry[2:]) or None
+        else:
+            try:
+                size = image_size(path)
+            except (IOError, OSError):
+                return None
+            with self._lock:
+                self.entries[path] = key + list(size or ())
+                self.read += 1
+        self._checked[path] = size
+        return size
+
+    def forget_missing(self):
+        for path in list(self.entries):
+            if not os.path.exists(path):
+                del self.entries[path]
+
+    def save(self):
+        dump_json(self.path, {'version': CACHE_VERSION,
+                              'images': self.entries})
+
+
+_token = re.compile(r'''
+    (<(pre|textarea|script|style)\b.*?</\2\s*>)     # 1: left alone
+  | <img\b([^>]*?)(\s*/?>)                           # 3: attributes, 4: end
+''', re.I | re.S | re.X)
+
+_attr = re.compile(r'''([^\s=/>]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?''')
+
+
+def annotate(html, page, find, siteurl=''):
+    """Return ``html`` with the size of its images, given by
+    ``find(target)`` for the paths relative to the output directory,
+    added to the ``<img>`` tags without ``width`` and ``height``."""
+    def replace(m):
+        if m.group(1):
+            return m.group(0)
+        attrs = dict((name.lower(), value)
+                     for name, value in _attr.findall(m.group(3)))
+        if 'width' in attrs or 'height' in attrs or not attrs.get('src'):
+            return m.group(0)
+        target = url_target(unescape(attrs['src'].strip('"\'')), page,
+                            siteurl)
+        size = find(target) if target else None
+        if size is None:
+            return m.group(0)
+        return '<img%s width="%d" height="%d"%s' % (
+            m.group(3), size[0], size[1], m.group(4))
+    return _token.sub(replace, html)
+
+
+class ImageFinder(object):
+    """Returns the size of the images of the site by output path."""
+
+    def __init__(self, index, output_path, sources=None):
+        self.index = index
+        self.output_path = output_path
+        self.sources = sources if sources is not None else {}
+
+    def __call__(self, target):
+        if target.rpartition('.')[2].lower() not in EXTENSIONS:
+            return None
+        path = self.sources.get(target)
+        if path is None:
+            path = os.path.join(self.output_path, *target.split('/'))
+        # incremental builds render the page again when the image changes
+        add_file_input(path)
+        return self.index.size(path)
+
+
+_index = None
+_sources = {}
+
+
+def get_index(settings):
+    global _index
+    if _index is None:
+        _index = SizeIndex(settings.get('IMGSIZE_CACHE_PATH') or
+                           cache_path(settings, 'imgsize.json'))
+    return _index
+
+
+def record_sources(generators):
+    """Record the source of the static and theme files by output path."""
+    _sources.clear()
+    if not generators:
+        return
+    from pelican_tools.assets import theme_sources
+    settings = generators[0].settings
+    static_dir = settings.get('THEME_STATIC_DIR', 'theme').strip('/')
+    for name, path in theme_sources(settings).items():
+        _sources['%s/%s' % (static_dir, name)] = path
+    for generator in generators:
+        for staticfile in generator.context.get('staticfiles', ()):
+            _sources[staticfile.save_as.replace(os.sep, '/')] = \
+                staticfile.source_path
+
+
+class _AnnotatedFile(io.StringIO):
+    """Collects a page, written to ``target`` with the size of its images
+    on close."""
+
+    def __init__(self, target, page, finder, siteurl):
+        super(_AnnotatedFile, self).__init__()
+        self.target = target
+        self.page = page
+        self.finder = finder
+        self.siteurl = siteurl
+
+    def close(self):
+        if not self.closed:
+            html = self.getvalue()
+            super(_AnnotatedFile, self).close()
+            try:
+                self.target.write(annotate(html, self.page, self.finder,
+                                           self.siteurl))
+            finally:
+                self.target.close()
+
+
+class SizeWriter(Writer):
+    """Writer adding the size of the images to the pages."""
+
+    writer_priority = 13
+
+    def __init__(self, output_path, settings=None):
+        super(SizeWriter, self).__init__(output_path, settings=settings)
+        self.finder = ImageFinder(get_index(self.settings),
+                                  os.path.abspath(output_path), _sources)
+
+    def _open_w(self, filename, encoding, override=False):
+        f = super(SizeWriter, self)._open_w(filename, encoding,
+                                            override=override)
+        if filename.rpartition('.')[2].lower() in ('html', 'htm'):
+            page = os.path.relpath(filename, self.output_path)
+            return _AnnotatedFile(f, page.replace(os.sep, '/'), self.finder,
+                                  self.settings.get('SITEURL', ''))
+        return f
+
+
+def save_index(pelican):
+    global _index
+    from pelican_tools import writer
+    writer.drain()
+    index = get_index(pelican.settings)
+    index.forget_missing()
+    index.save()
+    logger.info('Image sizes: %d images read, %d known', index.read,
+                len(index.entries))
+    _index = None
+
+
+def register():
+    from pelican import signals
+    from pelican_tools import writer
+    writer.use(SizeWriter)
+    signals.all_generators_finalized.connect(record_sources)
+    signals.finalized.connect(save_index)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Incremental builds for Pelican.
+
+Add ``pelican_tools.incremental`` to ``PLUGINS`` (or use the
+``pelican-incremental`` command) to record the SHA-256 of every source,
+template and setting in an on-disk cache, and to render on later builds only
+the outputs whose inputs changed.
+"""
+from __future__ import unicode_literals
+
+import logging
+
+from pelican_tools.incremental.cache import BuildCache, get_cache
+
+__all__ = ['BuildCache', 'get_cache', 'register']
+
+logger = logging.getLogger(__name__)
+
+
+def save_cache(pelican):
+    from pelican_tools import writer
+    writer.drain()
+    cache = get_cache(pelican.settings)
+    logger.info('Incremental build: rendered %d outputs, %d unchanged',
+                cache.rendered, cache.skipped)
+    cache.save()
+
+
+def register():
+    from pelican import signals
+    from pelican_tools import writer
+    from pelican_tools.incremental.writer import IncrementalWriter
+    writer.use(IncrementalWriter)
+    signals.finalized.connect(save_cache)
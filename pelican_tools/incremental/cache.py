@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""On-disk store of the fingerprints used by incremental builds."""
+from __future__ import unicode_literals
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from pelican_tools import depgraph
+from pelican_tools.compat import string_types
+from pelican_tools.depgraph import DependencyGraph
+from pelican_tools.utils import HashCache, cache_path, dump_json, load_json
+
+logger = logging.getLogger(__name__)
+
+#: Bump when the way output keys are computed changes.
+CACHE_VERSION = 4
+
+#: Settings which never influence the rendered output.
+IGNORED_SETTINGS = frozenset([
+    'CACHE_PATH', 'DELETE_OUTPUT_DIRECTORY', 'LOG_FILTER', 'OUTPUT_RETENTION',
+    'PELICAN_TOOLS_CACHE_PATH', 'INCREMENTAL_CACHE_PATH', 'DEPGRAPH_PATH',
+    'WRITE_SELECTED',
+])
+
+#: Content metadata left out of the site-wide fingerprint: it only shows up
+#: on pages that receive the content object explicitly.
+BODY_METADATA = frozenset(['summary'])
+
+
+def stable(value):
+    """Return a JSON-serialisable representation of ``value`` which does not
+    change from one run to the next (no memory addresses)."""
+    if value is None or isinstance(value, (bool, int, float) + string_types):
+        return value
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [stable(v) for v in value]
+        return sorted(items, key=repr) if isinstance(
+            value, (set, frozenset)) else items
+    if isinstance(value, dict):
+        return sorted((repr(k), stable(v)) for k, v in value.items())
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if hasattr(value, 'source_path'):
+        return 'content:%s' % value.source_path
+    if isinstance(value, type) or callable(value) or hasattr(
+            value, '__file__'):
+        return '%s.%s' % (getattr(value, '__module__', ''),
+                          getattr(value, '__name__', type(value).__name__))
+    text = '%s' % (value,)
+    if ' at 0x' in text:
+        return type(value).__name__
+    return text
+
+
+def fingerprint(*parts):
+    """Return a SHA-256 over the stable representation of ``parts``."""
+    data = json.dumps(stable(parts), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def settings_fingerprint(settings, exclude=()):
+    return fingerprint(sorted(
+        (k, v) for k, v in settings.items()
+        if k.isupper() and k not in IGNORED_SETTINGS and k not in exclude))
+
+
+def content_fingerprint(content):
+    """Fingerprint of the metadata of ``content`` that other pages (menus,
+    archives, sidebars) commonly display."""
+    metadata = dict((k, v) for k, v in content.metadata.items()
+                    if k not in BODY_METADATA)
+    return fingerprint(content.source_path, getattr(content, 'url', None),
+                       getattr(content, 'status', None), metadata)
+
+
+class BuildCache(object):
+    """Fingerprints of the last build.
+
+    ``sources`` holds the SHA-256 of every source and template file (reused
+    while size and mtime are unchanged), ``outputs`` maps every output file,
+    relative to the output directory, to the key computed from its inputs
+    when it was last rendered, and ``graph`` records these inputs.
+    ``templates`` keeps the analysis of the templates by source digest.
+    """
+
+    def __init__(self, path, graph_path=None):
+        self.path = path
+        self.graph_path = graph_path or os.path.join(
+            os.path.dirname(path), 'depgraph.json')
+        self.rendered = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self.reset()
+        data = load_json(path, {})
+        if data.get('version') == CACHE_VERSION:
+            self.sources.entries = data.get('sources', {})
+            self.outputs = data.get('outputs', {})
+            self.templates = data.get('templates', {})
+            self.graph = DependencyGraph(self.graph_path)
+        elif data:
+            logger.info('Discarding incremental cache %s from an older '
+                        'version', path)
+
+    def reset(self):
+        self.sources = HashCache()
+        self.outputs = {}
+        self.templates = {}
+        self.graph = DependencyGraph()
+
+    def is_fresh(self, output, key, output_path):
+        """Return True if ``output`` was rendered from ``key`` and is still
+        present in ``output_path``."""
+        return (self.outputs.get(output) == key and
+                os.path.exists(os.path.join(output_path, output)))
+
+    def record(self, output, key, inputs):
+        """Record that ``output`` was rendered from ``inputs`` (a mapping of
+        :mod:`~pelican_tools.depgraph` node name to fingerprint), hashed as
+        ``key``."""
+        with self._lock:
+            self.outputs[output] = key
+            self.graph.record(output, inputs)
+            self.rendered += 1
+
+    def add_inputs(self, output, inputs):
+        """Add ``inputs``, found while ``output`` was written, to those
+        recorded for it."""
+        with self._lock:
+            self.graph.add_inputs(output, inputs)
+
+    def skip(self, output):
+        """Count ``output`` as left unchanged."""
+        with self._lock:
+            self.skipped += 1
+
+    def save(self):
+        dump_json(self.path, {
+            'version': CACHE_VERSION,
+            'sources': self.sources.entries,
+            'outputs': self.outputs,
+            'templates': self.templates,
+        })
+        self.graph.save(self.graph_path)
+        logger.debug('Saved incremental cache to %s', self.path)
+
+    def clear(self):
+        self.reset()
+        for path in (self.path, self.graph_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+_caches = {}
+
+
+def get_cache(settings):
+    """Return the :class:`BuildCache` configured by ``settings``.
+
+    The cache is kept in memory between builds in the same process (e.g. in
+    watch mode). Its location is ``INCREMENTAL_CACHE_PATH``, by default
+    ``incremental.json`` in the pelican-tools cache directory, and the
+    dependency graph is stored in ``DEPGRAPH_PATH``.
+    """
+    path = settings.get('INCREMENTAL_CACHE_PATH') or cache_path(
+        settings, 'incremental.json')
+    path = os.path.abspath(path)
+    if path not in _caches:
+        _caches[path] = BuildCache(
+            path, os.path.abspath(depgraph.graph_path(settings)))
+    return _caches[path]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Build a Pelican site incrementally."""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import logging
+import os
+import sys
+
+from pelican_tools.incremental.cache import get_cache
+from pelican_tools.utils import (add_settings_arguments, enable_plugins,
+                                 iter_files, run_pelican, settings_from_args)
+
+
+def changed_sources(settings, cache):
+    """Return ``(status, path)`` tuples for the content sources added
+    (``A``), modified (``M``) or deleted (``D``) since the last build."""
+    from pelican.readers import Readers
+    extensions = set(Readers(settings).extensions)
+    root = os.path.abspath(settings['PATH'])
+    seen = set()
+    changes = []
+    for path in iter_files(root, extensions, settings['IGNORE_FILES']):
+        seen.add(path)
+        if cache.sources.known(path) is None:
+            changes.append(('A', path))
+        elif cache.sources.changed(path):
+            changes.append(('M', path))
+    for path in sorted(cache.sources.entries):
+        if path.startswith(root + os.sep) and path not in seen:
+            changes.append(('D', path))
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pelican-incremental',
+        description='Build a Pelican site, rendering only the outputs whose '
+        'sources, templates or settings changed since the last build.')
+    add_settings_arguments(parser)
+    parser.add_argument('--status', action='store_true',
+                        help='List the sources changed since the last build '
+                        'and exit.')
+    parser.add_argument('--clear', action='store_true',
+                        help='Forget the last build, so that the next one '
+                        'renders everything.')
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        const=logging.INFO, dest='verbosity',
+                        default=logging.WARNING,
+                        help='Show all messages.')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.verbosity,
+                        format='%(levelname)s: %(message)s')
+
+    settings = settings_from_args(args)
+    cache = get_cache(settings)
+    if args.clear:
+        cache.clear()
+        print('Cleared %s' % cache.path)
+        return 0
+    if args.status:
+        root = settings['PATH']
+        for status, path in changed_sources(settings, cache):
+            print('%s %s' % (status, os.path.relpath(path, root)))
+        return 0
+
+    enable_plugins(settings, 'pelican_tools.incremental')
+    run_pelican(settings)
+    print('Rendered %d outputs, %d unchanged' % (cache.rendered,
+                                                 cache.skipped))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""Pelican writer rendering only the outputs whose inputs changed."""
+from __future__ import unicode_literals
+
+import io
+import logging
+import os
+import threading
+
+from pelican.writers import Writer
+
+from pelican_tools.depgraph import node, split_node, template_dependencies
+from pelican_tools.incremental.cache import (content_fingerprint, fingerprint,
+                                             get_cache, settings_fingerprint,
+                                             stable)
+from pelican_tools.utils import sha256_bytes, stat_key
+
+logger = logging.getLogger(__name__)
+
+#: The writer and output each thread is writing, for :func:`add_file_input`.
+_current = threading.local()
+
+#: Keyword arguments of ``write_file`` holding every article of the site.
+#: Like the global context, they only contribute their metadata to the
+#: inputs of an output.
+SITE_KWARGS = frozenset(['all_articles'])
+
+
+def add_file_input(path):
+    """Record the file ``path`` as an input of the output being written by
+    the current thread, if it is written incrementally.
+
+    Plugins call it for the files whose data they add to an output without
+    going through its template inputs, such as the size of an image: the
+    output is rendered again when the modification time or size of the file
+    changes.
+    """
+    writer = getattr(_current, 'writer', None)
+    if writer is not None:
+        writer.add_file_input(_current.output, path)
+
+
+class _NullFile(io.StringIO):
+    """Stands in for an output file which does not need to be rewritten."""
+
+    def write(self, data):
+        return len(data)
+
+
+class _TrackedTemplate(object):
+    """Wraps a Jinja2 template to skip rendering of fresh outputs.
+
+    Pelican renders the template once per output file (several times for
+    paginated templates), so the key is computed from the local context of
+    each output rather than from the ``write_file`` call.
+    """
+
+    def __init__(self, writer, template, kwargs):
+        self.writer = writer
+        self.template = template
+        self.kwargs = kwargs
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, localcontext):
+        writer = self.writer
+        output = localcontext['output_file']
+        key, inputs = writer.output_key(self.template, self.kwargs,
+                                        localcontext)
+        writer._local.output = os.path.abspath(
+            os.path.join(writer.output_path, output))
+        if writer.cache.is_fresh(output, key, writer.output_path) and \
+                not writer.files_changed(output):
+            writer._local.fresh = True
+            _current.writer = None
+            writer.cache.skip(output)
+            return ''
+        writer._local.fresh = False
+        # files added while rendering, then while writing the output
+        writer._local.files = files = {}
+        _current.writer, _current.output = writer, output
+        result = self.template.render(localcontext)
+        inputs = dict(inputs)
+        inputs.update(files)
+        writer.cache.record(output, key, inputs)
+        writer._local.files = None
+        return result
+
+
+class IncrementalWriter(Writer):
+    """Writer which leaves alone the outputs rendered from unchanged inputs.
+
+    The inputs of an output are found by analysing its template: the
+    templates it extends or includes, the settings and global context
+    variables it reads, and the sources of the content objects given to it.
+    Every other setting is an input of all outputs. The key of an output
+    hashes the fingerprints of its inputs; outputs that are skipped are not
+    rewritten, but Pelican still reports them as written so that other
+    plugins see the complete site.
+    """
+
+    writer_priority = 10
+
+    def __init__(self, output_path, settings=None):
+        super(IncrementalWriter, self).__init__(output_path, settings=settings)
+        self.cache = get_cache(self.settings)
+        self.cache.rendered = self.cache.skipped = 0
+        self._templates = {}
+        self._fingerprints = {}
+        self._local = threading.local()
+
+    def write_file(self, name, template, context, *args, **kwargs):
+        if name:
+            template = _TrackedTemplate(self, template, kwargs)
+        return super(IncrementalWriter, self).write_file(
+            name, template, context, *args, **kwargs)
+
+    def _open_w(self, filename, encoding, override=False):
+        if (getattr(self._local, 'fresh', False) and
+                os.path.abspath(filename) == self._local.output):
+            self._local.fresh = False
+            self._written_files.add(filename)
+            return _NullFile()
+        return super(IncrementalWriter, self)._open_w(
+            filename, encoding, override=override)
+
+    def add_file_input(self, output, path):
+        name = node('file', path)
+        fp = self.file_fingerprint(path)
+        files = getattr(self._local, 'files', None)
+        if files is not None:
+            files[name] = fp
+        else:
+            self.cache.add_inputs(output, {name: fp})
+
+    def files_changed(self, output):
+        """Return True if one of the files recorded as inputs of
+        ``output`` changed since it was rendered."""
+        graph = self.cache.graph
+        for name in graph.outputs.get(output, ()):
+            kind, path = split_node(name)
+            if kind == 'file' and (graph.fingerprints.get(name) !=
+                                   self.file_fingerprint(path)):
+                return True
+        return False
+
+    def file_fingerprint(self, path):
+        def compute():
+            try:
+                return stat_key(path)
+            except OSError:
+                return None
+        return self.fingerprint(('file', path), compute)
+
+    def output_key(self, template, kwargs, localcontext):
+        """Return the key of the output rendered from ``localcontext`` and
+        its inputs, as a mapping of node name to fingerprint."""
+        env = template.environment
+        templates, variables = self.template_dependencies(template)
+        dynamic = '*' in templates
+        if dynamic:
+            variables = variables | self.referenced_variables(env)
+
+        inputs = {node('setting', '*'): self.fingerprint(
+            ('setting', '*', id(env)),
+            lambda: settings_fingerprint(self.settings,
+                                         self.referenced_variables(env)))}
+        for name in templates:
+            inputs[node('template', name)] = self.template_fingerprint(
+                env, name)
+
+        params = {}
+        explicit = dict(kwargs)
+        for name in list(explicit):
+            page = localcontext.get('%s_page' % name)
+            if page is not None:
+                # a paginated output only shows its own slice of the list
+                explicit[name] = page.object_list
+                params['%s_page' % name] = [page.number,
+                                            page.paginator.num_pages]
+        for name, value in explicit.items():
+            if name in variables or '%s_page' % name in variables:
+                self.add_value(inputs, params, name, value,
+                               site=name in SITE_KWARGS)
+
+        for name in variables:
+            if name.isupper():
+                if name in self.settings:
+                    inputs[node('setting', name)] = self.fingerprint(
+                        ('setting', name),
+                        lambda: fingerprint(self.settings[name]))
+            elif name not in explicit and name in localcontext:
+                self.add_value(inputs, params, name, localcontext[name],
+                               site=True)
+
+        key = fingerprint(sorted(inputs.items()), template.name,
+                          localcontext['output_file'], sorted(params.items()))
+        return key, inputs
+
+    def add_value(self, inputs, params, name, value, site=False):
+        """Add a template variable to the inputs of an output.
+
+        Content objects contribute the digest of their source and, as a
+        parameter, the fingerprint of their rendered content, in which the
+        ``{filename}`` links to other contents are resolved. Global lists of
+        content (``site``) contribute the fingerprint of their metadata, and
+        other values are parameters of the output itself.
+        """
+        if hasattr(value, 'source_path'):
+            value = [value]
+        elif isinstance(value, dict) and value:
+            value = sorted(value.items(), key=lambda item: '%s' % (item[0],))
+        elif not (isinstance(value, (list, tuple)) and value):
+            params[name] = stable(value)
+            return
+        if site:
+            inputs[node('context', name)] = self.fingerprint(
+                ('context', name, id(value)),
+                lambda: fingerprint(self.describe(value)))
+            return
+        for item in value:
+            if hasattr(item, 'source_path'):
+                inputs[node('source', item.source_path)] = \
+                    self.source_digest(item.source_path)
+                # the links resolved in the content change with other sources
+                params.setdefault('%s:rendered' % name, []).append(
+                    self.rendered_fingerprint(item))
+            else:
+                params.setdefault(name, []).append(self.describe(item))
+
+    def rendered_fingerprint(self, content):
+        """Fingerprint of the content and summary of ``content`` as rendered
+        for the output being written."""
+        siteurl = content.get_siteurl()
+        return self.fingerprint(
+            ('rendered', id(content), siteurl),
+            lambda: fingerprint(content.get_content(siteurl),
+                                getattr(content, 'summary', None)))
+
+    def describe(self, value):
+        """Describe the metadata of the content objects in ``value``."""
+        if hasattr(value, 'source_path'):
+            return content_fingerprint(value)
+        if isinstance(value, (list, tuple)):
+            return [self.describe(v) for v in value]
+        return stable(value)
+
+    def fingerprint(self, key, compute):
+        """Return the fingerprint ``key`` computed once per build."""
+        if key not in self._fingerprints:
+            self._fingerprints[key] = compute()
+        return self._fingerprints[key]
+
+    def source_digest(self, path):
+        def compute():
+            try:
+                return self.cache.sources.digest(path)
+            except (IOError, OSError):
+                return None
+        return self.fingerprint(('source', path), compute)
+
+    def template_fingerprint(self, env, name):
+        def compute():
+            if name == '*':
+                return fingerprint(sorted(
+                    (n, self.template_fingerprint(env, n))
+                    for n in self.list_templates(env)))
+            source = env.loader.get_source(env, name)[0]
+            return sha256_bytes(source.encode('utf-8'))
+        return self.fingerprint(('template', id(env), name), compute)
+
+    def template_dependencies(self, template):
+        key = (id(template.environment), template.name)
+        if key not in self._templates:
+            self._templates[key] = template_dependencies(
+                template.environment, template.name, self.cache.templates)
+        return self._templates[key]
+
+    def list_templates(self, env):
+        names = []
+        for loader in getattr(env.loader, 'loaders', [env.loader]):
+            try:
+                names.extend(loader.list_templates())
+            except TypeError:
+                continue  # this loader cannot enumerate its templates
+        return sorted(set(names))
+
+    def referenced_variables(self, env):
+        """Return the variables read by any template of ``env``."""
+        def compute():
+            variables = set()
+            for name in self.list_templates(env):
+                variables |= template_dependencies(
+                    env, name, self.cache.templates)[1]
+            return frozenset(variables)
+        return self.fingerprint(('variables', id(env)), compute)
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""Persistent SQLite index of the articles and pages of a site.
+
+The index stores the path, modification time, size, SHA-256 and metadata of
+every source. :meth:`ContentIndex.update` only reads the sources whose
+modification time or size changed since the previous update, so tools can
+query the content of a site without walking and parsing it again::
+
+    from pelican_tools.index import get_index
+
+    index = get_index(settings)
+    for entry in index.query(tag='python', status='published'):
+        print(entry.date, entry.slug, entry.path)
+
+The index lives in ``cache/pelican-tools/index.db`` (see
+``CONTENT_INDEX_PATH``). Metadata is read with :mod:`pelican_tools.scan`:
+the ``title``, ``date``, ``slug``, ``category``, ``status`` and ``lang``
+columns get Pelican's defaults, other fields are kept as written.
+"""
+from __future__ import print_function, unicode_literals
+
+import collections
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pelican_tools.compat import mtime_ns
+from pelican_tools.scan import FORMATS, scan_file
+from pelican_tools.utils import cache_path, iter_files, makedirs, sha256_file
+
+logger = logging.getLogger(__name__)
+
+#: Bumped when the schema changes; older indexes are rebuilt.
+INDEX_VERSION = 1
+
+#: Number of files sent to a worker process at once.
+CHUNK_SIZE = 256
+
+SCHEMA = '''
+CREATE TABLE files (
+    path TEXT PRIMARY KEY, kind TEXT, format TEXT, mtime_ns INTEGER,
+    size INTEGER, hash TEXT, title TEXT, date TEXT, slug TEXT,
+    category TEXT, status TEXT, lang TEXT, metadata TEXT);
+CREATE TABLE tags (path TEXT, tag TEXT);
+CREATE TABLE authors (path TEXT, author TEXT);
+CREATE TABLE metadata (path TEXT, key TEXT, value TEXT);
+CREATE INDEX files_date ON files (date);
+CREATE INDEX files_slug ON files (slug);
+CREATE INDEX files_category ON files (category);
+CREATE INDEX tags_tag ON tags (tag);
+CREATE INDEX tags_path ON tags (path);
+CREATE INDEX authors_author ON authors (author);
+CREATE INDEX authors_path ON authors (path);
+CREATE INDEX metadata_key ON metadata (key, value);
+CREATE INDEX metadata_path ON metadata (path);
+'''
+
+COLUMNS = ('path', 'kind', 'format', 'mtime_ns', 'size', 'hash', 'title',
+           'date', 'slug', 'category', 'status', 'lang', 'metadata')
+
+#: An indexed source. ``path`` is relative to the content directory and uses
+#: ``/`` as separator, ``metadata`` holds every field as written.
+Entry = collections.namedtuple('Entry', COLUMNS)
+
+
+def _hash_and_scan(args):
+    path, fmt = args
+    try:
+        return sha256_file(path), scan_file(path, fmt)
+    except (IOError, OSError, UnicodeError) as e:
+        logger.warning('Could not index %s: %s', path, e)
+        return None
+
+
+class ContentIndex(object):
+    """SQLite index of the sources of the site described by ``settings``.
+
+    The database is created at ``path`` if needed; it is opened in WAL
+    mode, so it can be queried while another process updates it.
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self.root = os.path.abspath(settings['PATH'])
+        makedirs(os.path.dirname(os.path.abspath(path)))
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != INDEX_VERSION:
+            self._create()
+
+    def _create(self):
+        with self.db:
+            for table in ('files', 'tags', 'authors', 'metadata'):
+                self.db.execute('DROP TABLE IF EXISTS %s' % table)
+            self.db.executescript(SCHEMA)
+            self.db.execute('PRAGMA user_version = %d' % INDEX_VERSION)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def clear(self):
+        """Empty the index: the next update reads every source."""
+        self._create()
+
+    # Updating
+
+    def sources(self):
+        """Yield ``(path, kind)`` for the articles and pages of the site,
+        ``path`` being relative to the content directory."""
+        settings = self.settings
+        extensions = set(FORMATS)
+        ignores = settings.get('IGNORE_FILES', ['.#*'])
+        seen = set()
+        for kind in ('page', 'article'):
+            excludes = [e.strip('/') + '/'
+                        for e in settings.get(kind.upper() + '_EXCLUDES', ())]
+            for base in settings.get(kind.upper() + '_PATHS', ()):
+                top = os.path.join(self.root, base) if base else self.root
+                for path in iter_files(top, extensions, ignores):
+                    rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+                    if rel in seen or rel.startswith(tuple(excludes)):
+                        continue
+                    seen.add(rel)
+                    yield rel, kind
+
+    def update(self, jobs=1):
+        """Bring the index up to date with the content directory.
+
+        Sources are hashed when their modification time or size changed,
+        and parsed again when their hash changed. Return the number of
+        ``added``, ``modified``, ``touched`` (same content), ``removed`` and
+        ``unchanged`` sources.
+        """
+        known = dict((row[0], row[1:]) for row in self.db.execute(
+            'SELECT path, kind, mtime_ns, size, hash FROM files'))
+        counts = dict.fromkeys(
+            ('added', 'modified', 'touched', 'removed', 'unchanged'), 0)
+        stale = []
+        for rel, kind in self.sources():
+            path = os.path.join(self.root, rel)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stat = (mtime_ns(st), st.st_size)
+            previous = known.pop(rel, None)
+            if previous is not None and previous[0] == kind and \
+                    tuple(previous[1:3]) == stat:
+                counts['unchanged'] += 1
+                continue
+            stale.append((rel, kind, stat, previous))
+
+        results = self._read([os.path.join(self.root, s[0]) for s in stale],
+                             jobs)
+        with self.db:
+            for (rel, kind, stat, previous), result in zip(stale, results):
+                if result is None:
+                    self._delete(rel)
+                    continue
+                digest, metadata = result
+                if previous is not None and previous[3] == digest and \
+                        previous[0] == kind:
+                    self.db.execute(
+                        'UPDATE files SET mtime_ns = ?, size = ? '
+                        'WHERE path = ?', stat + (rel,))
+                    counts['touched'] += 1
+                    continue
+                self._delete(rel)
+                self._insert(rel, kind, stat, digest, metadata)
+                counts['added' if previous is None else 'modified'] += 1
+            for rel in known:
+                self._delete(rel)
+                counts['removed'] += 1
+        return counts
+
+    def _read(self, paths, jobs):
+        formats = [FORMATS[p.rpartition('.')[2].lower()] for p in paths]
+        items = list(zip(paths, formats))
+        if jobs > 1 and len(items) > CHUNK_SIZE:
+            with ProcessPoolExecutor(jobs) as pool:
+                return list(pool.map(_hash_and_scan, items,
+                                     chunksize=CHUNK_SIZE))
+        return [_hash_and_scan(item) for item in items]
+
+    def _delete(self, rel):
+        for table in ('files', 'tags', 'authors', 'metadata'):
+            self.db.execute('DELETE FROM %s WHERE path = ?' % table, (rel,))
+
+    def _insert(self, rel, kind, stat, digest, metadata):
+        fields = self.defaults(rel, kind, metadata)
+        self.db.execute(
+            'INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (rel, kind, FORMATS[rel.rpartition('.')[2].lower()]) + stat +
+            (digest, fields['title'], fields['date'], fields['slug'],
+             fields['category'], fields['status'], fields['lang'],
+             json.dumps(metadata, sort_keys=True)))
+        self.db.executemany('INSERT INTO tags VALUES (?, ?)',
+                            [(rel, t) for t in metadata.get('tags', ())])
+        authors = metadata.get('authors') or (
+            [metadata['author']] if metadata.get('author') else [])
+        self.db.executemany('INSERT INTO authors VALUES (?, ?)',
+                            [(rel, a) for a in authors])
+        rows = []
+        for key, value in metadata.items():
+            for item in value if isinstance(value, list) else [value]:
+                rows.append((rel, key, item))
+        self.db.executemany('INSERT INTO metadata VALUES (?, ?, ?)', rows)
+
+    def defaults(self, rel, kind, metadata):
+        """Return the indexed columns of a source, with Pelican's defaults
+        for the fields its metadata does not set."""
+        settings = self.settings
+        fields = {
+            'title': metadata.get('title'),
+            'date': _normalize_date(metadata.get('date')),
+            'slug': metadata.get('slug'),
+            'category': metadata.get('category'),
+            'status': metadata.get('status'),
+            'lang': metadata.get('lang') or settings.get('DEFAULT_LANG'),
+        }
+        if not fields['slug']:
+            source = fields['title']
+            if settings.get('SLUGIFY_SOURCE') == 'basename' or not source:
+                source = os.path.splitext(os.path.basename(rel))[0]
+            fields['slug'] = _slugify(source, settings)
+        if kind == 'article':
+            if not fields['category']:
+                folder = os.path.dirname(rel).rpartition('/')[2]
+                if folder and settings.get('USE_FOLDER_AS_CATEGORY', True):
+                    fields['category'] = folder
+                else:
+                    fields['category'] = settings.get('DEFAULT_CATEGORY',
+                                                      'misc')
+        if not fields['status']:
+            fields['status'] = 'published'
+        return fields
+
+    # Querying
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def _entries(self, sql, params=()):
+        for row in self.db.execute(sql, params):
+            yield Entry(*(row[:-1] + (json.loads(row[-1]),)))
+
+    def get(self, path):
+        """Return the :class:`Entry` of ``path`` (relative to the content
+        directory), or None."""
+        for entry in self._entries('SELECT * FROM files WHERE path = ?',
+                                   (path,)):
+            return entry
+        return None
+
+    def files(self, kind=None):
+        """Yield the entries of all the sources, or only of the given
+        ``kind`` (``article`` or ``page``), in path order."""
+        if kind is None:
+            return self._entries('SELECT * FROM files ORDER BY path')
+        return self._entries(
+            'SELECT * FROM files WHERE kind = ? ORDER BY path', (kind,))
+
+    def query(self, kind=None, tag=None, category=None, author=None,
+              slug=None, status=None, lang=None, since=None, until=None,
+              order='date', reverse=False, limit=None):
+        """Yield the entries matching all the given criteria.
+
+        ``since`` and ``until`` are ISO dates (or prefixes of them, such as
+        ``2020-05``) and include their bounds. Entries are sorted by
+        ``order``, one of :data:`COLUMNS`.
+        """
+        if order not in COLUMNS:
+            raise ValueError('Cannot sort by %r' % order)
+        where, params = [], []
+        for column, value in (('kind', kind), ('category', category),
+                              ('slug', slug), ('status', status),
+                              ('lang', lang)):
+            if value is not None:
+                where.append('%s = ?' % column)
+                params.append(value)
+        if tag is not None:
+            where.append('path IN (SELECT path FROM tags WHERE tag = ?)')
+            params.append(tag)
+        if author is not None:
+            where.append(
+                'path IN (SELECT path FROM authors WHERE author = ?)')
+            params.append(author)
+        if since is not None:
+            where.append('date >= ?')
+            params.append(since)
+        if until is not None:
+            # a prefix includes every date starting with it
+            where.append('date < ?')
+            params.append(until + '\uffff')
+        sql = 'SELECT * FROM files'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY %s %s, path' % (order, 'DESC' if reverse else 'ASC')
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+        return self._entries(sql, params)
+
+    def stat(self, path):
+        """Return ``(mtime_ns, size, hash)`` as recorded for ``path``, or
+        None."""
+        return self.db.execute(
+            'SELECT mtime_ns, size, hash FROM files WHERE path = ?',
+            (path,)).fetchone()
+
+    def _counts(self, sql):
+        return collections.OrderedDict(self.db.execute(sql))
+
+    def tags(self):
+        """Return a mapping of tag to number of sources, sorted by tag."""
+        return self._counts('SELECT tag, COUNT(*) FROM tags '
+                            'GROUP BY tag ORDER BY tag')
+
+    def authors(self):
+        return self._counts('SELECT author, COUNT(*) FROM authors '
+                            'GROUP BY author ORDER BY author')
+
+    def categories(self):
+        return self._counts("SELECT category, COUNT(*) FROM files "
+                            "WHERE kind = 'article' "
+                            "GROUP BY category ORDER BY category")
+
+
+def _normalize_date(value):
+    """Return the ISO form of a date as written in metadata, so that dates
+    sort correctly, or the value itself if it cannot be parsed."""
+    if not value:
+        return None
+    try:
+        from pelican.utils import get_date
+        return get_date(value).isoformat()
+    except (ImportError, ValueError, OverflowError):
+        return value
+
+
+def _slugify(value, settings):
+    from pelican.utils import slugify
+    return slugify(value,
+                   regex_subs=settings.get('SLUG_REGEX_SUBSTITUTIONS', ()))
+
+
+def index_path(settings):
+    return settings.get('CONTENT_INDEX_PATH') or cache_path(settings,
+                                                            'index.db')
+
+
+def get_index(settings, update=True, jobs=1):
+    """Open the index of the site described by ``settings``, updating it
+    first unless ``update`` is false."""
+    index = ContentIndex(index_path(settings), settings)
+    if update:
+        start = time.time()
+        counts = index.update(jobs)
+        logger.info('Updated the content index in %.2fs: %s',
+                    time.time() - start,
+                    ', '.join('%d %s' % (n, name)
+                              for name, n in sorted(counts.items())))
+    return index
+
+
+def setup_parser(parser):
+    from pelican_tools.utils import add_settings_arguments
+    add_settings_arguments(parser)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Processes reading changed sources (default: '
+                        '%(default)s).')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Read every source again.')
+    parser.add_argument('--no-update', action='store_false', dest='update',
+                        help='Query the index without updating it.')
+    group = parser.add_argument_group('queries')
+    group.add_argument('--list', action='store_true',
+                       help='List the matching sources (all of them when no '
+                       'criteria is given).')
+    for name in ('kind', 'tag', 'category', 'author', 'slug', 'status',
+                 'lang', 'since', 'until'):
+        group.add_argument('--' + name)
+    group.add_argument('--json', action='store_true',
+                       help='Print the matching entries as JSON lines.')
+    group.add_argument('--counts', choices=('tags', 'categories', 'authors'),
+                       help='Print the number of sources per tag, category '
+                       'or author.')
+    parser.set_defaults(func=command)
+
+
+def command(args):
+    from pelican_tools.utils import settings_from_args
+    settings = settings_from_args(args)
+    with ContentIndex(index_path(settings), settings) as index:
+        if args.rebuild:
+            index.clear()
+        if args.update:
+            start = time.time()
+            counts = index.update(args.jobs)
+            print('Indexed %d sources in %.2fs: %s' % (
+                len(index), time.time() - start,
+                ', '.join('%d %s' % (counts[name], name) for name in
+                          ('added', 'modified', 'touched', 'removed',
+                           'unchanged'))), file=sys.stderr)
+        if args.counts:
+            for name, count in getattr(index, args.counts)().items():
+                print('%6d  %s' % (count, name))
+            return 0
+        criteria = dict((name, getattr(args, name)) for name in
+                        ('kind', 'tag', 'category', 'author', 'slug',
+                         'status', 'lang', 'since', 'until'))
+        if not (args.list or args.json or any(criteria.values())):
+            return 0
+        for entry in index.query(**criteria):
+            if args.json:
+                print(json.dumps(entry._asdict(), sort_keys=True))
+            else:
+                print('%s  %-10s %s' % ((entry.date or '-')[:10],
+                                        entry.status, entry.path))
+    return 0
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Shared on-disk cache of compiled theme templates.
+
+Add ``pelican_tools.jinja_cache`` to ``PLUGINS`` to store the Python code
+Jinja2 compiles templates to in ``JINJA_BYTECODE_CACHE_PATH`` (by default a
+``jinja`` directory in the pelican-tools cache), so that later builds load
+it instead of compiling the templates again.
+
+Entries are keyed by the SHA-256 of the template source, name and file and
+of the environment options affecting compilation (delimiters, extensions,
+...), so sites and processes can share one cache directory: a theme used by
+several sites is compiled once, and a site with other Jinja2 options gets
+its own entries. Entries are written atomically.
+"""
+from __future__ import unicode_literals
+
+import io
+import logging
+import sys
+import threading
+import weakref
+
+from jinja2 import __version__ as jinja_version
+from jinja2.bccache import Bucket, FileSystemBytecodeCache
+
+from pelican_tools.utils import (atomic_write, cache_path, makedirs,
+                                 sha256_bytes)
+
+logger = logging.getLogger(__name__)
+
+#: Environment attributes changing the code a template compiles to.
+ENVIRONMENT_OPTIONS = (
+    'block_start_string', 'block_end_string', 'variable_start_string',
+    'variable_end_string', 'comment_start_string', 'comment_end_string',
+    'line_statement_prefix', 'line_comment_prefix', 'trim_blocks',
+    'lstrip_blocks', 'newline_sequence', 'keep_trailing_newline',
+    'optimized', 'autoescape', 'is_async', 'enable_async',
+)
+
+
+def environment_signature(env):
+    """Return a string identifying the compilation options of ``env``."""
+    options = []
+    for name in ENVIRONMENT_OPTIONS:
+        value = getattr(env, name, None)
+        if callable(value):
+            value = '%s.%s' % (getattr(value, '__module__', ''),
+                               getattr(value, '__name__', ''))
+        options.append('%s=%r' % (name, value))
+    options.append('extensions=%s' % ','.join(sorted(env.extensions)))
+    options.append('jinja=%s' % jinja_version)
+    options.append('python=%d.%d' % sys.version_info[:2])
+    return ';'.join(options)
+
+
+class SourceHashBytecodeCache(FileSystemBytecodeCache):
+    """Bytecode cache keyed by the hash of template sources.
+
+    Jinja2's default keys only depend on the template name and file, so a
+    cache shared by sites with different options would thrash or return
+    code compiled for another environment. ``hits``, ``misses``,
+    ``bytes_read`` and ``bytes_written`` count the cache activity; they are
+    updated from several threads.
+    """
+
+    def __init__(self, directory):
+        makedirs(directory)
+        super(SourceHashBytecodeCache, self).__init__(directory, '%s.cache')
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+        self._signatures = weakref.WeakKeyDictionary()
+
+    def get_cache_key(self, name, filename=None, source=None, env=None):
+        signature = self._signatures.get(env)
+        if signature is None:
+            signature = self._signatures[env] = environment_signature(env)
+        return sha256_bytes('\0'.join((
+            sha256_bytes(source.encode('utf-8')), name or '',
+            filename or '', signature)).encode('utf-8'))
+
+    def get_bucket(self, environment, name, filename, source):
+        key = self.get_cache_key(name, filename, source, environment)
+        bucket = Bucket(environment, key, self.get_source_checksum(source))
+        self.load_bytecode(bucket)
+        return bucket
+
+    def load_bytecode(self, bucket):
+        try:
+            with open(self._get_cache_filename(bucket), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            data = b''
+        if data:
+            bucket.load_bytecode(io.BytesIO(data))
+        with self._lock:
+            if bucket.code is not None:
+                self.hits += 1
+                self.bytes_read += len(data)
+            else:
+                self.misses += 1
+
+    def dump_bytecode(self, bucket):
+        f = io.BytesIO()
+        bucket.write_bytecode(f)
+        data = f.getvalue()
+        try:
+            atomic_write(self._get_cache_filename(bucket), data)
+        except (IOError, OSError) as e:
+            logger.warning('Cannot store compiled template: %s', e)
+            return
+        with self._lock:
+            self.bytes_written += len(data)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written}
+
+
+_caches = {}
+
+
+def get_cache(settings):
+    """Return the bytecode cache configured by ``settings``, shared by all
+    the environments of the process using the same directory."""
+    directory = settings.get('JINJA_BYTECODE_CACHE_PATH') or cache_path(
+        settings, 'jinja')
+    if directory not in _caches:
+        _caches[directory] = SourceHashBytecodeCache(directory)
+    return _caches[directory]
+
+
+def install(generator):
+    env = getattr(generator, 'env', None)
+    if env is not None and env.bytecode_cache is None:
+        env.bytecode_cache = get_cache(generator.settings)
+
+
+def report(pelican):
+    cache = get_cache(pelican.settings)
+    logger.info('Jinja2 bytecode cache: %d hits, %d misses, %d bytes read, '
+                '%d bytes written', cache.hits, cache.misses,
+                cache.bytes_read, cache.bytes_written)
+
+
+def register():
+    from pelican import signals
+    signals.generator_init.connect(install)
+    signals.finalized.connect(report)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Manifests of output directories: path, size, SHA-256 and MIME type of
+every file.
+
+Deploy scripts, CDN purges and link checkers can read the manifest instead
+of hashing the output directory again, and ``pelican-manifest diff`` lists
+the files added, changed and removed between two builds without reading
+any of them::
+
+    pelican-manifest build output -o manifest.json
+    pelican-manifest diff old-manifest.json manifest.json
+
+Files are hashed in a pool of threads, and the digests of the previous
+manifest are reused for files whose size and modification time did not
+change. Add ``pelican_tools.manifest`` to ``PLUGINS`` to write
+``cache/pelican-tools/manifest.json`` (see ``MANIFEST_PATH``) at the end of
+every build, the previous one being kept as ``manifest.previous.json``.
+
+The manifest is compact JSON mapping the paths, relative to the output
+directory and with ``/`` separators, to ``[size, mtime_ns, sha256, mime]``.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import logging
+import mimetypes
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pelican_tools.utils import (cache_path, dump_json, iter_files,
+                                 load_json, settings_from_args, sha256_file,
+                                 stat_key)
+
+logger = logging.getLogger(__name__)
+
+#: Bumped when the manifest format changes.
+MANIFEST_VERSION = 1
+
+DEFAULT_MIME_TYPE = 'application/octet-stream'
+
+
+def mime_type(path):
+    return mimetypes.guess_type(path)[0] or DEFAULT_MIME_TYPE
+
+
+class Manifest(object):
+    """Files of an output directory, by path relative to it."""
+
+    def __init__(self, files=None, root=None):
+        self.files = files or {}
+        self.root = root
+        self.hashed = 0
+        self.reused = 0
+
+    @classmethod
+    def load(cls, path):
+        """Load the manifest stored in ``path``, empty if there is none."""
+        data = load_json(path, {})
+        if data.get('version') != MANIFEST_VERSION:
+            return cls()
+        return cls(data.get('files'), data.get('root'))
+
+    def save(self, path):
+        dump_json(path, {'version': MANIFEST_VERSION, 'root': self.root,
+                         'files': self.files})
+
+    def diff(self, new):
+        """Return the sorted paths added, changed and removed in the
+        manifest ``new``."""
+        old_files, new_files = self.files, new.files
+        added = sorted(set(new_files) - set(old_files))
+        removed = sorted(set(old_files) - set(new_files))
+        changed = sorted(
+            path for path, entry in new_files.items()
+            if path in old_files and old_files[path][2] != entry[2])
+        return added, changed, removed
+
+
+def _hash(item):
+    rel, path, key = item
+    try:
+        return rel, key, sha256_file(path)
+    except (IOError, OSError) as e:
+        logger.warning('Cannot read %s: %s', path, e)
+        return rel, key, None
+
+
+def build_manifest(output_path, previous=None, jobs=None, exclude=()):
+    """Return the :class:`Manifest` of ``output_path``, reusing the digests
+    of the ``previous`` one for the files whose size and mtime are
+    unchanged.
+
+    ``exclude`` holds absolute paths left out of the manifest.
+    """
+    root = os.path.abspath(output_path)
+    previous = previous.files if previous is not None else {}
+    exclude = set(os.path.abspath(path) for path in exclude)
+    manifest = Manifest(root=root)
+    pending = []
+    for path in iter_files(root):
+        if path in exclude:
+            continue
+        rel = os.path.relpath(path, root).replace(os.sep, '/')
+        try:
+            key = stat_key(path)
+        except OSError:
+            continue
+        entry = previous.get(rel)
+        if entry is not None and entry[1] == key[0] and entry[0] == key[1]:
+            manifest.files[rel] = entry
+            manifest.reused += 1
+        else:
+            pending.append((rel, path, key))
+    jobs = jobs or multiprocessing.cpu_count()
+    with ThreadPoolExecutor(jobs) as pool:
+        for rel, (mtime, size), digest in pool.map(_hash, pending):
+            if digest is not None:
+                manifest.files[rel] = [size, mtime, digest, mime_type(rel)]
+                manifest.hashed += 1
+    return manifest
+
+
+def manifest_path(settings):
+    return settings.get('MANIFEST_PATH') or cache_path(settings,
+                                                       'manifest.json')
+
+
+def previous_path(path):
+    root, ext = os.path.splitext(path)
+    return '%s.previous%s' % (root, ext)
+
+
+def save_manifest(manifest, path):
+    """Save ``manifest`` to ``path``, keeping the manifest it replaces as
+    :func:`previous_path`."""
+    if os.path.exists(path):
+        shutil.copyfile(path, previous_path(path))
+    manifest.save(path)
+
+
+def write_manifest(pelican):
+    from pelican_tools import writer
+    writer.drain()
+    path = manifest_path(pelican.settings)
+    start = time.time()
+    previous = Manifest.load(path)
+    manifest = build_manifest(pelican.output_path, previous,
+                              pelican.settings.get('MANIFEST_JOBS'),
+                              exclude=[path])
+    save_manifest(manifest, path)
+    added, changed, removed = previous.diff(manifest)
+    logger.info('Manifest of %d files written in %.2fs (%d hashed): %d '
+                'added, %d changed, %d removed', len(manifest.files),
+                time.time() - start, manifest.hashed, len(added),
+                len(changed), len(removed))
+
+
+def register():
+    from pelican import signals
+    signals.finalized.connect(write_manifest)
+
+
+def build_command(args):
+    settings = settings_from_args(args)
+    output = settings['OUTPUT_PATH']
+    if not os.path.isdir(output):
+        logger.error('%s is not a directory', output)
+        return 1
+    path = args.manifest or manifest_path(settings)
+    previous = Manifest.load(args.previous or path)
+    start = time.time()
+    manifest = build_manifest(output, previous, args.jobs, exclude=[path])
+    save_manifest(manifest, path)
+    print('%d files, %d hashed, %d reused in %.2fs' % (
+        len(manifest.files), manifest.hashed, manifest.reused,
+        time.time() - start))
+    return 0
+
+
+def diff_command(args):
+    old_path = args.old
+    new_path = args.new
+    if new_path is None:
+        new_path = old_path or manifest_path(settings_from_args(args))
+        old_path = previous_path(new_path)
+    start = time.time()
+    added, changed, removed = Manifest.load(old_path).diff(
+        Manifest.load(new_path))
+    for status, paths in (('A', added), ('M', changed), ('D', removed)):
+        for path in paths:
+            print('%s %s' % (status, path) if not args.names_only else path)
+    logger.info('%d added, %d changed, %d removed in %.1fms', len(added),
+                len(changed), len(removed), (time.time() - start) * 1000)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pelican-manifest',
+        description='Write the manifest of a Pelican output directory, or '
+        'compare two manifests.')
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        const=logging.INFO, dest='verbosity',
+                        default=logging.WARNING, help='Show all messages.')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    build = subparsers.add_parser(
+        'build', help='Write the manifest of an output directory.')
+    build.add_argument('output', nargs='?',
+                       help='Output directory (default: OUTPUT_PATH of the '
+                       'settings, or output).')
+    build.add_argument('-o', '--manifest',
+                       help='Manifest file (default: MANIFEST_PATH or '
+                       'manifest.json in the pelican-tools cache '
+                       'directory).')
+    build.add_argument('-s', '--settings',
+                       help='Pelican settings file to read the output and '
+                       'manifest paths from (default: pelicanconf.py if it '
+                       'exists).')
+    build.add_argument('--previous',
+                       help='Manifest whose digests are reused (default: '
+                       'the manifest file).')
+    build.add_argument('-j', '--jobs', type=int,
+                       help='Number of hashing threads (default: the number '
+                       'of cores).')
+    build.set_defaults(func=build_command, path=None, theme=None)
+
+    diff = subparsers.add_parser(
+        'diff', help='List the paths added (A), changed (M) and removed (D) '
+        'between two manifests.')
+    diff.add_argument('old', nargs='?',
+                      help='Old manifest (default: the previous manifest '
+                      'kept by the plugin or the build command).')
+    diff.add_argument('new', nargs='?',
+                      help='New manifest (default: the manifest written by '
+                      'the plugin or the build command).')
+    diff.add_argument('--names-only', action='store_true',
+                      help='Only print the paths.')
+    diff.add_argument('-s', '--settings',
+                      help='Pelican settings file to read the manifest path '
+                      'from (default: pelicanconf.py if it exists).')
+    diff.set_defaults(func=diff_command, path=None, output=None, theme=None)
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 2
+    logging.basicConfig(level=args.verbosity,
+                        format='%(levelname)s: %(message)s')
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
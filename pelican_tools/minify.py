@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""Minify HTML output in a single streaming pass.
+
+Add ``pelican_tools.minify`` to ``PLUGINS`` to minify every HTML page as it
+is written, in a pool of ``MINIFY_JOBS`` processes (all the cores by
+default). ``pelican-tools minify`` minifies the pages of an existing output
+directory.
+
+The minifier does not build a document tree: it tokenizes the HTML as it
+arrives, removes comments (except conditional comments and ``<!--!``
+comments), collapses runs of whitespace and drops whitespace next to block
+elements and inside ``<head>``. The content of ``<pre>``, ``<textarea>``,
+``<script>`` and ``<style>`` elements, attribute values and non-breaking
+spaces are left untouched. Like in browsers, a ``<`` which is not followed
+by a letter, ``/`` and a letter, ``!`` or ``?`` is text.
+"""
+from __future__ import print_function, unicode_literals
+
+import io
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pelican.writers import Writer
+
+from pelican_tools import writer
+from pelican_tools.utils import atomic_write, iter_files
+
+logger = logging.getLogger(__name__)
+
+#: Elements whose content is copied as is.
+RAW_TAGS = ('pre', 'textarea', 'script', 'style')
+
+#: Elements next to which whitespace is not rendered.
+BLOCK_TAGS = frozenset('''
+    address article aside blockquote body br caption col colgroup dd details
+    dialog div dl dt fieldset figcaption figure footer form h1 h2 h3 h4 h5
+    h6 head header hgroup hr html legend li link main menu meta nav ol
+    optgroup option p pre section source style summary table tbody td
+    template tfoot th thead title tr track ul
+'''.split())
+
+#: Extensions of the files minified by the plugin.
+EXTENSIONS = ('html', 'htm')
+
+_token = re.compile(r'''
+      (<!--.*?-->)                                      # 1: comment
+    | <(pre|textarea|script|style)(?=[ \t\n\r\f/>])       # 2: raw element
+      (?:[^>"']|"[^"]*"|'[^']*')*>.*?</\2[ \t\n\r\f]*>
+    | (<(?:/?([a-zA-Z][a-zA-Z0-9-]*)|[!?])              # 3: tag, 4: name
+      (?:[^<>"']|"[^"]*"|'[^']*')*>)
+      ([ \t\n\r\f]*)                                    # 5: whitespace
+    | ((?:[^<]+|<(?![a-zA-Z!?]|/[a-zA-Z]))+)            # 6: text
+''', re.S | re.I | re.X)
+# not \s, which matches non-breaking spaces
+_spaces = re.compile(r'[ \t\n\r\f]+')
+_tag_spaces = re.compile(r'''("[^"]*"|'[^']*')|[ \t\n\r\f]+''')
+_tag_end_spaces = re.compile(r'[ \t\n\r\f]+(/?>)$')
+_kept_comments = ('<!--[if', '<!--<![endif', '<!--!')
+_raw_tags = frozenset(RAW_TAGS)
+
+
+def _collapse(text):
+    if '  ' in text or '\n' in text or '\t' in text or '\r' in text or \
+            '\f' in text:
+        return _spaces.sub(' ', text)
+    return text
+
+
+class HTMLMinifier(object):
+    """Incremental HTML minifier.
+
+    :meth:`feed` returns the minified form of the data given so far,
+    keeping back an incomplete token until more data or :meth:`close`.
+    Text is only output with the token following it, which tells whether
+    its trailing whitespace is rendered.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._text = ''
+        self._prev_block = True
+        self._in_head = False
+
+    def feed(self, data):
+        self._buffer += data
+        return self._process(False)
+
+    def close(self):
+        out = self._process(True)
+        text, self._text = self._text, ''
+        return out + text.rstrip(' ')
+
+    def _process(self, final):
+        buf = self._buffer
+        size = len(buf)
+        pos = 0
+        out = []
+        append = out.append
+        text = self._text  # pending, with whitespace collapsed
+        prev_block = self._prev_block
+        in_head = self._in_head
+        match = _token.match
+        while pos < size:
+            m = match(buf, pos)
+            kind = m.lastindex if m else None
+            end = m.end() if m else pos
+            if kind == 6:
+                if end == size and not final:
+                    break  # the text may go on
+                data = _collapse(m.group(6))
+                if data[0] == ' ' and (text[-1:] == ' ' if text else
+                                       prev_block or in_head):
+                    data = data[1:]
+                text += data
+                pos = end
+                continue
+            if kind == 5:
+                if end == size and not final:
+                    break  # so may the whitespace
+                name = m.group(4)
+                if name is not None:
+                    name = name.lower()
+                    closing = buf[pos + 1] == '/'
+                    if name in _raw_tags and not closing:
+                        kind = None  # the end tag is not in the buffer
+                elif buf.startswith('<!--', pos):
+                    kind = None  # neither is the end of the comment
+            if kind is None:
+                if not final:
+                    break
+                if m is not None:
+                    # unterminated element or comment: keep the rest as is
+                    if text:
+                        append(text)
+                        text = ''
+                    append(buf[pos:])
+                    pos = size
+                else:
+                    if text:
+                        prev_block = False
+                    text += '<'
+                    pos += 1
+                continue
+            if kind == 1:
+                if buf.startswith(_kept_comments, pos):
+                    if text:
+                        append(text)
+                        text = ''
+                        prev_block = False
+                    append(m.group())
+                pos = end
+                continue
+
+            if kind == 2:
+                name = m.group(2).lower()
+                tag = m.group()
+                space = ''
+            else:
+                tag = m.group(3)
+                space = m.group(5)
+                if '\n' in tag or '  ' in tag or '\t' in tag:
+                    tag = _tag_spaces.sub(lambda t: t.group(1) or ' ', tag)
+                    tag = _tag_end_spaces.sub(r'\1', tag)
+                if name == 'head':
+                    in_head = not closing
+            block = name is None or name in BLOCK_TAGS
+            if text:
+                if block or in_head:
+                    text = text.rstrip(' ')
+                if text:
+                    append(text)
+            append(tag)
+            prev_block = block
+            # whitespace after a block element is not rendered
+            text = ' ' if space and not block and not in_head else ''
+            pos = end
+        self._buffer = buf[pos:]
+        self._text = text
+        self._prev_block = prev_block
+        self._in_head = in_head
+        return ''.join(out)
+
+
+def minify(html):
+    """Return the minified form of the HTML document ``html``."""
+    minifier = HTMLMinifier()
+    return minifier.feed(html) + minifier.close()
+
+
+def minify_file(path, chunk_size=64 * 1024):
+    """Minify the HTML file at ``path`` in place, reading it by chunks.
+
+    Return the sizes in bytes before and after.
+    """
+    minifier = HTMLMinifier()
+    out = []
+    with io.open(path, encoding='utf-8') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            out.append(minifier.feed(chunk))
+    out.append(minifier.close())
+    data = ''.join(out).encode('utf-8')
+    before = os.path.getsize(path)
+    if len(data) != before:
+        atomic_write(path, data)
+    return before, len(data)
+
+
+def _minify_chunk(paths):
+    return [minify_file(path) for path in paths]
+
+
+def minify_files(paths, jobs=None, chunk_size=16):
+    """Minify ``paths`` in place in ``jobs`` processes, returning the total
+    sizes before and after."""
+    paths = list(paths)
+    chunks = [paths[i:i + chunk_size]
+              for i in range(0, len(paths), chunk_size)]
+    jobs = jobs or multiprocessing.cpu_count()
+    before = after = 0
+    if jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            results = [r for chunk in pool.map(_minify_chunk, chunks)
+                       for r in chunk]
+    else:
+        results = _minify_chunk(paths)
+    for b, a in results:
+        before += b
+        after += a
+    return before, after
+
+
+def _pool_context():
+    # the pool is started from the threads of the writer: a process forked
+    # then could inherit locks held by the other threads
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class _MinifiedFile(io.StringIO):
+    """Collects a page, minified and written to ``target`` on close."""
+
+    def __init__(self, writer, target):
+        super(_MinifiedFile, self).__init__()
+        self.writer = writer
+        self.target = target
+
+    def close(self):
+        if not self.closed:
+            html = self.getvalue()
+            super(_MinifiedFile, self).close()
+            self.writer.minify_to(html, self.target)
+
+
+class MinifyWriter(Writer):
+    """Writer minifying HTML pages in a pool of processes.
+
+    Pages are minified and written asynchronously: :meth:`drain` waits until
+    all of them are written. At most four pages per process are in flight,
+    which bounds the number of open files. The processes are not forked
+    from the build, whose writer threads may hold locks.
+    """
+
+    writer_priority = 15
+
+    def __init__(self, output_path, settings=None):
+        super(MinifyWriter, self).__init__(output_path, settings=settings)
+        self.jobs = self.settings.get('MINIFY_JOBS') or \
+            multiprocessing.cpu_count()
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(self.jobs * 4)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._errors = []
+        self.pages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        writer.track(self)
+
+    def _open_w(self, filename, encoding, override=False):
+        f = super(MinifyWriter, self)._open_w(filename, encoding,
+                                              override=override)
+        if filename.rpartition('.')[2].lower() in EXTENSIONS:
+            return _MinifiedFile(self, f)
+        return f
+
+    def minify_to(self, html, target):
+        """Minify ``html`` and write it to the file object ``target``,
+        closing it."""
+        if self.jobs <= 1:
+            self._write(target, len(html), minify(html))
+            return
+        self._slots.acquire()
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    self.jobs, mp_context=_pool_context())
+            future = self._pool.submit(minify, html)
+            self._pending.add(future)
+        future.add_done_callback(
+            lambda f: self._done(f, target, len(html)))
+
+    def _done(self, future, target, size):
+        try:
+            self._write(target, size, future.result())
+        except Exception:
+            logger.debug('Failed to minify %s', getattr(target, 'name', ''),
+                         exc_info=True)
+            self._errors.append(sys.exc_info())
+        finally:
+            with self._lock:
+                self._pending.discard(future)
+            self._slots.release()
+
+    def _write(self, target, size, html):
+        try:
+            target.write(html)
+        finally:
+            target.close()
+        with self._lock:
+            self.pages += 1
+            self.bytes_in += size
+            self.bytes_out += len(html)
+
+    def drain(self):
+        """Wait until every page has been minified and written."""
+        parent = getattr(super(MinifyWriter, self), 'drain', None)
+        if parent is not None:
+            parent()
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                break
+            for future in pending:
+                future.exception()  # waits
+            time.sleep(0)  # let the callbacks run
+        if self._errors:
+            exc = self._errors[0][1]
+            del self._errors[:]
+            raise exc
+
+    def close(self):
+        parent = getattr(super(MinifyWriter, self), 'close', None)
+        if parent is not None:
+            parent()
+        self.drain()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self.pages:
+            logger.info('Minified %d pages from %d to %d characters '
+                        '(%.1f%% saved)', self.pages, self.bytes_in,
+                        self.bytes_out,
+                        100.0 * (self.bytes_in - self.bytes_out) /
+                        self.bytes_in)
+
+
+def register():
+    from pelican import signals
+    writer.use(MinifyWriter)
+    signals.finalized.connect(writer.close_writers)
+
+
+def setup_parser(parser):
+    parser.add_argument('output', nargs='?', default='output',
+                        help='Output directory (default: %(default)s).')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Number of processes (default: %(default)s).')
+    parser.set_defaults(func=command)
+
+
+def command(args):
+    files = list(iter_files(args.output, set(EXTENSIONS)))
+    start = time.time()
+    before, after = minify_files(files, args.jobs)
+    elapsed = time.time() - start
+    print('Minified %d files from %d to %d bytes (%.1f%% saved) in %.2fs, '
+          '%.1f MB/s' % (len(files), before, after,
+                         100.0 * (before - after) / before if before else 0,
+                         elapsed, before / 1e6 / elapsed if elapsed else 0))
+    return 0
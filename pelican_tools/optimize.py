@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""Recompress the PNG and JPEG images of an output directory.
+
+``pelican-optimize-images`` (or the ``pelican_tools.optimize`` plugin, at
+the end of every build) saves every PNG image again with Pillow's
+``optimize`` option, keeping the new file when it is smaller: the pixels,
+transparency, ICC profile and EXIF data are kept as they are, and the other
+ancillary chunks (gamma, sRGB and chromaticities, text, background...) are
+copied over. Images with chunks Pillow cannot write back are left alone.
+
+JPEG images are only recompressed with ``--jpeg`` (or
+``OPTIMIZE_IMAGES_JPEG = True``), as optimized progressive JPEGs encoded
+with their own quantization tables and chroma subsampling
+(``quality='keep'``). This is lossy: Pillow cannot transcode a JPEG image
+without decoding it, so this changes some pixels slightly, once: the
+optimized image is memoized as already optimal.
+
+Images are optimized in a pool of processes (``-j``,
+``OPTIMIZE_IMAGES_JOBS``) fed a few images at a time, so memory use does
+not grow with the number of images. Results are memoized by SHA-256 in
+``cache/pelican-tools/optimized`` (see ``OPTIMIZE_IMAGES_STORE_PATH``): the
+optimized version of an image, or the fact that it cannot be made smaller,
+is recorded once and for all, and images copied again by Pelican are
+replaced by their optimized version without optimizing them again. Images
+whose size and modification time did not change since they were optimized
+are not even read (see ``OPTIMIZE_IMAGES_CACHE_PATH``).
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import io
+import logging
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from pelican_tools.compat import mtime_ns
+from pelican_tools.utils import (atomic_write, cache_path, dump_json,
+                                 iter_files, load_json, sha256_bytes)
+
+try:
+    from PIL import Image, PngImagePlugin
+except ImportError:  # pragma: no cover
+    Image = PngImagePlugin = None
+
+logger = logging.getLogger(__name__)
+
+#: Bumped when the cache format or the way images are optimized changes.
+CACHE_VERSION = 2
+
+#: Extension to Pillow format.
+FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG'}
+
+#: Modes Pillow writes to PNG without changing the pixels.
+PNG_MODES = frozenset(['1', 'L', 'LA', 'P', 'RGB', 'RGBA'])
+
+#: PNG chunks Pillow writes from the options given to ``save``.
+PNG_OPTION_CHUNKS = frozenset([b'IHDR', b'PLTE', b'IDAT', b'IEND', b'iCCP',
+                               b'tRNS', b'pHYs', b'eXIf'])
+
+#: Ancillary PNG chunks Pillow writes back from a ``PngInfo``.
+PNG_INFO_CHUNKS = frozenset([b'cHRM', b'cICP', b'gAMA', b'sBIT', b'sRGB',
+                             b'tIME', b'sPLT', b'iTXt', b'tEXt', b'zTXt',
+                             b'bKGD', b'hIST'])
+
+#: Number of images sent to a worker process at once.
+CHUNK_SIZE = 4
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [mtime_ns(st), st.st_size]
+
+
+def memo_key(data):
+    """Return the key of the image ``data`` in the memo store."""
+    return sha256_bytes(('%s:%d' % (sha256_bytes(data), CACHE_VERSION)
+                         ).encode('ascii'))
+
+
+def png_chunks(data):
+    """Yield the type, data and whether it follows the image data of every
+    chunk of the PNG image ``data``."""
+    pos = 8
+    after_idat = False
+    while pos + 8 <= len(data):
+        length, cid = struct.unpack('>I4s', data[pos:pos + 8])
+        yield cid, data[pos + 8:pos + 8 + length], after_idat
+        after_idat = after_idat or cid == b'IDAT'
+        pos += length + 12
+
+
+def png_info(data, image):
+    """Return a ``PngInfo`` holding the ancillary chunks of the PNG image
+    ``data`` that ``save`` would not write, or None if one of them cannot
+    be written back."""
+    info = PngImagePlugin.PngInfo()
+    for cid, chunk, after_idat in png_chunks(data):
+        if cid in PNG_OPTION_CHUNKS:
+            if cid == b'pHYs' and 'dpi' not in image.info:
+                # an aspect ratio, which Pillow does not write
+                return None
+        elif cid in PNG_INFO_CHUNKS:
+            info.add(cid, chunk)
+        elif cid[1:2].islower() and cid[3:4].islower():
+            # private chunks are kept if they are safe to copy
+            info.add(cid, chunk, after_idat)
+        else:
+            return None
+    return info
+
+
+def optimize(data, fmt):
+    """Return ``data``, an image in the Pillow format ``fmt``, saved again
+    with the ``optimize`` option, or None if it cannot be done without
+    changing the image or losing some of its metadata."""
+    image = Image.open(io.BytesIO(data))
+    if getattr(image, 'is_animated', False) or image.format != fmt:
+        return None
+    options = dict((name, image.info[name])
+                   for name in ('icc_profile', 'exif', 'dpi')
+                   if image.info.get(name))
+    if fmt == 'PNG':
+        if image.mode not in PNG_MODES:
+            return None
+        pnginfo = png_info(data, image)
+        if pnginfo is None:
+            return None
+        if 'transparency' in image.info:
+            options['transparency'] = image.info['transparency']
+        options.update(pnginfo=pnginfo, optimize=True)
+    else:
+        options.update(quality='keep', subsampling='keep', optimize=True,
+                       progressive=True)
+    f = io.BytesIO()
+    image.save(f, fmt, **options)
+    return f.getvalue()
+
+
+def optimize_file(path, store):
+    """Optimize the image ``path`` through the memo ``store``, and return
+    its sizes before and after, and whether it was optimized now.
+
+    The store holds ``<key>.opt``, the optimized version of an image, and
+    ``<key>.ok``, an empty file recording that an image cannot be
+    made smaller.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    key = memo_key(data)
+    blob = os.path.join(store, key[:2], key)
+    if os.path.exists(blob + '.ok'):
+        return len(data), len(data), False
+    if os.path.exists(blob + '.opt'):
+        with open(blob + '.opt', 'rb') as f:
+            optimized = f.read()
+        fresh = False
+    else:
+        fmt = FORMATS[path.rpartition('.')[2].lower()]
+        optimized = optimize(data, fmt)
+        fresh = True
+        if optimized is None or len(optimized) >= len(data):
+            atomic_write(blob + '.ok', b'')
+            return len(data), len(data), fresh
+        atomic_write(blob + '.opt', optimized)
+        new = memo_key(optimized)
+        atomic_write(os.path.join(store, new[:2], new + '.ok'), b'')
+    # a copy, not a link: Pelican copies static files over in place
+    atomic_write(path, optimized)
+    return len(data), len(optimized), fresh
+
+
+def _optimize_chunk(chunk):
+    results = []
+    for rel, path, store in chunk:
+        try:
+            results.append((rel, optimize_file(path, store)))
+        except Exception as e:
+            # Pillow raises many kinds of errors for broken images
+            logger.warning('Cannot optimize %s: %s', path, e)
+            results.append((rel, None))
+    return results
+
+
+def bounded_map(pool, function, items, limit):
+    """Yield ``function(item)`` for every item, submitting at most
+    ``limit`` items to ``pool`` at once, in completion order."""
+    items = iter(items)
+    pending = set()
+    while True:
+        for item in items:
+            pending.add(pool.submit(function, item))
+            if len(pending) >= limit:
+                break
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+class ImageOptimizer(object):
+    """Optimizes the images of ``output_path`` through the memo ``store``,
+    recording the stat of the optimized images in ``cache_file``."""
+
+    def __init__(self, output_path, store, cache_file, jobs=None,
+                 extensions=None):
+        self.output_path = os.path.abspath(output_path)
+        self.store = os.path.abspath(store)
+        self.cache_file = cache_file
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.extensions = set(extensions or FORMATS)
+        data = load_json(cache_file, {}) if cache_file else {}
+        if data.get('version') == CACHE_VERSION and \
+                data.get('output_path') == self.output_path:
+            self.entries = data.get('files', {})
+        else:
+            self.entries = {}
+        self.stats = dict.fromkeys(('optimized', 'memoized', 'optimal',
+                                    'unchanged', 'errors'), 0)
+        # extension to [files made smaller, bytes before, bytes after]
+        self.sizes = {}
+
+    def pending(self):
+        seen = set()
+        for path in iter_files(self.output_path, self.extensions):
+            rel = os.path.relpath(path, self.output_path).replace(os.sep,
+                                                                  '/')
+            seen.add(rel)
+            if self.entries.get(rel) == _stat(path):
+                self.stats['unchanged'] += 1
+                continue
+            yield rel, path, self.store
+        for rel in set(self.entries) - seen:
+            del self.entries[rel]
+
+    def run(self):
+        chunks = self._chunks(self.pending())
+        if self.jobs > 1:
+            with ProcessPoolExecutor(self.jobs) as pool:
+                for results in bounded_map(pool, _optimize_chunk, chunks,
+                                           self.jobs * 2):
+                    self._record(results)
+        else:
+            for chunk in chunks:
+                self._record(_optimize_chunk(chunk))
+        if self.cache_file:
+            dump_json(self.cache_file, {'version': CACHE_VERSION,
+                                        'output_path': self.output_path,
+                                        'files': self.entries})
+        return self.stats
+
+    @staticmethod
+    def _chunks(items):
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) == CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _record(self, results):
+        for rel, result in results:
+            if result is None:
+                self.entries.pop(rel, None)
+                self.stats['errors'] += 1
+                continue
+            before, after, fresh = result
+            if before == after:
+                self.stats['optimal'] += 1
+            else:
+                self.stats['optimized' if fresh else 'memoized'] += 1
+                ext = rel.rpartition('.')[2].lower()
+                ext = 'jpg' if ext == 'jpeg' else ext
+                sizes = self.sizes.setdefault(ext, [0, 0, 0])
+                sizes[0] += 1
+                sizes[1] += before
+                sizes[2] += after
+            self.entries[rel] = _stat(os.path.join(self.output_path,
+                                                   *rel.split('/')))
+
+    def summary(self):
+        lines = ['%(optimized)d images optimized, %(memoized)d replaced by '
+                 'their memoized optimized version, %(optimal)d already '
+                 'optimal, %(unchanged)d unchanged' % self.stats]
+        for ext, (count, before, after) in sorted(self.sizes.items()):
+            lines.append('%s: %d files, %d bytes saved (%d to %d, -%.1f%%)'
+                         % (ext, count, before - after, before, after,
+                            100.0 * (before - after) / before))
+        return lines
+
+
+def get_optimizer(settings, output_path=None, jobs=None, jpeg=None):
+    if jpeg is None:
+        jpeg = settings.get('OPTIMIZE_IMAGES_JPEG', False)
+    return ImageOptimizer(
+        output_path or settings.get('OUTPUT_PATH', 'output'),
+        settings.get('OPTIMIZE_IMAGES_STORE_PATH') or cache_path(
+            settings, 'optimized'),
+        settings.get('OPTIMIZE_IMAGES_CACHE_PATH') or cache_path(
+            settings, 'optimize.json'),
+        jobs or settings.get('OPTIMIZE_IMAGES_JOBS'),
+        FORMATS if jpeg else ['png'])
+
+
+def optimize_output(pelican):
+    if Image is None:
+        logger.warning('Pillow is not installed, images are not optimized')
+        return
+    from pelican_tools import writer
+    writer.drain()
+    start = time.time()
+    optimizer = get_optimizer(pelican.settings, pelican.output_path)
+    optimizer.run()
+    logger.info('Optimized the images in %.2fs: %s', time.time() - start,
+                '; '.join(optimizer.summary()))
+
+
+def register():
+    from pelican import signals
+    signals.finalized.connect(optimize_output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pelican-optimize-images',
+        description='Recompress the PNG (and JPEG) images of a Pelican '
+        'output directory.')
+    parser.add_argument('output', nargs='?',
+                        help='Output directory (default: OUTPUT_PATH of the '
+                        'settings, or output).')
+    parser.add_argument('-s', '--settings',
+                        help='Pelican settings file to read the '
+                        'OPTIMIZE_IMAGES_* settings and the output and '
+                        'cache paths from.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Number of processes (default: the number of '
+                        'cores).')
+    parser.add_argument('--jpeg', action='store_true', default=None,
+                        help='Also recompress the JPEG images, as '
+                        'progressive JPEGs; this is lossy (default: '
+                        'OPTIMIZE_IMAGES_JPEG).')
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        const=logging.INFO, dest='verbosity',
+                        default=logging.WARNING, help='Show all messages.')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.verbosity,
+                        format='%(levelname)s: %(message)s')
+    if Image is None:
+        logger.error('pelican-optimize-images needs Pillow')
+        return 1
+
+    settings = {}
+    if args.settings:
+        from pelican_tools.utils import read_settings
+        settings = read_settings(args.settings)
+    output = args.output or settings.get('OUTPUT_PATH') or 'output'
+    if not os.path.isdir(output):
+        parser.error('%s is not a directory' % output)
+
+    start = time.time()
+    optimizer = get_optimizer(settings, output, args.jobs, args.jpeg)
+    stats = optimizer.run()
+    for line in optimizer.summary():
+        print(line)
+    print('Done in %.2fs with %d processes' % (
+        time.time() - start, optimizer.jobs))
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
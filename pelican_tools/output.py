@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Leave alone the output files whose content did not change.
+
+Add ``pelican_tools.output`` to ``PLUGINS`` to make Pelican compare every
+page and feed it renders with the file already in the output directory, and
+skip the write when they are identical: the file and its modification time
+are left untouched, so deploy tools and CDN invalidations keyed on mtimes
+only see the files that really changed.
+
+The SHA-256 of the output files is kept in
+``cache/pelican-tools/output.json`` (see ``OUTPUT_CACHE_PATH``), so existing
+files are only read again when their size or modification time changed.
+Changed files are written atomically.
+"""
+from __future__ import unicode_literals
+
+import io
+import logging
+import os
+import threading
+
+from pelican.writers import Writer
+
+from pelican_tools.utils import (HashCache, atomic_write, cache_path,
+                                 sha256_bytes, stat_key)
+
+logger = logging.getLogger(__name__)
+
+
+class OutputCache(HashCache):
+    """Digests of the output files, with counters of the writes done and
+    avoided during the current build."""
+
+    def __init__(self, path=None):
+        super(OutputCache, self).__init__(path)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.written = 0
+        self.bytes_written = 0
+        self.unchanged = 0
+        self.bytes_unchanged = 0
+
+    def write(self, path, data):
+        """Write ``data`` (bytes) to ``path`` unless the file already holds
+        it, and return True if it was written."""
+        digest = sha256_bytes(data)
+        try:
+            same = os.path.getsize(path) == len(data) and \
+                self.digest(path) == digest
+        except OSError:
+            same = False
+        if same:
+            with self._lock:
+                self.unchanged += 1
+                self.bytes_unchanged += len(data)
+            return False
+        atomic_write(path, data)
+        self.entries[path] = stat_key(path) + [digest]
+        with self._lock:
+            self.written += 1
+            self.bytes_written += len(data)
+        return True
+
+
+_caches = {}
+
+
+def get_cache(settings):
+    path = settings.get('OUTPUT_CACHE_PATH') or cache_path(settings,
+                                                           'output.json')
+    if path not in _caches:
+        _caches[path] = OutputCache(path)
+    return _caches[path]
+
+
+class _OutputFile(io.StringIO):
+    """Collects the content of an output file, written on close if it
+    differs from the existing one."""
+
+    def __init__(self, cache, filename, encoding):
+        super(_OutputFile, self).__init__()
+        self.cache = cache
+        self.filename = filename
+        self.output_encoding = encoding
+
+    def close(self):
+        if not self.closed:
+            data = self.getvalue().encode(self.output_encoding)
+            super(_OutputFile, self).close()
+            self.cache.write(self.filename, data)
+
+
+class SkipIdenticalWriter(Writer):
+    """Writer which does not rewrite output files with the same content."""
+
+    writer_priority = 20
+
+    def __init__(self, output_path, settings=None):
+        super(SkipIdenticalWriter, self).__init__(output_path,
+                                                  settings=settings)
+        self.output_cache = get_cache(self.settings)
+        self.output_cache.reset_stats()
+
+    def _open_w(self, filename, encoding, override=False):
+        if filename in self._written_files or \
+                filename in getattr(self, '_overridden_files', ()):
+            # let Pelican decide between overriding, skipping and failing
+            return super(SkipIdenticalWriter, self)._open_w(
+                filename, encoding, override=override)
+        if override and hasattr(self, '_overridden_files'):
+            self._overridden_files.add(filename)
+        self._written_files.add(filename)
+        return _OutputFile(self.output_cache, filename, encoding)
+
+
+def save_cache(pelican):
+    from pelican_tools import writer
+    writer.drain()
+    cache = get_cache(pelican.settings)
+    logger.info('Output: %d files written (%d bytes), %d unchanged files not '
+                'rewritten (%d bytes)', cache.written, cache.bytes_written,
+                cache.unchanged, cache.bytes_unchanged)
+    output_path = os.path.join(os.path.abspath(pelican.output_path), '')
+    for path in list(cache.entries):
+        if path.startswith(output_path) and not os.path.exists(path):
+            cache.discard(path)
+    cache.save()
+
+
+def register():
+    from pelican import signals
+    from pelican_tools import writer
+    writer.use(SkipIdenticalWriter)
+    signals.finalized.connect(save_cache)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""Parse Markdown and reStructuredText sources in a process pool.
+
+Add ``pelican_tools.parallel_read`` to ``PLUGINS`` to parse the sources of
+the article and page generators across ``PARALLEL_READ_JOBS`` processes (all
+the cores by default) before Pelican reads them. Pelican then gets the
+parsed content and metadata in its usual order, exactly as if it had read
+them serially. The sources are read serially, with a warning, when one of
+the settings of the readers (such as ``MARKDOWN``) cannot be sent to the
+worker processes.
+"""
+from __future__ import print_function, unicode_literals
+
+import importlib
+import logging
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+#: Readers that are safe to run in another process.
+READERS = ('MarkdownReader', 'RstReader')
+
+#: Number of files sent to a worker at once.
+CHUNK_SIZE = 32
+
+#: Settings the readers parse with: the pool is not used when one of them
+#: cannot be sent to the workers.
+READER_SETTINGS = frozenset([
+    'DOCUTILS_SETTINGS', 'FORMATTED_FIELDS', 'MARKDOWN', 'READERS',
+    'TYPOGRIFY', 'TYPOGRIFY_DASHES', 'TYPOGRIFY_IGNORE_TAGS',
+    'TYPOGRIFY_OMIT_FILTERS',
+])
+
+_readers = None
+
+
+class _Wrapped(object):
+    """Picklable stand-in for a tag, category or author."""
+
+    def __init__(self, wrapper):
+        self.module = type(wrapper).__module__
+        self.cls = type(wrapper).__name__
+        self.name = wrapper.name
+
+    def thaw(self, settings):
+        cls = getattr(importlib.import_module(self.module), self.cls)
+        return cls(self.name, settings)
+
+
+def freeze(metadata):
+    """Make reader metadata independent of the worker's settings."""
+    from pelican.urlwrappers import URLWrapper
+
+    def _freeze(value):
+        if isinstance(value, URLWrapper):
+            return _Wrapped(value)
+        if isinstance(value, list):
+            return [_freeze(v) for v in value]
+        return value
+    return dict((k, _freeze(v)) for k, v in metadata.items())
+
+
+def thaw(metadata, settings):
+    """Rebuild metadata frozen by :func:`freeze` with ``settings``."""
+    def _thaw(value):
+        if isinstance(value, _Wrapped):
+            return value.thaw(settings)
+        if isinstance(value, list):
+            return [_thaw(v) for v in value]
+        return value
+    return dict((k, _thaw(v)) for k, v in metadata.items())
+
+
+def picklable_settings(settings):
+    """Return the settings which can be sent to worker processes.
+
+    Raise ValueError if one of the :data:`READER_SETTINGS` cannot: the
+    workers would not parse the sources like a serial read.
+    """
+    result = {}
+    for key, value in settings.items():
+        try:
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            if key in READER_SETTINGS:
+                raise ValueError('The %s setting cannot be sent to worker '
+                                 'processes' % key)
+            logger.debug('Not sending setting %s to readers', key)
+        else:
+            result[key] = value
+    return result
+
+
+def _init_worker(settings):
+    global _readers
+    from pelican.readers import Readers
+    _readers = Readers(settings)
+
+
+def _read_chunk(paths):
+    results = []
+    for path in paths:
+        ext = os.path.splitext(path)[1][1:]
+        try:
+            content, metadata = _readers.readers[ext].read(path)
+            result = (content, freeze(metadata))
+            pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            # let the serial reader fail where Pelican reports errors
+            logger.debug('Could not read %s in a worker: %s', path, e)
+            result = None
+        results.append((path, result))
+    return results
+
+
+def default_jobs():
+    return multiprocessing.cpu_count()
+
+
+def read_files(paths, settings, jobs=None, chunk_size=CHUNK_SIZE):
+    """Parse ``paths`` with Pelican's readers in ``jobs`` processes.
+
+    Return a list of ``(path, result)`` in the order of ``paths``, where
+    result is the ``(content, metadata)`` tuple returned by the reader (with
+    tags, categories and authors frozen, see :func:`thaw`), or None if the
+    file could not be read in a worker. Raise ValueError if the settings of
+    the readers cannot be sent to the workers.
+    """
+    paths = list(paths)
+    chunks = [paths[i:i + chunk_size]
+              for i in range(0, len(paths), chunk_size)]
+    worker_settings = picklable_settings(settings)
+    with ProcessPoolExecutor(max_workers=jobs or default_jobs(),
+                             initializer=_init_worker,
+                             initargs=(worker_settings,)) as pool:
+        results = []
+        for chunk in pool.map(_read_chunk, chunks):
+            results.extend(chunk)
+    return results
+
+
+def handled_extensions(readers):
+    """Return the extensions ``readers`` reads with a reader supported by
+    the pool: plugins may have replaced the built-in ones."""
+    return set(ext for ext, reader in readers.readers.items()
+               if type(reader).__module__ == 'pelican.readers' and
+               type(reader).__name__ in READERS)
+
+
+def preread(generator, paths, exclude):
+    """Parse the sources of ``generator`` in a pool and make its readers
+    return the results."""
+    settings = generator.settings
+    jobs = settings.get('PARALLEL_READ_JOBS') or default_jobs()
+    if jobs <= 1:
+        return
+    readers = generator.readers
+    extensions = handled_extensions(readers)
+    files = []
+    for f in sorted(generator.get_files(paths, exclude=exclude)):
+        if os.path.splitext(f)[1][1:] not in extensions:
+            continue
+        if generator.get_cached_data(f, None) is not None:
+            continue
+        path = os.path.abspath(os.path.join(generator.path, f))
+        if readers.get_cached_data(path, (None, None))[0] is not None:
+            continue
+        files.append(path)
+    if not files:
+        return
+
+    start = time.time()
+    try:
+        results = dict(read_files(files, settings, jobs,
+                                  settings.get('PARALLEL_READ_CHUNK_SIZE',
+                                               CHUNK_SIZE)))
+    except ValueError as e:
+        logger.warning('%s: reading the sources serially', e)
+        return
+    logger.info('Parsed %d files with %d processes in %.2fs',
+                len(files), jobs, time.time() - start)
+    for ext in extensions:
+        _install(readers.readers[ext], results)
+
+
+def _install(reader, results):
+    serial_read = reader.read
+
+    def read(path):
+        result = results.pop(path, None)
+        if result is None:
+            return serial_read(path)
+        content, metadata = result
+        return content, thaw(metadata, reader.settings)
+    reader.read = read
+
+
+def preread_articles(generator):
+    preread(generator, generator.settings['ARTICLE_PATHS'],
+            generator.settings['ARTICLE_EXCLUDES'])
+
+
+def preread_pages(generator):
+    preread(generator, generator.settings['PAGE_PATHS'],
+            generator.settings['PAGE_EXCLUDES'])
+
+
+def register():
+    from pelican import signals
+    signals.article_generator_init.connect(preread_articles)
+    signals.page_generator_init.connect(preread_pages)
+
+
+def source_files(settings):
+    """Return the sources of the articles and pages of a site that the pool
+    can read, as listed by the content index."""
+    from pelican.readers import Readers
+    from pelican_tools.index import get_index
+    extensions = handled_extensions(Readers(settings))
+    with get_index(settings) as index:
+        return [os.path.join(index.root, *entry.path.split('/'))
+                for entry in index.files()
+                if entry.path.rpartition('.')[2] in extensions]
+
+
+def setup_parser(parser):
+    from pelican_tools.utils import add_settings_arguments
+    add_settings_arguments(parser)
+    parser.add_argument('-j', '--jobs', type=int, default=default_jobs(),
+                        help='Number of processes (default: %(default)s).')
+    parser.add_argument('--check', action='store_true',
+                        help='Also read the files serially and check that '
+                        'the results are identical.')
+    parser.set_defaults(func=command)
+
+
+def command(args):
+    from pelican.readers import Readers
+    from pelican_tools.utils import settings_from_args
+    settings = settings_from_args(args)
+    files = source_files(settings)
+
+    start = time.time()
+    try:
+        results = read_files(files, settings, args.jobs)
+    except ValueError as e:
+        logger.error('%s', e)
+        return 1
+    elapsed = time.time() - start
+    failed = [path for path, result in results if result is None]
+    print('Read %d files with %d processes in %.2fs (%.0f files/s)' % (
+        len(files), args.jobs, elapsed,
+        len(files) / elapsed if elapsed else 0))
+    for path in failed:
+        print('Failed: %s' % path)
+
+    if args.check:
+        readers = Readers(settings)
+        different = 0
+        for path, result in results:
+            if result is None:
+                continue
+            ext = os.path.splitext(path)[1][1:]
+            content, metadata = readers.readers[ext].read(path)
+            if (content, metadata) != (result[0],
+                                       thaw(result[1], settings)):
+                different += 1
+                print('Different: %s' % path)
+        print('%d files differ from a serial read' % different)
+        return 1 if different or failed else 0
+    return 1 if failed else 0
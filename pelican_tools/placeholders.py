@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""Low-quality placeholders for the images of a site.
+
+Add ``pelican_tools.placeholders`` to ``PLUGINS`` to compute, for every
+PNG, JPEG and WebP image among the static files, a placeholder to show
+while the image loads:
+
+- ``lqip``, a ``data:`` URI of the image reduced to ``PLACEHOLDER_SIZE``
+  (16) pixels on its longest side, to stretch and blur with CSS;
+- ``blurhash``, the `BlurHash <https://blurha.sh>`_ of the image with
+  ``PLACEHOLDER_COMPONENTS`` (``(4, 3)``) components, to decode in
+  JavaScript;
+- ``color``, the average color of the image, as ``#rrggbb``;
+- ``width`` and ``height``, the size of the image.
+
+Templates look placeholders up by the URL or output path of the image in
+the ``placeholders`` global::
+
+    {% set p = placeholders.get(article.cover) %}
+    <img src="{{ article.cover }}"{% if p %} width="{{ p.width }}"
+         height="{{ p.height }}" style="background: {{ p.color }}
+         url({{ p.lqip }}) 0 0 / cover"{% endif %}>
+
+Images are decoded at a reduced size where the format allows it, then
+averaged down in blocks of pixels with NumPy, which also computes the
+BlurHash. Placeholders are kept in ``cache/pelican-tools/placeholders.json``
+(see ``PLACEHOLDER_CACHE_PATH``) with the modification time, size and
+SHA-256 of every image: unchanged images cost a ``stat`` on later builds,
+and images only touched (by a checkout, say) are hashed but not decoded.
+New images are processed in a pool of processes (``PLACEHOLDER_JOBS``).
+With ``pelican_tools.incremental``, the images are inputs of the pages
+looking their placeholder up, which are rendered again when they change.
+This needs the ``Pillow`` and ``numpy`` packages.
+"""
+from __future__ import unicode_literals
+
+import base64
+import collections
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pelican_tools.incremental.writer import add_file_input
+from pelican_tools.utils import (cache_path, dump_json, load_json,
+                                 sha256_file, stat_key, url_target)
+
+try:
+    import numpy as np
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    np = Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+#: Bumped when the cache format or the way placeholders are made changes.
+CACHE_VERSION = 1
+
+EXTENSIONS = ('png', 'jpg', 'jpeg', 'webp')
+
+#: Pillow format of the ``lqip`` images, by ``PLACEHOLDER_FORMAT``.
+FORMATS = {'png': ('PNG', 'image/png', {'optimize': True}),
+           'webp': ('WEBP', 'image/webp', {'quality': 60})}
+
+DEFAULT_SIZE = 16
+DEFAULT_COMPONENTS = (4, 3)
+
+#: Longest side of the image the BlurHash is computed from.
+SAMPLE_SIZE = 32
+
+#: Number of images sent to a worker process at once.
+CHUNK_SIZE = 8
+
+#: EXIF orientations turning the image by a quarter.
+ROTATED = frozenset([5, 6, 7, 8])
+
+BASE83 = ('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+          '#$%*+,-.:;=?@[]^_{|}~')
+
+Placeholder = collections.namedtuple(
+    'Placeholder', ['width', 'height', 'color', 'lqip', 'blurhash'])
+
+
+def _base83(value, length):
+    return ''.join(BASE83[value // 83 ** (length - i) % 83]
+                   for i in range(1, length + 1))
+
+
+def srgb_to_linear(pixels):
+    """Return the ``pixels`` (0 to 255) as linear intensities (0 to 1)."""
+    v = pixels / 255.0
+    return np.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(value):
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def downsample(pixels, longest):
+    """Return the ``pixels`` (an array of rows of pixels) averaged in square
+    blocks down to at most ``longest`` pixels on the longest side."""
+    height, width = pixels.shape[:2]
+    factor = -(-max(height, width) // longest)
+    if factor <= 1:
+        return pixels.astype(np.float32)
+    fy, fx = min(factor, height), min(factor, width)
+    h, w = height // fy, width // fx
+    blocks = pixels[:h * fy, :w * fx].reshape(h, fy, w, fx, -1)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def blurhash(linear, components=DEFAULT_COMPONENTS):
+    """Return the BlurHash of the ``linear`` RGB pixels and their average
+    color, as sRGB values."""
+    cx, cy = components
+    height, width = linear.shape[:2]
+    basis_x = np.cos(np.pi * np.outer(np.arange(cx), np.arange(width)) /
+                     width)
+    basis_y = np.cos(np.pi * np.outer(np.arange(cy), np.arange(height)) /
+                     height)
+    # factors[j, i] is the weight of the cosine of frequencies (i, j)
+    factors = np.einsum('jy,yxc,ix->jic', basis_y, linear, basis_x)
+    factors *= 2.0 / (width * height)
+    factors[0, 0] /= 2
+    dc = [linear_to_srgb(c) for c in factors[0, 0]]
+    ac = factors.reshape(-1, 3)[1:]
+    chars = [_base83(cx - 1 + (cy - 1) * 9, 1)]
+    if len(ac):
+        quantised = max(0, min(82, int(np.abs(ac).max() * 166 - 0.5)))
+        maximum = (quantised + 1) / 166.0
+        chars.append(_base83(quantised, 1))
+    else:
+        maximum = 1.0
+        chars.append(_base83(0, 1))
+    chars.append(_base83((dc[0] << 16) + (dc[1] << 8) + dc[2], 4))
+    scaled = ac / maximum
+    levels = np.clip(np.floor(np.sign(scaled) * np.sqrt(np.abs(scaled)) *
+                              9 + 9.5), 0, 18).astype(int)
+    for r, g, b in levels:
+        chars.append(_base83(int(r * 361 + g * 19 + b), 2))
+    return ''.join(chars), '#%02x%02x%02x' % tuple(dc)
+
+
+def make_placeholder(path, size=DEFAULT_SIZE, components=DEFAULT_COMPONENTS,
+                     fmt='png'):
+    """Return the :class:`Placeholder` of the image ``path``."""
+    image = Image.open(path)
+    width, height = image.size
+    if image.getexif().get(0x0112) in ROTATED:
+        width, height = height, width
+    sample_size = max(size, SAMPLE_SIZE)
+    # JPEG images are decoded at 1/2 to 1/8 of their size
+    image.draft('RGB', (sample_size * 2, sample_size * 2))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    sample = downsample(np.asarray(image), sample_size)
+    hash_, color = blurhash(srgb_to_linear(sample), components)
+    tiny = np.rint(downsample(sample, size)).astype(np.uint8)
+    pillow_format, mime, options = FORMATS[fmt]
+    f = io.BytesIO()
+    Image.fromarray(tiny).save(f, pillow_format, **options)
+    lqip = 'data:%s;base64,%s' % (
+        mime, base64.b64encode(f.getvalue()).decode('ascii'))
+    return Placeholder(width, height, color, lqip, hash_)
+
+
+def _process_chunk(chunk):
+    results = []
+    for rel, path, params in chunk:
+        try:
+            results.append((rel, make_placeholder(path, *params)))
+        except Exception as e:
+            # Pillow raises many kinds of errors for broken images
+            logger.warning('Cannot make the placeholder of %s: %s', path, e)
+            results.append((rel, None))
+    return results
+
+
+class Placeholders(object):
+    """Placeholders of the images of the site, by path relative to the
+    output directory, looked up by URL or output path."""
+
+    def __init__(self, siteurl=''):
+        self.siteurl = siteurl
+        self.entries = {}
+        self.sources = {}
+
+    def get(self, url, default=None):
+        if not url:
+            return default
+        target = url_target(url, '', self.siteurl)
+        if target in self.sources:
+            # incremental builds render the page again when the image
+            # changes
+            add_file_input(self.sources[target])
+        return self.entries.get(target, default) if target else default
+
+    def __getitem__(self, url):
+        placeholder = self.get(url)
+        if placeholder is None:
+            raise KeyError(url)
+        return placeholder
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class PlaceholderCache(object):
+    """Computes the placeholders of ``sources`` (output path to source
+    path), reusing those recorded in ``cache_file``."""
+
+    def __init__(self, cache_file, size=DEFAULT_SIZE,
+                 components=DEFAULT_COMPONENTS, fmt='png', jobs=None):
+        self.cache_file = cache_file
+        self.params = [size, list(components), fmt]
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.entries = {}
+        data = load_json(cache_file, {}) if cache_file else {}
+        if data.get('version') == CACHE_VERSION and \
+                data.get('params') == self.params:
+            self.entries = data.get('images', {})
+        self.stats = dict.fromkeys(('made', 'hashed', 'unchanged', 'errors'),
+                                   0)
+
+    def update(self, sources):
+        """Return the placeholders of ``sources``, by output path."""
+        placeholders = {}
+        entries = {}
+        pending = []
+        by_digest = dict((entry['sha256'], entry)
+                         for entry in self.entries.values())
+        for rel, path in sorted(sources.items()):
+            try:
+                key = stat_key(path)
+            except OSError:
+                continue
+            entry = self.entries.get(rel)
+            if entry is None or entry['stat'] != key:
+                # touched, renamed or copied images keep their placeholder
+                digest = sha256_file(path)
+                self.stats['hashed'] += 1
+                entry = by_digest.get(digest)
+                if entry is None:
+                    entry = {'sha256': digest}
+                    pending.append((rel, path, self.params))
+                entry = dict(entry, stat=key)
+            else:
+                self.stats['unchanged'] += 1
+            entries[rel] = entry
+            if 'placeholder' in entry:
+                placeholders[rel] = Placeholder(*entry['placeholder'])
+
+        chunks = [pending[i:i + CHUNK_SIZE]
+                  for i in range(0, len(pending), CHUNK_SIZE)]
+        if self.jobs > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(self.jobs) as pool:
+                results = [r for chunk in pool.map(_process_chunk, chunks)
+                           for r in chunk]
+        else:
+            results = [r for chunk in chunks for r in _process_chunk(chunk)]
+        for rel, placeholder in results:
+            if placeholder is None:
+                del entries[rel]
+                self.stats['errors'] += 1
+                continue
+            self.stats['made'] += 1
+            entries[rel]['placeholder'] = list(placeholder)
+            placeholders[rel] = placeholder
+
+        self.entries = entries
+        if self.cache_file:
+            dump_json(self.cache_file, {'version': CACHE_VERSION,
+                                        'params': self.params,
+                                        'images': self.entries})
+        return placeholders
+
+
+_placeholders = Placeholders()
+
+
+def install(generator):
+    env = getattr(generator, 'env', None)
+    if env is not None:
+        _placeholders.siteurl = generator.settings.get('SITEURL', '')
+        env.globals['placeholders'] = _placeholders
+
+
+def compute_placeholders(generators):
+    if not generators:
+        return
+    if np is None or Image is None:
+        logger.warning('Pillow and numpy are needed for placeholders')
+        return
+    settings = generators[0].settings
+    fmt = settings.get('PLACEHOLDER_FORMAT', 'png')
+    if fmt not in FORMATS:
+        logger.error('PLACEHOLDER_FORMAT must be one of %s, not %r',
+                     ', '.join(sorted(FORMATS)), fmt)
+        return
+    sources = {}
+    for generator in generators:
+        for staticfile in generator.context.get('staticfiles', ()):
+            rel = staticfile.save_as.replace(os.sep, '/')
+            if rel.rpartition('.')[2].lower() in EXTENSIONS:
+                sources[rel] = staticfile.source_path
+    start = time.time()
+    cache = PlaceholderCache(
+        settings.get('PLACEHOLDER_CACHE_PATH') or cache_path(
+            settings, 'placeholders.json'),
+        settings.get('PLACEHOLDER_SIZE', DEFAULT_SIZE),
+        settings.get('PLACEHOLDER_COMPONENTS', DEFAULT_COMPONENTS),
+        fmt, settings.get('PLACEHOLDER_JOBS'))
+    _placeholders.entries = cache.update(sources)
+    _placeholders.sources = sources
+    elapsed = time.time() - start
+    logger.info('Placeholders in %.2fs (%.3fms per image): %d made, %d '
+                'images hashed, %d unchanged, %d errors', elapsed,
+                1000 * elapsed / max(1, len(sources)), cache.stats['made'],
+                cache.stats['hashed'], cache.stats['unchanged'],
+                cache.stats['errors'])
+
+
+def register():
+    from pelican import signals
+    signals.generator_init.connect(install)
+    signals.all_generators_finalized.connect(compute_placeholders)
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""Measure where the time of a Pelican build goes.
+
+``pelican-profile`` builds a site like ``pelican`` and records the wall
+time, CPU time and peak memory use (RSS) of each phase of the build:
+
+* ``initialization``: reading the settings and loading the plugins,
+* ``reading``: parsing the sources,
+* ``context``: the rest of the generators' ``generate_context``,
+* ``rendering``: rendering the templates,
+* ``writing``: the rest of the generators' ``generate_output``,
+* ``plugins``: the receivers of Pelican's signals,
+* ``other``: everything else (creating the generators, ...).
+
+Times are also given per generator and per signal. Nested measures are not
+counted twice: reading an article while generating the context only counts
+as reading. Threads (see :mod:`pelican_tools.writer`) render and write in
+parallel, so the phases may add up to more than the wall time of the build.
+
+The plugin can also be enabled alone by adding ``pelican_tools.profile`` to
+``PLUGINS``: the report then covers the build from the end of the
+initialization and is stored in ``PROFILE_REPORT_PATH`` (by default
+``profile.json`` in the pelican-tools cache).
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from pelican_tools.utils import (add_settings_arguments, atomic_write,
+                                 cache_path, enable_plugins, get_pelican,
+                                 settings_from_args)
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('initialization', 'reading', 'context', 'rendering', 'writing',
+          'plugins')
+
+#: Number of signals listed in the summary table, the slowest first.
+SIGNALS_SHOWN = 10
+
+#: CPU time of the calling thread, where available.
+thread_time = (getattr(time, 'thread_time', None) or
+               getattr(time, 'process_time', None) or time.clock)
+
+
+def peak_rss():
+    """Return the peak resident set size of the process, in bytes."""
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def process_cpu():
+    """Return the CPU time used by the process and its finished children."""
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+class _Stats(object):
+    __slots__ = ('calls', 'wall', 'cpu', 'rss')
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rss = 0
+
+    def add(self, wall, cpu, rss):
+        self.calls += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.rss = max(self.rss, rss)
+
+    def as_dict(self):
+        return {'calls': self.calls, 'wall': round(self.wall, 6),
+                'cpu': round(self.cpu, 6), 'peak_rss': self.rss}
+
+
+class Profiler(object):
+    """Accumulates the time spent in nested measures.
+
+    Each measure has a phase and a name (a generator or signal name). The
+    time of a measure excludes the time of the measures nested in it, which
+    are counted in their own phase.
+    """
+
+    #: True when the profile plugin runs without ``pelican-profile``.
+    standalone = False
+
+    def __init__(self):
+        self.phases = dict((phase, _Stats()) for phase in PHASES)
+        self.names = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.start()
+
+    def start(self):
+        self.started = time.time()
+        self.cpu_started = process_cpu()
+        self.wall = self.cpu = None
+
+    def stop(self):
+        self.wall = time.time() - self.started
+        self.cpu = process_cpu() - self.cpu_started
+
+    def measure(self, phase, name, func, *args, **kwargs):
+        """Call ``func`` and record its duration under ``phase`` and
+        ``name``."""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        frame = [0.0, 0.0]  # time spent in nested measures
+        stack.append(frame)
+        wall, cpu = time.time(), thread_time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            wall, cpu = time.time() - wall, thread_time() - cpu
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+            rss = peak_rss()
+            own_wall, own_cpu = wall - frame[0], cpu - frame[1]
+            with self._lock:
+                self.phases[phase].add(own_wall, own_cpu, rss)
+                key = (phase, name)
+                if key not in self.names:
+                    self.names[key] = _Stats()
+                self.names[key].add(own_wall, own_cpu, rss)
+
+    def wrap(self, phase, name, func):
+        """Return ``func`` measured under ``phase`` and ``name``."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.measure(phase, name, func, *args, **kwargs)
+        return wrapper
+
+    def report(self):
+        """Return the measures as a JSON-serialisable dictionary."""
+        if self.wall is None:
+            self.stop()
+        phases = [dict(self.phases[phase].as_dict(), name=phase)
+                  for phase in PHASES]
+        accounted = sum(self.phases[phase].wall for phase in PHASES)
+        phases.append({'name': 'other', 'calls': 1,
+                       'wall': round(max(0.0, self.wall - accounted), 6),
+                       'cpu': None, 'peak_rss': peak_rss()})
+        generators = {}
+        signals = []
+        for (phase, name), stats in sorted(self.names.items()):
+            if phase == 'plugins':
+                signals.append(dict(stats.as_dict(), name=name))
+            elif phase != 'initialization':
+                generators.setdefault(name, {'name': name})[phase] = \
+                    stats.as_dict()
+        return {
+            'total': {'wall': round(self.wall, 6), 'cpu': round(self.cpu, 6),
+                      'peak_rss': peak_rss()},
+            'phases': phases,
+            'generators': [generators[name] for name in sorted(generators)],
+            'signals': signals,
+            'caches': cache_stats(),
+        }
+
+
+def cache_stats():
+    """Return the statistics of the pelican-tools caches used by the
+    build."""
+    stats = {}
+    jinja_cache = sys.modules.get('pelican_tools.jinja_cache')
+    if jinja_cache is not None:
+        for path, cache in jinja_cache._caches.items():
+            stats['jinja:%s' % path] = cache.stats()
+    output = sys.modules.get('pelican_tools.output')
+    if output is not None:
+        for path, cache in output._caches.items():
+            stats['output:%s' % path] = {
+                'written': cache.written, 'bytes_written': cache.bytes_written,
+                'unchanged': cache.unchanged,
+                'bytes_unchanged': cache.bytes_unchanged}
+    incremental = sys.modules.get('pelican_tools.incremental.cache')
+    if incremental is not None:
+        for path, cache in incremental._caches.items():
+            stats['incremental:%s' % path] = {'rendered': cache.rendered,
+                                              'skipped': cache.skipped}
+    return stats
+
+
+def format_report(report):
+    """Return the report as a human readable table."""
+    def mb(size):
+        return '%.1f' % (size / 1048576.0)
+
+    def cpu(value):
+        return '-' if value is None else '%.3f' % value
+
+    lines = ['%-28s %6s %9s %9s %9s' % ('Phase', 'Calls', 'Wall (s)',
+                                        'CPU (s)', 'RSS (MB)')]
+    for row in report['phases']:
+        lines.append('%-28s %6d %9.3f %9s %9s' % (
+            row['name'], row['calls'], row['wall'], cpu(row['cpu']),
+            mb(row['peak_rss'])))
+    total = report['total']
+    lines.append('%-28s %6s %9.3f %9.3f %9s' % (
+        'total', '', total['wall'], total['cpu'], mb(total['peak_rss'])))
+    if report['generators']:
+        lines.append('')
+        lines.append('%-28s %-10s %6s %9s %9s' % ('Generator', 'Phase',
+                                                  'Calls', 'Wall (s)',
+                                                  'CPU (s)'))
+        for generator in report['generators']:
+            for phase in PHASES:
+                if phase in generator:
+                    row = generator[phase]
+                    lines.append('%-28s %-10s %6d %9.3f %9.3f' % (
+                        generator['name'], phase, row['calls'], row['wall'],
+                        row['cpu']))
+    if report['signals']:
+        lines.append('')
+        lines.append('%-39s %6s %9s %9s' % ('Signal', 'Calls', 'Wall (s)',
+                                            'CPU (s)'))
+        rows = sorted(report['signals'], key=lambda r: -r['wall'])
+        for row in rows[:SIGNALS_SHOWN]:
+            lines.append('%-39s %6d %9.3f %9.3f' % (
+                row['name'], row['calls'], row['wall'], row['cpu']))
+    for name, stats in sorted(report['caches'].items()):
+        lines.append('')
+        lines.append('%s: %s' % (name, ', '.join(
+            '%s %s' % (key, value) for key, value in sorted(stats.items()))))
+    return '\n'.join(lines)
+
+
+class _TimedTemplate(object):
+    """Wraps a Jinja2 template to measure its rendering."""
+
+    def __init__(self, profiler, generator, template):
+        self.profiler = profiler
+        self.generator = generator
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, *args, **kwargs):
+        return self.profiler.measure('rendering', self.generator,
+                                     self.template.render, *args, **kwargs)
+
+
+_profiler = None
+
+
+def instrument_signals(profiler):
+    """Measure the receivers of Pelican's signals."""
+    from blinker import Signal
+    from pelican import signals
+    for name in dir(signals):
+        signal = getattr(signals, name)
+        if isinstance(signal, Signal) and \
+                not hasattr(signal.send, '_pelican_tools_profile'):
+            send = _measured_send(signal.send, getattr(signal, 'name', name))
+            send._pelican_tools_profile = True
+            signal.send = send
+
+
+def _measured_send(send, name):
+    @functools.wraps(send)
+    def measured(*args, **kwargs):
+        if _profiler is None:
+            return send(*args, **kwargs)
+        return _profiler.measure('plugins', name, send, *args, **kwargs)
+    return measured
+
+
+def start(pelican):
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+        _profiler.standalone = True
+    instrument_signals(_profiler)
+
+
+def instrument(generator):
+    """Measure the phases of ``generator``."""
+    profiler = _profiler
+    if profiler is None:
+        return
+    name = type(generator).__name__
+    for method, phase in (('generate_context', 'context'),
+                          ('generate_output', 'writing')):
+        if hasattr(generator, method):
+            setattr(generator, method, profiler.wrap(
+                phase, name, getattr(generator, method)))
+    readers = getattr(generator, 'readers', None)
+    if readers is not None and hasattr(readers, 'read_file'):
+        readers.read_file = profiler.wrap('reading', name, readers.read_file)
+    if hasattr(generator, 'get_template'):
+        get_template = generator.get_template
+
+        def timed_get_template(template_name):
+            return _TimedTemplate(profiler, name, get_template(template_name))
+        generator.get_template = timed_get_template
+
+
+def finish(pelican):
+    global _profiler
+    profiler = _profiler
+    if profiler is None or not getattr(profiler, 'standalone', False):
+        return
+    _profiler = None
+    from pelican_tools import writer
+    writer.drain()
+    profiler.stop()
+    report = profiler.report()
+    path = pelican.settings.get('PROFILE_REPORT_PATH') or cache_path(
+        pelican.settings, 'profile.json')
+    atomic_write(path, json.dumps(report, indent=2,
+                                  sort_keys=True).encode('utf-8'))
+    logger.info('Build profile stored in %s:\n%s', path,
+                format_report(report))
+
+
+def register():
+    from pelican import signals
+    signals.initialized.connect(start)
+    signals.generator_init.connect(instrument)
+    signals.finalized.connect(finish)
+
+
+def main(argv=None):
+    global _profiler
+    parser = argparse.ArgumentParser(
+        prog='pelican-profile',
+        description='Build a Pelican site and report the time and memory '
+        'used by each phase of the build.')
+    add_settings_arguments(parser)
+    parser.add_argument('--json', metavar='FILE',
+                        help='Write the report as JSON to FILE (- for the '
+                        'standard output).')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Do not print the summary table.')
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        const=logging.INFO, dest='verbosity',
+                        default=logging.WARNING, help='Show all messages.')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.verbosity,
+                        format='%(levelname)s: %(message)s')
+
+    profiler = _profiler = Profiler()
+    settings = profiler.measure('initialization', 'settings',
+                                settings_from_args, args)
+    enable_plugins(settings, 'pelican_tools.profile')
+    pelican = profiler.measure('initialization', 'pelican', get_pelican,
+                               settings)
+    try:
+        pelican.run()
+    finally:
+        _profiler = None
+    profiler.stop()
+
+    report = profiler.report()
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    elif args.json:
+        atomic_write(args.json, json.dumps(report, indent=2,
+                                           sort_keys=True).encode('utf-8'))
+    if not args.quiet and args.json != '-':
+        print(format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
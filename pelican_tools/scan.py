@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""Read the metadata of content sources without parsing their body.
+
+Only the header of each file is read: Markdown metadata up to the first
+blank line (or YAML front matter up to the closing ``---``), the title and
+field list of reStructuredText documents, and the ``<head>`` of HTML files.
+Values are returned as written in the source: Pelican's readers still
+process them (dates, slugs, ...) when the site is built.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pelican_tools.utils import iter_files
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'md': 'markdown', 'markdown': 'markdown', 'mkd': 'markdown',
+    'mdown': 'markdown', 'rst': 'rst', 'html': 'html', 'htm': 'html',
+}
+
+#: Metadata holding comma separated lists, as in Pelican.
+LIST_FIELDS = ('tags', 'authors')
+
+#: Bytes read at once; most headers fit in the first read.
+HEADER_SIZE = 4096
+
+#: Number of files sent to a worker process at once.
+CHUNK_SIZE = 512
+
+_md_field = re.compile(r'^[ ]{0,3}([A-Za-z0-9_-]+):\s*(.*)$')
+_md_fields = re.compile(r'^[ ]{0,3}([A-Za-z0-9_-]+):[ \t]*(.*?)\s*$', re.M)
+_md_continuation = re.compile(r'^[ ]{4,}(.*)$')
+_yaml_item = re.compile(r'^\s*-\s+(.*)$')
+_rst_field = re.compile(r'^:([^:]+):\s*(.*)$')
+_rst_underline = re.compile(r'^([=\-`:\'"~^_*+#<>.])\1+\s*$')
+_html_meta = re.compile(
+    r'<meta\s+[^>]*?name\s*=\s*["\']([^"\']+)["\'][^>]*?'
+    r'content\s*=\s*["\']([^"\']*)["\']', re.I)
+_html_meta_reversed = re.compile(
+    r'<meta\s+[^>]*?content\s*=\s*["\']([^"\']*)["\'][^>]*?'
+    r'name\s*=\s*["\']([^"\']+)["\']', re.I)
+_html_title = re.compile(r'<title>(.*?)</title>', re.I | re.S)
+_blank_line = re.compile(br'\r?\n[ \t]*\r?\n')
+
+
+def _header_end(data, fmt):
+    """Return the offset where the header of ``data`` ends, or None if it
+    may continue past ``data``."""
+    if fmt == 'html':
+        end = data.lower().find(b'</head>')
+        return None if end < 0 else end
+    if fmt == 'rst':
+        return _rst_header_end(data)
+    if data.startswith(b'---'):
+        end = data.find(b'\n---', 3)
+        if end < 0:
+            end = data.find(b'\n...', 3)
+        return None if end < 0 else end + 4
+    match = _blank_line.search(data)
+    return match.start() if match else None
+
+
+def _rst_header_end(data):
+    """The fields of a reStructuredText document follow its title: the
+    header ends at the first line which is neither part of the title nor a
+    field."""
+    offset = 0
+    in_fields = False
+    lines = data.split(b'\n')
+    for n, line in enumerate(lines[:-1]):  # the last line may be truncated
+        stripped = line.strip()
+        if stripped.startswith(b':'):
+            in_fields = True
+        elif in_fields and line[:1] in (b' ', b'\t') and stripped:
+            pass  # continuation of a field
+        elif in_fields or (stripped and n > 3):
+            return offset
+        offset += len(line) + 1
+    return None
+
+
+def read_header(path, fmt):
+    """Return the header of the file at ``path`` as text."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        data = os.read(fd, HEADER_SIZE)
+        while True:
+            end = _header_end(data, fmt)
+            if end is not None:
+                data = data[:end]
+                break
+            chunk = os.read(fd, max(len(data), HEADER_SIZE))
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        os.close(fd)
+    if data.startswith(b'\xef\xbb\xbf'):
+        data = data[3:]
+    return data.decode('utf-8', 'replace')
+
+
+def parse_markdown(text):
+    if text.startswith('---'):
+        return parse_yaml(text.splitlines()[1:])
+    fields = _md_fields.findall(text)
+    if len(fields) == text.count('\n') + 1:
+        # fast path: every line is a field
+        return dict((k.lower(), v) for k, v in fields)
+    lines = text.splitlines()
+    metadata = {}
+    key = None
+    for line in lines:
+        if not line.strip():
+            break
+        match = _md_field.match(line)
+        if match:
+            key = match.group(1).lower()
+            metadata[key] = match.group(2).strip()
+            continue
+        match = _md_continuation.match(line)
+        if match and key:
+            metadata[key] = ('%s\n%s' % (metadata[key],
+                                         match.group(1).strip())).strip()
+            continue
+        break
+    return metadata
+
+
+def parse_yaml(lines):
+    """Parse the simple ``key: value`` / ``- item`` subset of YAML used in
+    front matter."""
+    metadata = {}
+    key = None
+    for line in lines:
+        if line.strip() in ('---', '...'):
+            break
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        match = _yaml_item.match(line)
+        if match and key:
+            if not isinstance(metadata[key], list):
+                metadata[key] = []
+            metadata[key].append(_unquote(match.group(1)))
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            continue
+        key = name.strip().lower()
+        value = value.strip()
+        if value.startswith('[') and value.endswith(']'):
+            metadata[key] = [_unquote(v) for v in value[1:-1].split(',')
+                             if v.strip()]
+        else:
+            metadata[key] = _unquote(value)
+    return metadata
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1]
+    return value
+
+
+def parse_rst(text):
+    metadata = {}
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines) and not lines[i].strip():
+        i += 1
+    if i < len(lines) and _rst_underline.match(lines[i]):
+        i += 1  # overline
+    if i + 1 < len(lines) and _rst_underline.match(lines[i + 1]):
+        metadata['title'] = lines[i].strip()
+    key = None
+    for line in lines[i:]:
+        match = _rst_field.match(line)
+        if match:
+            key = match.group(1).strip().lower()
+            metadata[key] = match.group(2).strip()
+        elif key and line.startswith((' ', '\t')) and line.strip():
+            metadata[key] = '%s %s' % (metadata[key], line.strip())
+        else:
+            key = None
+    return metadata
+
+
+def parse_html(text):
+    metadata = {}
+    for name, content in _html_meta.findall(text):
+        metadata[name.lower()] = content
+    for content, name in _html_meta_reversed.findall(text):
+        metadata.setdefault(name.lower(), content)
+    match = _html_title.search(text)
+    if match:
+        metadata['title'] = match.group(1).strip()
+    return metadata
+
+
+PARSERS = {'markdown': parse_markdown, 'rst': parse_rst, 'html': parse_html}
+
+
+def split_list(value):
+    if isinstance(value, list):
+        return value
+    separator = ';' if ';' in value else ','
+    return [v.strip() for v in value.split(separator) if v.strip()]
+
+
+def scan_file(path, fmt=None):
+    """Return the metadata of the source at ``path``.
+
+    Keys are lowercased, ``tags`` and ``authors`` are lists, other values
+    are strings as written in the source.
+    """
+    fmt = fmt or FORMATS[os.path.splitext(path)[1][1:].lower()]
+    metadata = PARSERS[fmt](read_header(path, fmt))
+    for key in LIST_FIELDS:
+        if key in metadata:
+            metadata[key] = split_list(metadata[key])
+    return metadata
+
+
+def _record(prefix, path):
+    try:
+        fmt = FORMATS[path.rpartition('.')[2].lower()]
+        metadata = scan_file(path, fmt)
+    except (IOError, OSError, UnicodeError) as e:
+        logger.warning('Could not scan %s: %s', path, e)
+        return None
+    return {'path': path[prefix:], 'format': fmt, 'metadata': metadata}
+
+
+def _scan_chunk(args):
+    prefix, paths = args
+    return [record for record in (_record(prefix, path) for path in paths)
+            if record is not None]
+
+
+def _chunks(prefix, paths, size):
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == size:
+            yield prefix, chunk
+            chunk = []
+    if chunk:
+        yield prefix, chunk
+
+
+def scan(root, ignores=(), jobs=1, extensions=None):
+    """Yield ``{'path', 'format', 'metadata'}`` records for the sources
+    below ``root``, in path order. Paths are relative to ``root``.
+
+    With ``jobs`` greater than 1, headers are read and parsed by a pool of
+    processes.
+    """
+    files = iter_files(root, extensions or set(FORMATS), ignores)
+    prefix = len(os.path.join(root, ''))
+    if jobs > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            for records in pool.map(_scan_chunk,
+                                    _chunks(prefix, files, CHUNK_SIZE)):
+                for record in records:
+                    yield record
+        return
+    for path in files:
+        record = _record(prefix, path)
+        if record is not None:
+            yield record
+
+
+def write_jsonl(records, fp):
+    encode = json.JSONEncoder(sort_keys=True, ensure_ascii=False).encode
+    count = 0
+    for record in records:
+        fp.write(encode(record))
+        fp.write('\n')
+        count += 1
+    return count
+
+
+def write_sqlite(records, path):
+    """Store ``records`` in the SQLite database ``path``, replacing
+    previous results. Metadata is stored as ``(path, key, value)`` rows,
+    one per item of list values."""
+    db = sqlite3.connect(path)
+    count = 0
+    try:
+        with db:
+            db.execute('DROP TABLE IF EXISTS metadata')
+            db.execute('DROP TABLE IF EXISTS files')
+            db.execute('CREATE TABLE files (path TEXT PRIMARY KEY, '
+                       'format TEXT)')
+            db.execute('CREATE TABLE metadata (path TEXT, key TEXT, '
+                       'value TEXT)')
+            for record in records:
+                db.execute('INSERT INTO files VALUES (?, ?)',
+                           (record['path'], record['format']))
+                rows = []
+                for key, value in record['metadata'].items():
+                    for item in (value if isinstance(value, list)
+                                 else [value]):
+                        rows.append((record['path'], key, item))
+                db.executemany('INSERT INTO metadata VALUES (?, ?, ?)', rows)
+                count += 1
+            db.execute('CREATE INDEX metadata_key ON metadata (key, value)')
+    finally:
+        db.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pelican-scan',
+        description='Print the metadata of Pelican content sources as JSON '
+        'lines (or store it in SQLite) without parsing their body.')
+    parser.add_argument('path', nargs='?', default='content',
+                        help='Content directory (default: %(default)s).')
+    parser.add_argument('-f', '--format', choices=('jsonl', 'sqlite'),
+                        default='jsonl', help='Output format.')
+    parser.add_argument('-o', '--output',
+                        help='Output file, required for SQLite (default: '
+                        'standard output).')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Processes reading the files (default: '
+                        '%(default)s).')
+    parser.add_argument('--ignore', action='append', default=['.*'],
+                        metavar='PATTERN',
+                        help='Ignore files and directories matching PATTERN.')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print the scan rate on standard error.')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+
+    start = time.time()
+    records = scan(args.path, args.ignore, args.jobs)
+    if args.format == 'sqlite':
+        if not args.output:
+            parser.error('--output is required with --format sqlite')
+        count = write_sqlite(records, args.output)
+    elif args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as fp:
+            count = write_jsonl(records, fp)
+    else:
+        count = write_jsonl(records, sys.stdout)
+    elapsed = time.time() - start
+    if args.stats:
+        print('Scanned %d files in %.3fs (%.0f files/s)' % (
+            count, elapsed, count / elapsed if elapsed else 0),
+            file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
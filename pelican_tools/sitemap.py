@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Sitemaps of any size, written as a stream of gzipped shards.
+
+Add ``pelican_tools.sitemap`` to ``PLUGINS`` to write, at the end of every
+build, the HTML pages of the output directory to ``sitemap-1.xml.gz``,
+``sitemap-2.xml.gz``... and list these shards in the ``sitemap.xml``
+sitemap index. ``<url>`` entries are written to the shards as the output
+directory is walked, and a new shard is started before one would exceed
+the limits of the protocol, 50,000 URLs or 50 MB uncompressed
+(``SITEMAP_MAX_URLS`` and ``SITEMAP_MAX_BYTES``).
+
+The ``lastmod`` of articles and pages is their ``modified`` or ``date``
+metadata, read from the content index (see :mod:`pelican_tools.index`)
+which only parses the sources changed since the previous build. Other pages
+get the newest ``lastmod`` of the content they list (the articles of their
+page for paginated outputs), and none if they list no content.
+
+The sitemap protocol requires absolute URLs: no sitemap is written unless
+``SITEURL`` is one.
+
+Other settings: ``SITEMAP_NAME`` (``sitemap``), ``SITEMAP_GZIP`` (True) and
+``SITEMAP_EXCLUDE``, glob patterns of the output paths left out.
+"""
+from __future__ import print_function, unicode_literals
+
+import fnmatch
+import gzip
+import logging
+import os
+import re
+import time
+from xml.sax.saxutils import escape
+
+from pelican_tools.compat import replace
+from pelican_tools.utils import (atomic_write, iter_files, makedirs,
+                                 sha256_file)
+
+try:
+    from urllib.parse import quote, urlparse
+except ImportError:  # pragma: no cover
+    from urllib import quote
+    from urlparse import urlparse
+
+logger = logging.getLogger(__name__)
+
+#: Limits of the sitemap protocol.
+MAX_URLS = 50000
+MAX_BYTES = 50 * 1024 * 1024
+
+DEFAULT_EXCLUDE = ['theme/*', 'drafts/*', '404.html']
+
+NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+          '<urlset xmlns="%s">\n' % NAMESPACE).encode('utf-8')
+FOOTER = b'</urlset>\n'
+
+_url_safe = ":/?#[]@!$&'()*+,;=%~"
+
+
+def w3c_date(value):
+    """Return the W3C datetime form of an ISO date or datetime, keeping
+    only the date of naive datetimes."""
+    if not value:
+        return None
+    if re.search(r'T.*(?:Z|[+-]\d\d:?\d\d)$', value):
+        return value
+    return value[:10]
+
+
+class _Shard(object):
+    """A sitemap file being written, replacing ``path`` on close unless it
+    already holds the same content."""
+
+    def __init__(self, path, compress):
+        self.path = path
+        self.tmp = os.path.join(os.path.dirname(path),
+                                '.tmp-' + os.path.basename(path))
+        self.raw = open(self.tmp, 'wb')
+        self.file = self.raw
+        if compress:
+            # no file name and a null timestamp, for reproducible shards
+            self.file = gzip.GzipFile(filename='', mode='wb',
+                                      fileobj=self.raw, mtime=0)
+        self.urls = 0
+        self.size = 0
+        self.lastmod = None
+        self.write(HEADER)
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self.write(FOOTER)
+        if self.file is not self.raw:
+            self.file.close()
+        self.raw.close()
+        if os.path.exists(self.path) and \
+                os.path.getsize(self.path) == os.path.getsize(self.tmp) and \
+                sha256_file(self.path) == sha256_file(self.tmp):
+            os.remove(self.tmp)
+        else:
+            replace(self.tmp, self.path)
+
+
+class ShardedSitemap(object):
+    """Writes ``<url>`` entries to as many shards as needed in
+    ``directory``, then the sitemap index.
+
+    Shard ``n`` is ``<name>-<n>.xml.gz`` (``.xml`` without compression)
+    and the index is ``<name>.xml``. ``base_url`` is the URL of
+    ``directory``.
+    """
+
+    def __init__(self, directory, base_url, name='sitemap', compress=True,
+                 max_urls=MAX_URLS, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.base_url = base_url.rstrip('/')
+        self.name = name
+        self.compress = compress
+        self.max_urls = max_urls
+        self.max_bytes = max_bytes
+        self.shards = []
+        self._shard = None
+        self.urls = 0
+        makedirs(directory)
+
+    def shard_name(self, number):
+        return '%s-%d.xml%s' % (self.name, number,
+                                '.gz' if self.compress else '')
+
+    def add(self, loc, lastmod=None):
+        entry = '<url><loc>%s</loc>%s</url>\n' % (
+            escape(quote(loc, safe=_url_safe)),
+            '<lastmod>%s</lastmod>' % escape(lastmod) if lastmod else '')
+        entry = entry.encode('utf-8')
+        shard = self._shard
+        if shard is None or shard.urls >= self.max_urls or \
+                shard.size + len(entry) + len(FOOTER) > self.max_bytes:
+            shard = self._next_shard()
+        shard.write(entry)
+        shard.urls += 1
+        self.urls += 1
+        if lastmod and (shard.lastmod is None or lastmod > shard.lastmod):
+            shard.lastmod = lastmod
+
+    def _next_shard(self):
+        if self._shard is not None:
+            self._shard.close()
+        name = self.shard_name(len(self.shards) + 1)
+        self._shard = _Shard(os.path.join(self.directory, name),
+                             self.compress)
+        self.shards.append((name, self._shard))
+        return self._shard
+
+    def close(self):
+        """Write the last shard and the index, and remove the shards left
+        by a previous, larger sitemap."""
+        if self._shard is None:
+            self._next_shard()
+        self._shard.close()
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+                 '<sitemapindex xmlns="%s">' % NAMESPACE]
+        for name, shard in self.shards:
+            lines.append('<sitemap><loc>%s/%s</loc>%s</sitemap>' % (
+                escape(self.base_url), name,
+                '<lastmod>%s</lastmod>' % shard.lastmod
+                if shard.lastmod else ''))
+        lines.append('</sitemapindex>\n')
+        atomic_write(os.path.join(self.directory, self.name + '.xml'),
+                     '\n'.join(lines).encode('utf-8'))
+        written = set(name for name, shard in self.shards)
+        pattern = re.compile(r'%s-\d+\.xml(?:\.gz)?$' % re.escape(self.name))
+        for name in os.listdir(self.directory):
+            if pattern.match(name) and name not in written:
+                os.remove(os.path.join(self.directory, name))
+
+
+def content_dates(settings):
+    """Return the ``lastmod`` of every indexed source, by path relative to
+    the content directory."""
+    from pelican.utils import get_date
+    from pelican_tools.index import get_index
+    dates = {}
+    with get_index(settings) as index:
+        for entry in index.files():
+            modified = entry.metadata.get('modified')
+            if modified:
+                try:
+                    modified = get_date(modified).isoformat()
+                except (ValueError, OverflowError):
+                    modified = None
+            dates[entry.path] = w3c_date(modified or entry.date)
+    return dates
+
+
+def page_url(rel):
+    """Return the URL path of the output file ``rel``."""
+    if rel == 'index.html':
+        return ''
+    if rel.endswith('/index.html'):
+        return rel[:-len('index.html')]
+    return rel
+
+
+_sources = {}
+_listed = {}
+
+
+def collect_sources(generators):
+    """Record the source and URL of every article and page output."""
+    _sources.clear()
+    _listed.clear()
+    for generator in generators:
+        for name in ('articles', 'translations', 'pages',
+                     'hidden_pages', 'hidden_translations'):
+            for content in getattr(generator, name, ()):
+                save_as = getattr(content, 'save_as', None)
+                if save_as:
+                    _sources[save_as.replace(os.sep, '/')] = (
+                        content.relative_source_path.replace(os.sep, '/'),
+                        content.url)
+
+
+def collect_listed(path, context):
+    """Record the sources of the content listed by the output ``path``:
+    the objects of its pages if it is paginated, its articles otherwise."""
+    lists = [context['%s_page' % name[:-len('_paginator')]].object_list
+             for name in context if name.endswith('_paginator')]
+    if not lists:
+        lists = [context.get('articles') or ()]
+    _listed[os.path.abspath(path)] = set(
+        content.relative_source_path.replace(os.sep, '/')
+        for items in lists for content in items
+        if hasattr(content, 'relative_source_path'))
+
+
+def is_absolute(url):
+    parts = urlparse(url)
+    return bool(parts.scheme and parts.netloc)
+
+
+def write_sitemap(pelican):
+    settings = pelican.settings
+    siteurl = settings.get('SITEURL', '')
+    if not is_absolute(siteurl):
+        logger.warning('Not writing the sitemap: SITEURL %r is not an '
+                       'absolute URL', siteurl)
+        return
+    from pelican_tools import writer
+    writer.drain()
+    start = time.time()
+    dates = content_dates(settings)
+    exclude = settings.get('SITEMAP_EXCLUDE', DEFAULT_EXCLUDE)
+    name = settings.get('SITEMAP_NAME', 'sitemap')
+    output_path = os.path.abspath(pelican.output_path)
+    sitemap = ShardedSitemap(
+        output_path, siteurl, name, settings.get('SITEMAP_GZIP', True),
+        settings.get('SITEMAP_MAX_URLS', MAX_URLS),
+        settings.get('SITEMAP_MAX_BYTES', MAX_BYTES))
+    for path in iter_files(output_path, set(['html', 'htm'])):
+        rel = os.path.relpath(path, output_path).replace(os.sep, '/')
+        if any(fnmatch.fnmatch(rel, pattern) for pattern in exclude):
+            continue
+        source = _sources.get(rel)
+        if source is not None:
+            url, lastmod = source[1], dates.get(source[0])
+        else:
+            listed = [dates.get(source)
+                      for source in _listed.get(path, ())]
+            url = page_url(rel)
+            lastmod = max([date for date in listed if date] or [None])
+        sitemap.add('%s/%s' % (siteurl.rstrip('/'), url), lastmod)
+    sitemap.close()
+    logger.info('Wrote %d URLs to %d sitemap shards in %.2fs', sitemap.urls,
+                len(sitemap.shards), time.time() - start)
+
+
+def register():
+    from pelican import signals
+    signals.all_generators_finalized.connect(collect_sources)
+    signals.content_written.connect(collect_listed)
+    signals.finalized.connect(write_sitemap)
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""Helpers shared by the pelican-tools modules."""
+from __future__ import unicode_literals
+
+import errno
+import fnmatch
+import hashlib
+import importlib
+import io
+import json
+import logging
+import os
+import posixpath
+import re
+import tempfile
+
+from pelican_tools.compat import mtime_ns, replace
+
+try:
+    from urllib.parse import unquote
+except ImportError:  # pragma: no cover
+    from urllib import unquote
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def makedirs(path):
+    """Create ``path`` and its parents, ignoring already existing ones."""
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def atomic_write(path, data):
+    """Write ``data`` (bytes) to ``path`` through a temporary file.
+
+    Readers never see a partially written file: the content is written next
+    to its destination and renamed over it.
+    """
+    directory = os.path.dirname(path) or os.curdir
+    makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def load_json(path, default=None):
+    """Load a JSON document, returning ``default`` if it is missing or
+    unreadable."""
+    try:
+        with io.open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        if os.path.exists(path):
+            logger.warning('Ignoring unreadable cache %s: %s', path, e)
+        return default
+
+
+def dump_json(path, data):
+    """Atomically store ``data`` as compact JSON in ``path``."""
+    text = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    atomic_write(path, text.encode('utf-8'))
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path):
+    """Return the hex SHA-256 digest of the file at ``path``."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stat_key(path):
+    """Return ``[mtime_ns, size]`` for ``path``, used to detect changes
+    without reading the file."""
+    st = os.stat(path)
+    return [mtime_ns(st), st.st_size]
+
+
+def iter_files(root, extensions=None, ignores=()):
+    """Yield the paths of the files below ``root``.
+
+    Only files whose extension (without the dot) is in ``extensions`` are
+    returned, if given. Files and directories matching one of the
+    ``ignores`` glob patterns are skipped, like Pelican's ``IGNORE_FILES``.
+    """
+    ignored = _never
+    if ignores:
+        ignored = re.compile('|'.join(
+            '(?:%s)' % fnmatch.translate(p) for p in ignores)).match
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames[:] = sorted(d for d in dirnames if not ignored(d))
+        for filename in sorted(filenames):
+            if ignored(filename):
+                continue
+            if extensions is not None:
+                ext = filename.rpartition('.')[2]
+                if ext not in extensions or ext == filename:
+                    continue
+            yield os.path.join(dirpath, filename)
+
+
+def _never(name):
+    return False
+
+
+def url_target(url, page, siteurl=''):
+    """Return the path, relative to the output directory, of the file the
+    ``url`` found in the page ``page`` refers to, or None if it is not on
+    the site.
+
+    ``page`` is relative to the output directory too, and ``url`` is
+    absolute when it starts with ``siteurl``. The query and fragment of
+    ``url`` are ignored.
+    """
+    siteurl = siteurl.rstrip('/')
+    site_path = re.sub(r'^[a-z][a-z0-9+.-]*://[^/]*', '', siteurl)
+    if siteurl and url.startswith(siteurl + '/'):
+        target = url[len(siteurl) + 1:]
+    elif url.startswith('/') and not url.startswith('//'):
+        if site_path and not url.startswith(site_path + '/'):
+            return None
+        target = url[len(site_path) + 1:]
+    elif ':' in url or url.startswith(('//', '#')):
+        return None
+    else:
+        target = posixpath.join(posixpath.dirname(page), url)
+    target = re.split('[?#]', target, 1)[0]
+    if not target:
+        return None
+    target = posixpath.normpath(unquote(target))
+    if target == os.pardir or target.startswith(os.pardir + '/'):
+        return None
+    return target
+
+
+def cache_path(settings, name):
+    """Return the path of the pelican-tools cache file ``name``.
+
+    Caches live in ``PELICAN_TOOLS_CACHE_PATH``, which defaults to a
+    ``pelican-tools`` directory inside Pelican's ``CACHE_PATH``.
+    """
+    root = settings.get('PELICAN_TOOLS_CACHE_PATH') or os.path.join(
+        settings.get('CACHE_PATH', 'cache'), 'pelican-tools')
+    return os.path.join(root, name)
+
+
+class HashCache(object):
+    """SHA-256 digests of files, reused while their size and mtime are
+    unchanged.
+
+    The cache is a mapping of path to ``[mtime_ns, size, digest]`` and can be
+    persisted as JSON with :meth:`save`.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self.entries = load_json(path, {})
+
+    def digest(self, path):
+        """Return the digest of ``path``, hashing it only if it changed."""
+        key = stat_key(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry[:2] == key:
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        digest = sha256_file(path)
+        self.entries[path] = key + [digest]
+        return digest
+
+    def known(self, path):
+        """Return the recorded digest of ``path`` without touching the
+        filesystem, or None."""
+        entry = self.entries.get(path)
+        return entry[2] if entry else None
+
+    def changed(self, path):
+        """Return True if ``path`` differs from what was last recorded."""
+        previous = self.known(path)
+        try:
+            return previous is None or self.digest(path) != previous
+        except OSError:
+            return True
+
+    def discard(self, path):
+        self.entries.pop(path, None)
+
+    def save(self, path=None):
+        dump_json(path or self.path, self.entries)
+
+
+def read_settings(path=None, overrides=None):
+    """Read Pelican settings the same way the ``pelican`` command does."""
+    from pelican.settings import read_settings as _read_settings
+    return _read_settings(path, override=overrides or {})
+
+
+def enable_plugins(settings, *names):
+    """Append the plugins ``names`` to the ``PLUGINS`` setting, once."""
+    plugins = list(settings.get('PLUGINS') or [])
+    loaded = set(getattr(p, '__name__', p) for p in plugins)
+    plugins.extend(name for name in names if name not in loaded)
+    settings['PLUGINS'] = plugins
+    return settings
+
+
+def add_settings_arguments(parser):
+    """Add the ``pelican``-like arguments used to locate a site."""
+    parser.add_argument('path', nargs='?', default=None,
+                        help='Path where to find the content files.')
+    parser.add_argument('-s', '--settings', dest='settings',
+                        help='The settings of the application, this is '
+                        'automatically set to pelicanconf.py if a file exists '
+                        'with this name.')
+    parser.add_argument('-o', '--output', dest='output',
+                        help='Where to output the generated files.')
+    parser.add_argument('-t', '--theme-path', dest='theme',
+                        help='Path where to find the theme templates.')
+
+
+def settings_from_args(args):
+    """Return Pelican settings for arguments added by
+    :func:`add_settings_arguments`."""
+    return read_settings(*settings_source(args))
+
+
+def settings_source(args):
+    """Return the settings file and the overrides given by arguments added
+    by :func:`add_settings_arguments`."""
+    config = args.settings
+    if config is None and os.path.isfile('pelicanconf.py'):
+        config = 'pelicanconf.py'
+    overrides = {}
+    if args.path:
+        overrides['PATH'] = os.path.abspath(args.path)
+    if args.output:
+        overrides['OUTPUT_PATH'] = os.path.abspath(args.output)
+    if args.theme:
+        overrides['THEME'] = os.path.abspath(args.theme)
+    return config, overrides
+
+
+def get_pelican(settings):
+    """Return the Pelican instance (of ``PELICAN_CLASS``) for ``settings``."""
+    from pelican import Pelican
+    cls = settings.get('PELICAN_CLASS', Pelican)
+    if not isinstance(cls, type):
+        module, cls_name = cls.rsplit('.', 1)
+        cls = getattr(importlib.import_module(module), cls_name)
+    return cls(settings)
+
+
+def run_pelican(settings):
+    """Build the site described by ``settings`` and return the Pelican
+    instance."""
+    pelican = get_pelican(settings)
+    pelican.run()
+    return pelican
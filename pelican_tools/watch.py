@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""Rebuild a Pelican site incrementally when its sources change.
+
+``pelican-watch`` watches the content directory, the theme and the settings
+file with inotify on Linux (polling the files elsewhere, or with
+``--poll``). Events arriving within ``--debounce`` seconds of each other are
+handled as one batch, which triggers an incremental build: only the changed
+sources are read again (Pelican's content cache is enabled) and only the
+outputs depending on them are rendered (see :mod:`pelican_tools.incremental`).
+Pelican itself still runs in full. The delay between the first event of a
+batch and the end of the build is reported for every rebuild, with the
+number of outputs the dependency graph tells depend on the changes.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import logging
+import os
+import re
+import select
+import struct
+import sys
+import time
+
+from pelican_tools.compat import mtime_ns
+from pelican_tools.utils import (add_settings_arguments, enable_plugins,
+                                 get_pelican, iter_files, read_settings,
+                                 settings_source)
+
+logger = logging.getLogger(__name__)
+
+#: Files whose changes never trigger a build: editor swap and backup files.
+IGNORED = ('.*', '*~', '#*#', '*.swp', '*.swx', '4913')
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+_event = struct.Struct(str('iIII'))
+
+
+class InotifyWatcher(object):
+    """Watch directory trees with the Linux inotify API, through ctypes.
+
+    Raises OSError if inotify is not available.
+    """
+
+    def __init__(self, paths, ignored=()):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.ignored = ignored
+        self.roots = [os.path.abspath(p) for p in paths]
+        self._trees = tuple(os.path.join(p, '') for p in self.roots
+                            if os.path.isdir(p))
+        self._dirs = {}
+        for path in self.roots:
+            self._watch_tree(path)
+
+    def _wanted(self, path):
+        return path.startswith(self._trees) or path in self.roots
+
+    def _watch(self, directory):
+        wd = self._add_watch(self.fd,
+                             directory.encode(sys.getfilesystemencoding()),
+                             WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            logger.warning('Cannot watch %s: %s', directory,
+                           os.strerror(ctypes.get_errno()))
+            return
+        self._dirs[wd] = directory
+
+    def _unwatch_tree(self, root):
+        """Stop watching ``root`` and its subdirectories, moved out of the
+        watched trees."""
+        prefix = os.path.join(root, '')
+        for wd, directory in list(self._dirs.items()):
+            if directory == root or directory.startswith(prefix):
+                self._rm_watch(self.fd, wd)
+                del self._dirs[wd]
+
+    def _watch_tree(self, root):
+        """Watch ``root`` and its subdirectories, returning the files they
+        hold."""
+        if os.path.isfile(root):
+            # watch the directory of a file, to notice it being replaced
+            self._watch(os.path.dirname(root))
+            return []
+        files = []
+        for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+            dirnames[:] = [d for d in dirnames if not self.ignored(d)]
+            self._watch(dirpath)
+            files.extend(os.path.join(dirpath, f) for f in filenames)
+        return files
+
+    def wait(self, timeout=None):
+        """Return the set of paths changed within ``timeout`` seconds
+        (forever if None), empty if nothing changed."""
+        changed = set()
+        while not changed:
+            start = time.time()
+            if not select.select([self.fd], [], [], timeout)[0]:
+                return changed
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                raise
+            changed = self._parse(data)
+            if timeout is not None:
+                timeout = max(0, timeout - (time.time() - start))
+        return changed
+
+    def _parse(self, data):
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event.unpack_from(data, offset)
+            offset += _event.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost: consider everything changed
+                changed.update(self.roots)
+                continue
+            directory = self._dirs.get(wd)
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if directory is None or not name:
+                continue
+            name = name.decode(sys.getfilesystemencoding())
+            if self.ignored(name):
+                continue
+            path = os.path.join(directory, name)
+            if not self._wanted(path):
+                continue  # a sibling of a watched file
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self._watch_tree(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    # the files it held are gone
+                    if mask & IN_MOVED_FROM:
+                        self._unwatch_tree(path)
+                    changed.add(path)
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """Watch directory trees by comparing the size and modification time of
+    their files every ``interval`` seconds."""
+
+    def __init__(self, paths, ignored=(), interval=1.0):
+        self.roots = [os.path.abspath(p) for p in paths]
+        self.ignored = ignored
+        self.interval = interval
+        self._state = self._snapshot()
+
+    def _snapshot(self):
+        state = {}
+        for root in self.roots:
+            files = [root] if os.path.isfile(root) else iter_files(root)
+            for path in files:
+                if self.ignored(os.path.basename(path)):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                state[path] = (mtime_ns(st), st.st_size)
+        return state
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.time())
+                if delay < 0:
+                    return set()
+            time.sleep(delay)
+            state = self._snapshot()
+            changed = set(path for path in set(state) | set(self._state)
+                          if state.get(path) != self._state.get(path))
+            self._state = state
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+def ignore_matcher(patterns):
+    """Return a function telling if a file name matches ``patterns``."""
+    return re.compile('|'.join('(?:%s)' % fnmatch.translate(p)
+                               for p in patterns)).match
+
+
+def get_watcher(paths, ignored, poll=False, interval=1.0):
+    """Return an inotify watcher for ``paths``, or a polling one if inotify
+    is not available or ``poll`` is true."""
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(paths, ignored)
+        except OSError as e:
+            logger.warning('Cannot use inotify (%s), polling instead', e)
+    return PollingWatcher(paths, ignored, interval)
+
+
+def batches(watcher, debounce=0.1, max_delay=2.0):
+    """Yield ``(paths, first_event_time)`` for each burst of changes.
+
+    A batch ends when no change happened for ``debounce`` seconds, or
+    ``max_delay`` seconds after its first event.
+    """
+    while True:
+        changed = watcher.wait()
+        first = time.time()
+        while time.time() - first < max_delay:
+            more = watcher.wait(debounce)
+            if not more:
+                break
+            changed |= more
+        yield changed, first
+
+
+class Builder(object):
+    """Build a site incrementally, reloading the settings when the settings
+    file changes."""
+
+    def __init__(self, settings_file, overrides, content_cache=True):
+        self.settings_file = settings_file
+        self.overrides = overrides
+        self.content_cache = content_cache
+        self.load()
+
+    def load(self):
+        settings = read_settings(self.settings_file, self.overrides)
+        if self.content_cache:
+            # parse only the sources which changed since the last build
+            settings['CACHE_CONTENT'] = True
+            settings['LOAD_CONTENT_CACHE'] = True
+        enable_plugins(settings, 'pelican_tools.incremental')
+        self.settings = settings
+        self.pelican = get_pelican(settings)
+
+    def watched_paths(self):
+        settings = self.settings
+        paths = [settings['PATH'], os.path.join(settings['THEME'],
+                                                'templates')]
+        paths.extend(settings.get('WATCH_PATHS', ()))
+        if self.settings_file:
+            paths.append(self.settings_file)
+        return [os.path.abspath(p) for p in paths if os.path.exists(p)]
+
+    def excluded(self, path):
+        """Return True for paths written by the build itself."""
+        for setting in ('OUTPUT_PATH', 'CACHE_PATH'):
+            root = os.path.join(os.path.abspath(self.settings[setting]), '')
+            if path.startswith(root):
+                return True
+        return False
+
+    def build(self):
+        """Build the site and return the incremental cache counters.
+
+        Pelican runs in full: the incremental cache is what limits the
+        build to the changed sources and the outputs depending on them.
+        """
+        from pelican_tools.incremental import get_cache
+        self.pelican.run()
+        cache = get_cache(self.settings)
+        return cache.rendered, cache.skipped
+
+    def affected(self, paths):
+        """Return the number of outputs the last build rendered from
+        ``paths``, as recorded by the dependency graph, for the report of
+        the rebuild."""
+        from pelican_tools.depgraph import node
+        from pelican_tools.incremental import get_cache
+        graph = get_cache(self.settings).graph
+        templates = os.path.join(os.path.abspath(self.settings['THEME']),
+                                 'templates', '')
+        changed = []
+        for path in paths:
+            if path.startswith(templates):
+                path = node('template', path[len(templates):].replace(
+                    os.sep, '/'))
+            elif path == os.path.abspath(self.settings_file or ''):
+                path = node('setting', '*')
+            elif not os.path.isfile(path):
+                # maybe a removed directory: the sources it held
+                prefix = node('source', os.path.join(path, ''))
+                changed.extend(name for name in graph.fingerprints
+                               if name.startswith(prefix))
+            changed.append(path)
+        return len(graph.affected(changed))
+
+
+def watch(builder, poll=False, interval=1.0, debounce=0.1, max_delay=2.0,
+          initial=True):
+    """Build the site whenever its sources change, until interrupted.
+
+    Return the latencies of the rebuilds, in seconds.
+    """
+    latencies = []
+    if initial:
+        start = time.time()
+        rendered, skipped = builder.build()
+        print('Built the site in %.2fs: %d outputs rendered, %d unchanged' % (
+            time.time() - start, rendered, skipped))
+    ignored = ignore_matcher(list(IGNORED) +
+                             list(builder.settings.get('IGNORE_FILES', ())))
+    watcher = get_watcher(builder.watched_paths(), ignored, poll, interval)
+    print('Watching %s with %s' % (', '.join(builder.watched_paths()),
+                                   type(watcher).__name__))
+    try:
+        for changed, first_event in batches(watcher, debounce, max_delay):
+            changed = sorted(p for p in changed if not builder.excluded(p))
+            if not changed:
+                continue
+            names = ', '.join(os.path.relpath(p) for p in changed[:3])
+            if len(changed) > 3:
+                names += ' and %d more' % (len(changed) - 3)
+            try:
+                if builder.settings_file and \
+                        os.path.abspath(builder.settings_file) in changed:
+                    builder.load()
+                affected = builder.affected(changed)
+                start = time.time()
+                rendered, skipped = builder.build()
+            except Exception as e:
+                logger.error('Build failed: %s', e,
+                             exc_info=logger.isEnabledFor(logging.DEBUG))
+                continue
+            end = time.time()
+            latencies.append(end - first_event)
+            print('%s changed: %d outputs rendered (of %d depending on it), '
+                  '%d unchanged; built in %.2fs, %.0fms after the first '
+                  'event' % (names, rendered, affected, skipped, end - start,
+                             (end - first_event) * 1000))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pelican-watch',
+        description='Build a Pelican site, then rebuild it incrementally '
+        'whenever its content, theme or settings change.')
+    add_settings_arguments(parser)
+    parser.add_argument('--debounce', type=float, default=0.1,
+                        help='Seconds without changes ending a batch '
+                        '(default: %(default)s).')
+    parser.add_argument('--max-delay', type=float, default=2.0,
+                        help='Maximum seconds between the first change of a '
+                        'batch and the build (default: %(default)s).')
+    parser.add_argument('--poll', action='store_true',
+                        help='Poll the files instead of using inotify.')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='Polling interval in seconds (default: '
+                        '%(default)s).')
+    parser.add_argument('--no-initial-build', action='store_false',
+                        dest='initial',
+                        help='Wait for changes before building.')
+    parser.add_argument('--no-content-cache', action='store_false',
+                        dest='content_cache',
+                        help="Read every source on each build instead of "
+                        "using Pelican's content cache.")
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        const=logging.INFO, dest='verbosity',
+                        default=logging.WARNING, help='Show all messages.')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.verbosity,
+                        format='%(levelname)s: %(message)s')
+
+    config, overrides = settings_source(args)
+    builder = Builder(config, overrides, args.content_cache)
+    latencies = watch(builder, args.poll, args.interval, args.debounce,
+                      args.max_delay, args.initial)
+    if latencies:
+        latencies.sort()
+        print('\n%d rebuilds, latency median %.0fms, max %.0fms' % (
+            len(latencies), latencies[len(latencies) // 2] * 1000,
+            latencies[-1] * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""WebP copies of the images of the output, served through ``<picture>``.
+
+Add ``pelican_tools.webp`` to ``PLUGINS`` to encode, at the end of every
+build, a WebP copy of every JPEG and PNG image of the output directory in a
+pool of processes (``WEBP_JOBS``): ``images/photo.jpg`` gets
+``images/photo.jpg.webp``. A copy is only kept when it is smaller than the
+original by at least ``WEBP_MARGIN`` (10% by default). The ``<img>`` tags
+of the HTML pages referring to images with a WebP copy are wrapped in
+``<picture>`` elements offering the copy first, as the pages are written::
+
+    <picture data-webp><source srcset="photo.jpg.webp" type="image/webp">
+    <img src="photo.jpg" alt=""></picture>
+
+Images with a ``srcset`` are wrapped when every candidate has a WebP copy.
+
+Pages are written before Pelican copies the images, so they are wrapped
+according to the copies of the previous build; the pages written with a
+decision which turned out different, such as those showing a new image, are
+rewritten once the copies are made. Unchanged pages are thus written once,
+and left alone by :mod:`pelican_tools.output` on the next builds.
+
+Decisions are recorded in ``cache/pelican-tools/webp`` (see
+``WEBP_STORE_PATH``) under the SHA-256 of the image and of the encoding
+options, with the kept copies, so an image is never encoded twice. The stat
+of the images and the images the pages show are recorded in
+``cache/pelican-tools/webp.json`` (``WEBP_CACHE_PATH``): unchanged images
+are not read again.
+
+``WEBP_QUALITY`` (80) is the quality of the copies, and PNG images are
+encoded losslessly unless ``WEBP_LOSSLESS_PNG`` is False. List the plugin
+before the plugins working on the finished output, such as
+``pelican_tools.compress``. This needs the ``Pillow`` package.
+"""
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pelican.writers import Writer
+
+from pelican_tools.compat import mtime_ns
+from pelican_tools.images import link
+from pelican_tools.utils import (atomic_write, cache_path, dump_json,
+                                 iter_files, load_json, sha256_bytes,
+                                 url_target)
+
+try:
+    from html import unescape
+except ImportError:  # pragma: no cover
+    from HTMLParser import HTMLParser
+    unescape = HTMLParser().unescape
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+#: Bumped when the cache format or the way copies are encoded changes.
+CACHE_VERSION = 2
+
+EXTENSIONS = ('jpg', 'jpeg', 'png')
+
+DEFAULT_OPTIONS = {
+    'quality': 80,
+    'lossless_png': True,
+    'method': 4,
+    'margin': 0.1,
+}
+
+#: Number of images sent to a worker process at once.
+CHUNK_SIZE = 8
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [mtime_ns(st), st.st_size]
+
+
+def options_key(options):
+    return json.dumps([CACHE_VERSION, options], sort_keys=True)
+
+
+def encode(data, options, lossless=False):
+    """Return the WebP encoding of the image ``data``."""
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert(
+            'RGBA' if 'A' in image.getbands() or
+            'transparency' in image.info else 'RGB')
+    f = io.BytesIO()
+    if lossless:
+        image.save(f, 'WEBP', lossless=True, method=options['method'])
+    else:
+        image.save(f, 'WEBP', quality=options['quality'],
+                   method=options['method'])
+    return f.getvalue()
+
+
+def convert_file(path, store, options):
+    """Write the WebP copy of ``path`` if it is worth it, and return its
+    cache entry.
+
+    The decision for the same content and options is read from the
+    ``store``: ``<key>.webp`` holds a kept copy, and an empty ``<key>.no``
+    records that the copy was not smaller enough.
+    """
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = sha256_bytes(data)
+    key = hashlib.sha256(('%s:%s' % (digest, options_key(options))).encode(
+        'utf-8')).hexdigest()
+    blob = os.path.join(store, key[:2], key)
+    entry = {'stat': [mtime_ns(st), st.st_size], 'key': key,
+             'sizes': [len(data), None], 'encoded': False}
+    if os.path.exists(blob + '.webp'):
+        entry['sizes'][1] = os.path.getsize(blob + '.webp')
+    elif not os.path.exists(blob + '.no'):
+        lossless = options['lossless_png'] and \
+            path.rpartition('.')[2].lower() == 'png'
+        webp = encode(data, options, lossless)
+        entry['encoded'] = True
+        if len(webp) <= len(data) * (1 - options['margin']):
+            atomic_write(blob + '.webp', webp)
+            entry['sizes'][1] = len(webp)
+        else:
+            atomic_write(blob + '.no', b'')
+    sidecar = path + '.webp'
+    if entry['sizes'][1] is not None:
+        link(blob + '.webp', sidecar)
+        entry['webp'] = _stat(sidecar)
+    else:
+        entry['webp'] = None
+    return entry
+
+
+def _convert_chunk(chunk):
+    results = []
+    for rel, path, store, options in chunk:
+        try:
+            results.append((rel, convert_file(path, store, options)))
+        except Exception as e:
+            # Pillow raises many kinds of errors for broken images
+            logger.warning('Cannot encode %s: %s', path, e)
+            results.append((rel, None))
+    return results
+
+
+_token = re.compile(r'''
+    <picture\ data-webp(?:="")?>\s*<source\b[^>]*>\s*(<img\b[^>]*>)\s*
+        </picture>                                      # 1: one of ours
+  | (<(pre|textarea|script|style|picture)\b.*?</\3\s*>)  # 2: left alone
+  | (<img\b[^>]*>)                                      # 4: image
+''', re.I | re.S | re.X)
+
+_attr = re.compile(r'''([^\s=/>]+)\s*=\s*("[^"]*"|'[^']*'|[^\s>]+)''')
+
+
+def _attributes(tag):
+    return dict((name.lower(), value.strip('"\''))
+                for name, value in _attr.findall(tag))
+
+
+class PageRewriter(object):
+    """Wraps the images of pages with WebP copies in ``<picture>``."""
+
+    def __init__(self, webps, siteurl=''):
+        self.webps = webps
+        self.siteurl = siteurl
+
+    def resolve(self, url, page):
+        """Return the path in the output of the image ``url`` of the page
+        ``page``, None for remote images."""
+        url = unescape(url)
+        if '?' in url or '#' in url:
+            return None  # the WebP URL could not be derived from it
+        return url_target(url, page, self.siteurl)
+
+    def picture(self, tag, page, refs):
+        attrs = _attributes(tag)
+        srcset = attrs.get('srcset')
+        if srcset:
+            candidates = [c.strip().split(None, 1) for c in srcset.split(',')
+                          if c.strip()]
+            urls = [c[0] for c in candidates]
+        else:
+            urls = [attrs.get('src', '')]
+        rels = [self.resolve(url, page) for url in urls if url]
+        refs.update(rel for rel in rels if rel and
+                    rel.rpartition('.')[2].lower() in EXTENSIONS)
+        if not rels or not all(rel in self.webps for rel in rels):
+            return tag
+        if srcset:
+            source = ', '.join(' '.join([c[0] + '.webp'] + c[1:])
+                               for c in candidates)
+        else:
+            source = urls[0] + '.webp'
+        sizes = attrs.get('sizes')
+        return '<picture data-webp><source srcset="%s" type="image/webp"%s>' \
+            '%s</picture>' % (source, ' sizes="%s"' % sizes if sizes else '',
+                              tag)
+
+    def rewrite(self, html, page):
+        """Return ``html`` with its images wrapped, and the images it
+        refers to."""
+        refs = set()
+
+        def replace(match):
+            if match.group(1):
+                return self.picture(match.group(1), page, refs)
+            if match.group(4):
+                return self.picture(match.group(4), page, refs)
+            return match.group(0)
+        return _token.sub(replace, html), refs
+
+
+class WebPConverter(object):
+    """Writes the WebP copies of the images of ``output_path`` and wraps the
+    images of its pages."""
+
+    def __init__(self, output_path, store, cache_file, options=None,
+                 jobs=None, siteurl=''):
+        self.output_path = os.path.abspath(output_path)
+        self.store = os.path.abspath(store)
+        self.cache_file = cache_file
+        self.options = dict(DEFAULT_OPTIONS, **(options or {}))
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.siteurl = siteurl
+        data = load_json(cache_file, {}) if cache_file else {}
+        if data.get('version') == CACHE_VERSION and \
+                data.get('output_path') == self.output_path:
+            self.images = data.get('images', {})
+            self.pages = data.get('pages', {})
+        else:
+            self.images, self.pages = {}, {}
+        self._lock = threading.Lock()
+        self._rewriter = PageRewriter(self.webps(), siteurl)
+        self.stats = dict.fromkeys(('encoded', 'kept', 'rejected',
+                                    'unchanged', 'errors', 'pages',
+                                    'bytes_saved'), 0)
+
+    def webps(self):
+        """Return the images known to have a WebP copy."""
+        return set(rel for rel, entry in self.images.items()
+                   if entry['webp'] is not None)
+
+    def wrap(self, html, page):
+        """Return the page ``page`` with its images wrapped in ``<picture>``
+        according to the copies known so far."""
+        rewriter = self._rewriter
+        html, refs = rewriter.rewrite(html, page)
+        with self._lock:
+            self.pages[page] = [sorted(refs),
+                                sorted(rewriter.webps.intersection(refs))]
+        return html
+
+    def is_fresh(self, rel, path):
+        entry = self.images.get(rel)
+        return (entry is not None and entry['stat'] == _stat(path) and
+                entry['options'] == options_key(self.options) and
+                entry['webp'] == _stat(path + '.webp'))
+
+    def convert(self):
+        pending = []
+        seen = set()
+        for path in iter_files(self.output_path, EXTENSIONS):
+            rel = os.path.relpath(path, self.output_path).replace(os.sep,
+                                                                  '/')
+            seen.add(rel)
+            if self.is_fresh(rel, path):
+                self.stats['unchanged'] += 1
+            else:
+                pending.append((rel, path, self.store, self.options))
+        for rel in set(self.images) - seen:
+            self._remove_webp(rel, self.images.pop(rel))
+        chunks = [pending[i:i + CHUNK_SIZE]
+                  for i in range(0, len(pending), CHUNK_SIZE)]
+        if self.jobs > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(self.jobs) as pool:
+                for results in pool.map(_convert_chunk, chunks):
+                    self._record(results)
+        else:
+            for chunk in chunks:
+                self._record(_convert_chunk(chunk))
+
+    def _remove_webp(self, rel, entry):
+        path = os.path.join(self.output_path, *rel.split('/')) + '.webp'
+        if entry['webp'] is not None and _stat(path) == entry['webp']:
+            os.remove(path)
+
+    def _record(self, results):
+        for rel, entry in results:
+            previous = self.images.pop(rel, None)
+            if entry is None:
+                self.stats['errors'] += 1
+                continue
+            if entry['webp'] is None and previous is not None:
+                self._remove_webp(rel, previous)
+            self.stats['encoded'] += entry.pop('encoded')
+            original, webp = entry['sizes']
+            if webp is None:
+                self.stats['rejected'] += 1
+            else:
+                self.stats['kept'] += 1
+                self.stats['bytes_saved'] += original - webp
+            entry['options'] = options_key(self.options)
+            self.images[rel] = entry
+
+    def rewrite_pages(self):
+        """Wrap the images of the pages written with a different idea of
+        which images have a copy, such as those showing new images."""
+        webps = self.webps()
+        rewriter = PageRewriter(webps, self.siteurl)
+        for rel, (refs, wrapped) in list(self.pages.items()):
+            path = os.path.join(self.output_path, *rel.split('/'))
+            if not os.path.exists(path):
+                del self.pages[rel]
+                continue
+            if sorted(webps.intersection(refs)) == wrapped:
+                continue
+            with io.open(path, encoding='utf-8') as f:
+                html = f.read()
+            rewritten, refs = rewriter.rewrite(html, rel)
+            if rewritten != html:
+                atomic_write(path, rewritten.encode('utf-8'))
+                self.stats['pages'] += 1
+            self.pages[rel] = [sorted(refs),
+                               sorted(webps.intersection(refs))]
+
+    def run(self):
+        self.convert()
+        self.rewrite_pages()
+        if self.cache_file:
+            dump_json(self.cache_file, {'version': CACHE_VERSION,
+                                        'output_path': self.output_path,
+                                        'images': self.images,
+                                        'pages': self.pages})
+        return self.stats
+
+    def summary(self):
+        return ('%(encoded)d images encoded, %(kept)d WebP copies kept '
+                '(%(bytes_saved)d bytes saved), %(rejected)d not smaller '
+                'enough, %(unchanged)d unchanged; %(pages)d pages '
+                'rewritten' % self.stats)
+
+
+def get_converter(settings, output_path=None):
+    options = {}
+    for name in DEFAULT_OPTIONS:
+        if 'WEBP_' + name.upper() in settings:
+            options[name] = settings['WEBP_' + name.upper()]
+    return WebPConverter(
+        output_path or settings.get('OUTPUT_PATH', 'output'),
+        settings.get('WEBP_STORE_PATH') or cache_path(settings, 'webp'),
+        settings.get('WEBP_CACHE_PATH') or cache_path(settings, 'webp.json'),
+        options, settings.get('WEBP_JOBS'), settings.get('SITEURL', ''))
+
+
+_converter = None
+
+
+def shared_converter(settings, output_path):
+    """Return the converter of the build, shared by the writer and
+    :func:`convert_output`."""
+    global _converter
+    if _converter is None:
+        _converter = get_converter(settings, output_path)
+    return _converter
+
+
+class _WrappedFile(io.StringIO):
+    """Collects a page, written to ``target`` with its images wrapped on
+    close."""
+
+    def __init__(self, target, page, converter):
+        super(_WrappedFile, self).__init__()
+        self.target = target
+        self.page = page
+        self.converter = converter
+
+    def close(self):
+        if not self.closed:
+            html = self.getvalue()
+            super(_WrappedFile, self).close()
+            try:
+                self.target.write(self.converter.wrap(html, self.page))
+            finally:
+                self.target.close()
+
+
+class WebPWriter(Writer):
+    """Writer wrapping the images with a WebP copy in ``<picture>``."""
+
+    writer_priority = 14
+
+    def __init__(self, output_path, settings=None):
+        super(WebPWriter, self).__init__(output_path, settings=settings)
+        self.converter = shared_converter(self.settings, output_path)
+
+    def _open_w(self, filename, encoding, override=False):
+        f = super(WebPWriter, self)._open_w(filename, encoding,
+                                            override=override)
+        if filename.rpartition('.')[2].lower() in ('html', 'htm'):
+            page = os.path.relpath(filename, self.output_path)
+            return _WrappedFile(f, page.replace(os.sep, '/'),
+                                self.converter)
+        return f
+
+
+def convert_output(pelican):
+    global _converter
+    if Image is None:
+        logger.warning('Pillow is not installed, no WebP copies')
+        _converter = None
+        return
+    from pelican_tools import writer
+    writer.drain()
+    start = time.time()
+    converter = shared_converter(pelican.settings, pelican.output_path)
+    _converter = None
+    converter.run()
+    logger.info('WebP in %.2fs: %s', time.time() - start,
+                converter.summary())
+
+
+def register():
+    from pelican import signals
+    from pelican_tools import writer
+    writer.use(WebPWriter)
+    signals.finalized.connect(convert_output)
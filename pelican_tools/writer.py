@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""Pelican writer rendering and writing pages in a pool of threads.
+
+Add ``pelican_tools.writer`` to ``PLUGINS`` to replace Pelican's serial
+writer by a producer/consumer pipeline: generators queue the pages to write
+and ``PARALLEL_WRITE_JOBS`` threads render and write them, so that template
+rendering overlaps with file writes. The queue holds at most
+``PARALLEL_WRITE_QUEUE`` pages: generators wait when it is full, which caps
+memory use whatever the size of the site.
+
+Pelican only uses one writer, so the pelican-tools plugins which need their
+own writer register it with :func:`use`, and Pelican gets a writer class
+combining all of them.
+"""
+from __future__ import unicode_literals
+
+import logging
+import multiprocessing
+import sys
+import threading
+import weakref
+
+from pelican.writers import Writer
+
+from pelican_tools.compat import queue
+
+logger = logging.getLogger(__name__)
+
+_writer_classes = []
+_active = weakref.WeakSet()
+
+
+def use(cls):
+    """Make Pelican write with ``cls``, a subclass of Pelican's ``Writer``.
+
+    Several classes can be used at once: they are combined in the order of
+    their ``writer_priority`` attribute, lower priorities being the outer
+    ones.
+    """
+    from pelican import signals
+    if cls not in _writer_classes:
+        _writer_classes.append(cls)
+    signals.get_writer.connect(get_writer)
+
+
+def get_writer(pelican):
+    classes = sorted(_writer_classes,
+                     key=lambda cls: getattr(cls, 'writer_priority', 50))
+    if not classes:
+        return None
+    if len(classes) == 1:
+        return classes[0]
+    return type(str('PelicanToolsWriter'), tuple(classes), {})
+
+
+def track(writer):
+    """Have :func:`drain` and the ``finalized`` signal wait for ``writer``,
+    which writes files asynchronously.
+
+    ``writer`` has a ``drain()`` method, and a ``close()`` method if it
+    holds resources to release at the end of the build. Writer classes
+    combined with others call the methods of the next class in the MRO.
+    """
+    _active.add(writer)
+
+
+def drain():
+    """Wait until every page queued so far has been written.
+
+    Plugins working on the output directory when the build is finalized
+    should call it first.
+    """
+    for writer in list(_active):
+        writer.drain()
+
+
+class ThreadedWriter(Writer):
+    """Writer rendering and writing pages in a pool of threads.
+
+    :meth:`write_file` only queues the page; errors raised by the workers
+    are raised again by the next call to :meth:`write_file` or
+    :meth:`drain`. Receivers of the ``content_written`` signal are called
+    from the worker threads.
+
+    Pages with relative URLs are rendered one at a time, as contents read
+    the URL of the site for the page being rendered from the context they
+    share (see :class:`_PageContext`); their files are still written in
+    parallel.
+    """
+
+    writer_priority = 0
+
+    def __init__(self, output_path, settings=None):
+        super(ThreadedWriter, self).__init__(output_path, settings=settings)
+        jobs = self.settings.get('PARALLEL_WRITE_JOBS') or min(
+            32, multiprocessing.cpu_count() + 4)
+        size = self.settings.get('PARALLEL_WRITE_QUEUE') or jobs * 4
+        self._queue = queue.Queue(size)
+        self._errors = []
+        self._open_lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self._rendering = threading.local()
+        self._threads = []
+        for i in range(jobs):
+            thread = threading.Thread(target=self._work,
+                                      name='pelican-writer-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        _active.add(self)
+
+    def write_file(self, name, template, context, *args, **kwargs):
+        if not name:
+            return
+        self._raise_errors()
+        # the generators may update their context once the call returns
+        self._queue.put((name, template, _PageContext(context, self), args,
+                         kwargs))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                name, template, context, args, kwargs = item
+                super(ThreadedWriter, self).write_file(
+                    name, template, context, *args, **kwargs)
+            except RuntimeError:
+                if _invalid_slug(item[4]):
+                    # like Pelican, skip the pages of tags without a slug
+                    logger.info('Skipping %s: invalid slug', item[0])
+                else:
+                    self._errors.append(sys.exc_info())
+            except Exception:
+                logger.debug('Failed to write %s', item[0], exc_info=True)
+                self._errors.append(sys.exc_info())
+            finally:
+                self._end_render()
+                self._queue.task_done()
+
+    def _begin_render(self):
+        if not getattr(self._rendering, 'locked', False):
+            self._render_lock.acquire()
+            self._rendering.locked = True
+
+    def _end_render(self):
+        if getattr(self._rendering, 'locked', False):
+            self._rendering.locked = False
+            self._render_lock.release()
+
+    def _open_w(self, filename, encoding, override=False):
+        # Pelican opens the file once the page is rendered
+        self._end_render()
+        # keep Pelican's check against writing the same file twice atomic
+        with self._open_lock:
+            return super(ThreadedWriter, self)._open_w(
+                filename, encoding, override=override)
+
+    def _raise_errors(self):
+        if self._errors:
+            exc = self._errors[0][1]
+            del self._errors[:]
+            raise exc
+
+    def drain(self):
+        """Wait for the queued pages to be written."""
+        self._queue.join()
+        self._raise_errors()
+        parent = getattr(super(ThreadedWriter, self), 'drain', None)
+        if parent is not None:
+            parent()
+
+    def close(self):
+        """Write the queued pages and stop the threads."""
+        self.drain()
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        del self._threads[:]
+        parent = getattr(super(ThreadedWriter, self), 'close', None)
+        if parent is not None:
+            parent()
+        _active.discard(self)
+
+
+class _PageContext(dict):
+    """Copy of the context of a generator, queued with a page.
+
+    Before rendering a page with relative URLs, Pelican's writer sets
+    ``localsiteurl`` in the context, from which contents make their links
+    relative: contents read it from the context of their generator, not
+    from this copy. The copy sets it in the shared context too, and the
+    writer holds its render lock until the page is rendered, so that no
+    other page changes it in the meantime.
+    """
+
+    def __init__(self, context, writer):
+        super(_PageContext, self).__init__(context)
+        self._shared = context
+        self._writer = writer
+
+    def __setitem__(self, name, value):
+        if name == 'localsiteurl':
+            self._writer._begin_render()
+            self._shared[name] = value
+        super(_PageContext, self).__setitem__(name, value)
+
+
+def _invalid_slug(kwargs):
+    for name in ('tag', 'category', 'author'):
+        if name in kwargs and not getattr(kwargs[name], 'slug', True):
+            return True
+    return False
+
+
+def drain_writer(generator, writer):
+    if hasattr(writer, 'drain'):
+        writer.drain()
+
+
+def close_writers(pelican):
+    for writer in list(_active):
+        if hasattr(writer, 'close'):
+            writer.close()
+        _active.discard(writer)
+
+
+def register():
+    from pelican import signals
+    use(ThreadedWriter)
+    signals.article_writer_finalized.connect(drain_writer)
+    signals.page_writer_finalized.connect(drain_writer)
+    signals.finalized.connect(close_writers)
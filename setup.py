@@ -1,13 +1,38 @@
 #!/usr/bin/env python
+import sys
+
 from setuptools import setup
 
 requires = []
 
+if sys.version_info < (3, 2):
+    requires.append('futures')
+
+extras_require = {
+    'brotli': ['brotli'],
+    'zopfli': ['zopfli'],
+    'images': ['Pillow'],
+    'placeholders': ['Pillow', 'numpy'],
+}
+
 entry_points = {
-    'console_scripts': []
+    'console_scripts': [
+        'pelican-incremental = pelican_tools.incremental.cli:main',
+        'pelican-tools = pelican_tools.cli:main',
+        'pelican-scan = pelican_tools.scan:main',
+        'pelican-watch = pelican_tools.watch:main',
+        'pelican-profile = pelican_tools.profile:main',
+        'pelican-precompress = pelican_tools.compress:main',
+        'pelican-manifest = pelican_tools.manifest:main',
+        'pelican-images = pelican_tools.images:main',
+        'pelican-optimize-images = pelican_tools.optimize:main',
+    ]
 }
 
-packages = []
+packages = [
+    'pelican_tools',
+    'pelican_tools.incremental',
+]
 
 setup(
     name='pelican-tools',
@@ -20,6 +45,7 @@ setup(
     packages=packages,
     include_package_data=True,
     install_requires=requires,
+    extras_require=extras_require,
     entry_points=entry_points,
     classifiers=[
         'Development Status :: 5 - Production/Stable',
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Small Pelican sites built in temporary directories.
+
+Sites are built by running ``pelican`` in a separate process, like users
+do: the plugins keep state in their modules (writer classes, signal
+receivers), which must not leak from one build to the next.
+"""
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ARTICLE = '''Title: Article {number}
+Date: 2024-01-{number:02d} 10:00
+Category: cat{category}
+Tags: t{number}, common
+Slug: a{number}
+Summary: Summary of article {number}.
+
+Body of article {number}, which links to [the first
+article]({{filename}}/a1.md).
+'''
+
+#: Settings of every test site, before the settings of the test.
+SETTINGS = {
+    'SITENAME': 'Test site',
+    'SITEURL': '',
+    'TIMEZONE': 'UTC',
+    'DEFAULT_LANG': 'en',
+    'RELATIVE_URLS': True,
+    'DEFAULT_PAGINATION': 2,
+    'FEED_ALL_ATOM': 'feeds/all.atom.xml',
+    'CATEGORY_FEED_ATOM': 'feeds/{slug}.atom.xml',
+    'TAG_FEED_ATOM': 'feeds/tag.{slug}.atom.xml',
+    'LOAD_CONTENT_CACHE': False,
+}
+
+
+class SiteTestCase(unittest.TestCase):
+    """Test case with a site in a temporary directory."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='pelican-tools-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.content = os.path.join(self.root, 'content')
+        os.makedirs(self.content)
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def write(self, rel, data):
+        """Write ``data`` (text or bytes) to ``rel`` in the content."""
+        path = os.path.join(self.content, *rel.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if isinstance(data, bytes):
+            with open(path, 'wb') as f:
+                f.write(data)
+        else:
+            with io.open(path, 'w', encoding='utf-8') as f:
+                f.write(data)
+        return path
+
+    def write_articles(self, count=5, categories=2):
+        for number in range(1, count + 1):
+            self.write('a%d.md' % number, ARTICLE.format(
+                number=number, category=number % categories))
+
+    def build(self, name='output', plugins=(), **settings):
+        """Build the site to the output directory ``name``, with its own
+        cache, and return the path of the output directory."""
+        output = self.path(name)
+        values = dict(SETTINGS, PATH=self.content, OUTPUT_PATH=output,
+                      CACHE_PATH=self.path('cache-%s' % name),
+                      PLUGINS=list(plugins))
+        values.update(settings)
+        config = self.path('%s.py' % name)
+        with io.open(config, 'w', encoding='utf-8') as f:
+            for key, value in sorted(values.items()):
+                f.write('%s = %r\n' % (key, value))
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'pelican', '-s', config, '-q'],
+            cwd=self.root, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = process.communicate()[0].decode('utf-8', 'replace')
+        if process.returncode:
+            self.fail('Building %s failed:\n%s' % (name, out))
+        return output
+
+    def assertSameOutput(self, expected, actual, stale=()):
+        """Assert that two output directories hold the same files, but for
+        the ``stale`` files of ``actual``."""
+        expected, actual = read_tree(expected), read_tree(actual)
+        self.assertEqual(sorted(actual), sorted(set(expected) | set(stale)))
+        for rel in sorted(expected):
+            if expected[rel] != actual[rel]:
+                self.assertMultiLineEqual(
+                    expected[rel].decode('utf-8', 'replace'),
+                    actual[rel].decode('utf-8', 'replace'),
+                    '%s differs' % rel)
+
+
+def read_tree(root):
+    """Return the content of the files below ``root`` by relative path."""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            rel = os.path.relpath(path, root).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                files[rel] = f.read()
+    return files
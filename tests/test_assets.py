@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from pelican_tools.assets import minify_css, minify_js
+
+
+class MinifyTest(unittest.TestCase):
+
+    def test_css(self):
+        self.assertEqual(minify_css('''/* comment */
+/*! license */
+a  >  b ,  c {
+    color:  red ;
+    content: "  x  ";
+}
+'''), '/*! license */ a>b,c{color:red;content:"  x  "}')
+
+    def test_js(self):
+        self.assertEqual(minify_js('''// comment
+function f(a) {
+    // indented comment
+    return a + 1;
+
+}
+'''), '''function f(a) {
+    return a + 1;
+}''')
+
+    def test_js_continued_string(self):
+        js = "var s = 'first \\\n    // second \\\n\\\n  third';\nf();"
+        self.assertEqual(minify_js(js), js)
+
+    def test_js_line_ends(self):
+        js = 'var a = b\n  ;(c || d).e()\nvar f = g\n  [1, 2].forEach(h)'
+        self.assertEqual(minify_js(js), js)
+
+    def test_js_template_literal(self):
+        js = 'var s = `\n    kept\n\n`;\n'
+        self.assertEqual(minify_js(js), js)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pelican_tools.build import Releases
+
+
+class ReleasesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='pelican-tools-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.releases = Releases(os.path.join(self.root, 'output'))
+
+    def add(self, *names):
+        for name in names:
+            os.makedirs(os.path.join(self.releases.directory, name))
+
+    def test_list(self):
+        self.add('20240102T000000', '20240101T000000-10', '.staging',
+                 '20240101T000000-2', '20240101T000000')
+        self.assertEqual(self.releases.list(), [
+            '20240101T000000', '20240101T000000-2', '20240101T000000-10',
+            '20240102T000000'])
+
+    def test_prune_same_second(self):
+        base = '20240101T000000'
+        self.add(base, *['%s-%d' % (base, n) for n in range(2, 12)])
+        self.releases.switch('%s-11' % base)
+        self.assertEqual(self.releases.prune(2), [base] + [
+            '%s-%d' % (base, n) for n in range(2, 10)])
+        self.assertEqual(self.releases.list(),
+                         ['%s-10' % base, '%s-11' % base])
+        self.assertEqual(self.releases.current(), '%s-11' % base)
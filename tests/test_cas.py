@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+
+from pelican_tools import cli
+from pelican_tools.cas import BlobStore, Deduplicator
+from pelican_tools.utils import sha256_file
+from tests.support import SiteTestCase
+
+ARTICLE = '''Title: {slug}
+Date: 2024-01-01
+Slug: {slug}
+
+{body}
+'''
+
+
+class DeduplicatorTest(SiteTestCase):
+
+    def make_tree(self):
+        tree = self.path('tree')
+        for rel, data in [('a.txt', 'same'), ('sub/b.txt', 'same'),
+                          ('c.txt', 'other')]:
+            path = os.path.join(tree, *rel.split('/'))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(data)
+        return tree
+
+    def test_run(self):
+        tree = self.make_tree()
+        store = BlobStore(self.path('blobs'))
+        deduplicator = Deduplicator(store, self.path('cas.json'), jobs=2)
+        stats = deduplicator.run([tree])
+        self.assertEqual((stats['files'], stats['stored'], stats['linked']),
+                         (3, 2, 1))
+        a, b, c = (os.path.join(tree, rel)
+                   for rel in ('a.txt', 'sub/b.txt', 'c.txt'))
+        self.assertTrue(os.path.samefile(a, b))
+        self.assertFalse(os.path.samefile(a, c))
+        self.assertTrue(store.is_linked(a, sha256_file(a)))
+        deduplicator.save()
+
+        again = Deduplicator(store, self.path('cas.json'))
+        self.assertEqual(again.run([tree])['shared'], 3)
+
+    def test_command(self):
+        tree = self.make_tree()
+        self.assertEqual(cli.main(['dedupe', '--store', self.path('blobs'),
+                                   tree]), 0)
+        self.assertTrue(os.path.samefile(os.path.join(tree, 'a.txt'),
+                                         os.path.join(tree, 'sub', 'b.txt')))
+
+
+class DeduplicatedBuildTest(SiteTestCase):
+
+    plugins = ['pelican_tools.cas']
+
+    def setUp(self):
+        super(DeduplicatedBuildTest, self).setUp()
+        templates = self.path('templates')
+        os.makedirs(templates)
+        with open(os.path.join(templates, 'article.html'), 'w') as f:
+            f.write('{{ article.content }}')
+        self.settings = dict(THEME_TEMPLATES_OVERRIDES=[templates],
+                             STATIC_PATHS=['files'])
+        for slug in ('first', 'second'):
+            self.write('%s.md' % slug, ARTICLE.format(slug=slug,
+                                                      body='Same body.'))
+            self.write('files/%s.txt' % slug, 'same file')
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_changed_twins(self):
+        output = self.build(plugins=self.plugins, **self.settings)
+        pages = [os.path.join(output, '%s.html' % slug)
+                 for slug in ('first', 'second')]
+        files = [os.path.join(output, 'files', '%s.txt' % slug)
+                 for slug in ('first', 'second')]
+        for first, second in (pages, files):
+            self.assertTrue(os.path.samefile(first, second))
+        store = BlobStore(self.path('cache-output', 'pelican-tools',
+                                    'blobs'))
+        page_blob = store.path(sha256_file(pages[1]))
+        page = self.read(pages[1])
+        file_blob = store.path(sha256_file(files[1]))
+
+        self.write('first.md', ARTICLE.format(slug='first',
+                                              body='Another body.'))
+        self.write('files/first.txt', 'changed file')
+        self.build(plugins=self.plugins, **self.settings)
+
+        self.assertIn('Another body.', self.read(pages[0]))
+        self.assertEqual(self.read(pages[1]), page)
+        self.assertEqual(self.read(page_blob), page)
+        self.assertEqual(self.read(files[0]), 'changed file')
+        self.assertEqual(self.read(files[1]), 'same file')
+        self.assertEqual(self.read(file_blob), 'same file')
+        self.assertTrue(os.path.samefile(pages[1], page_blob))
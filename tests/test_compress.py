@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import gzip
+import os
+import unittest
+
+from pelican_tools import compress, compress_max
+from tests.support import SiteTestCase
+
+PAGE = b'<p>A paragraph long enough to be compressed.</p>\n' * 20
+
+
+class KeyTest(unittest.TestCase):
+
+    def test_zopfli_iterations(self):
+        options = dict(compress_max.MAX_OPTIONS)
+        self.assertEqual(compress.gzip_key(options, 1024), 'zopfli-15')
+        self.assertEqual(
+            compress.gzip_key(options, compress_max.LARGE_FILE + 1),
+            'zopfli-5')
+        options['zopfli_iterations'] = 3
+        self.assertEqual(
+            compress.gzip_key(options, compress_max.LARGE_FILE + 1),
+            'zopfli-3')
+        self.assertEqual(compress.gzip_key({'gzip_level': 9}, 1024),
+                         'gzip-9')
+
+
+class CompressFileTest(SiteTestCase):
+
+    def setUp(self):
+        super(CompressFileTest, self).setUp()
+        self.page = self.write('page.html', PAGE)
+        self.options = dict(compress.DEFAULT_OPTIONS, formats=['gz'])
+
+    def test_sidecar(self):
+        entry = compress.compress_file(self.page, self.options)
+        with gzip.open(self.page + '.gz') as f:
+            self.assertEqual(f.read(), PAGE)
+        self.assertEqual(entry['sidecars']['gz'][0], 'gzip-9')
+        self.assertEqual(entry['bytes']['gz'][0], len(PAGE))
+
+    def test_reused_by_key(self):
+        entry = compress.compress_file(self.page, self.options)
+        entry.pop('bytes')
+        again = compress.compress_file(self.page, self.options, entry)
+        self.assertIsNone(again['bytes']['gz'])
+        self.assertEqual(again['sidecars'], entry['sidecars'])
+
+        options = dict(self.options, gzip_level=1)
+        again = compress.compress_file(self.page, options, entry)
+        self.assertEqual(again['sidecars']['gz'][0], 'gzip-1')
+        self.assertIsNotNone(again['bytes']['gz'])
+
+    def test_precompressor(self):
+        cache = self.path('compress.json')
+        options = {'html': self.options}
+        stats = compress.Precompressor(self.content, options, cache,
+                                       jobs=1).run()
+        self.assertEqual(stats['compressed'], 1)
+        stats = compress.Precompressor(self.content, options, cache,
+                                       jobs=1).run()
+        self.assertEqual((stats['compressed'], stats['unchanged']), (0, 1))
+        options = {'html': dict(self.options, gzip_level=1)}
+        stats = compress.Precompressor(self.content, options, cache,
+                                       jobs=1).run()
+        self.assertEqual(stats['compressed'], 1)
+
+
+class ContentCacheTest(SiteTestCase):
+
+    def test_reused_by_content(self):
+        page = self.write('page.html', PAGE)
+        options = compress.extension_options(
+            {'PRECOMPRESS_CONTENT_CACHE_PATH': self.path('compressed')},
+            'max')['html']
+        options['formats'] = ['gz']
+        entry = compress.compress_file(page, options)
+        key = entry['sidecars']['gz'][0]
+        self.assertEqual(key, compress.gzip_key(options, len(PAGE)))
+        cache = compress_max.ContentCache(options['content_cache'])
+        with open(page + '.gz', 'rb') as f:
+            self.assertEqual(cache.get(entry['sha256'], key), f.read())
+
+        # the sidecar is taken from the cache even without a cache entry
+        cache.put(entry['sha256'], key, b'cached')
+        os.remove(page + '.gz')
+        compress.compress_file(page, options)
+        with open(page + '.gz', 'rb') as f:
+            self.assertEqual(f.read(), b'cached')
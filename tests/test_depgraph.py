@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pelican_tools.depgraph import DependencyGraph, node
+
+
+class DependencyGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='pelican-tools-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.path = os.path.join(self.root, 'depgraph.json')
+        self.source = os.path.abspath('content/a.md')
+        graph = DependencyGraph(self.path)
+        graph.record('a.html', {node('source', self.source): 'a1',
+                                node('template', 'article.html'): 't1',
+                                node('setting', 'SITENAME'): 's1'})
+        graph.record('index.html', {node('template', 'index.html'): 't2',
+                                    node('template', '*'): 't3',
+                                    node('context', 'articles'): 'c1'})
+        graph.record('b.html', {node('template', 'article.html'): 't1',
+                                node('setting', '*'): 's2'})
+        graph.save()
+        self.graph = DependencyGraph(self.path)
+
+    def test_affected(self):
+        self.assertEqual(self.graph.affected(['content/a.md']),
+                         set(['a.html']))
+        self.assertEqual(self.graph.affected([node('context', 'articles')]),
+                         set(['index.html']))
+        # templates loaded dynamically may be any template
+        self.assertEqual(
+            self.graph.affected([node('template', 'article.html')]),
+            set(['a.html', 'b.html', 'index.html']))
+        # settings not referenced by name may be any setting
+        self.assertEqual(self.graph.affected([node('setting', 'SITEURL')]),
+                         set(['b.html']))
+        self.assertEqual(self.graph.affected([node('source', '/nowhere')]),
+                         set())
+
+    def test_changed_inputs(self):
+        self.assertEqual(self.graph.changed_inputs({
+            node('source', self.source): 'a2',
+            node('template', 'article.html'): 't1'}),
+            [node('source', self.source)])
+        changed = self.graph.record('a.html', {
+            node('source', self.source): 'a2',
+            node('template', 'article.html'): 't1'})
+        self.assertEqual(changed, [node('setting', 'SITENAME'),
+                                   node('source', self.source)])
+
+    def test_explain(self):
+        self.assertEqual(self.graph.explain('a.html'), [
+            'a.html',
+            '  setting:', '    SITENAME',
+            '  source:', '    %s' % self.source,
+            '  template:', '    article.html',
+            '  last rendered because of:', '    (new output)'])
+        self.assertEqual(self.graph.explain('c.html'),
+                         ['c.html: not recorded by the last build'])
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+
+from pelican_tools.feeds import page_name, paginate
+from tests.support import SiteTestCase, read_tree
+
+#: Plugin recording the feeds ``feed_written`` reports, with the number of
+#: their entries.
+RECORDER = '''
+import json
+
+from pelican import signals
+
+RECORD = %r
+
+
+def record(path, context, feed):
+    with open(RECORD, 'a') as f:
+        f.write(json.dumps([path, len(feed.items)]) + '\\n')
+
+
+def register():
+    signals.feed_written.connect(record)
+'''
+
+
+class FeedWriterTest(SiteTestCase):
+
+    plugins = ['pelican_tools.feeds']
+
+    def setUp(self):
+        super(FeedWriterTest, self).setUp()
+        self.write_articles(count=6, categories=2)
+
+    def feeds(self, output):
+        return dict((rel, data) for rel, data in read_tree(output).items()
+                    if rel.startswith('feeds/'))
+
+    def edit(self, rel, old, new):
+        path = os.path.join(self.content, rel)
+        with io.open(path, encoding='utf-8') as f:
+            text = f.read()
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text.replace(old, new))
+
+    def test_same_as_pelican(self):
+        self.assertSameOutput(self.build('clean'),
+                              self.build(plugins=self.plugins))
+
+    def test_unchanged_feeds_are_skipped(self):
+        output = self.build(plugins=self.plugins)
+        path = os.path.join(output, 'feeds', 'all.atom.xml')
+        os.utime(path, (0, 0))
+        self.build(plugins=self.plugins)
+        self.assertEqual(os.stat(path).st_mtime, 0)
+
+    def test_renamed_linked_article(self):
+        # every article links to a1: its new URL changes every entry
+        self.build(plugins=self.plugins)
+        self.edit('a1.md', 'Slug: a1\n', 'Slug: a1x\n')
+        output = self.build(plugins=self.plugins)
+        clean = self.build('clean')
+        self.assertEqual(self.feeds(clean), self.feeds(output))
+        self.assertIn(b'a1x.html', self.feeds(output)['feeds/cat0.atom.xml'])
+
+    def test_edited_summary(self):
+        self.build(plugins=self.plugins)
+        self.edit('a4.md', 'Summary of article 4.', 'New summary.')
+        output = self.build(plugins=self.plugins)
+        self.assertEqual(self.feeds(self.build('clean')), self.feeds(output))
+
+    def test_paged_feeds(self):
+        output = self.build(plugins=self.plugins, FEED_PAGE_SIZE=2)
+        feeds = self.feeds(output)
+        self.assertIn('feeds/all.atom-1.xml', feeds)
+        self.assertIn('feeds/all.atom-2.xml', feeds)
+        self.assertNotIn('feeds/all.atom-3.xml', feeds)
+        self.assertIn(b'rel="next"', feeds['feeds/all.atom.xml'])
+
+    def test_feed_written(self):
+        record = self.path('written.jsonl')
+        os.makedirs(self.path('plugins'))
+        with io.open(self.path('plugins', 'recorder.py'), 'w',
+                     encoding='utf-8') as f:
+            f.write(RECORDER % record)
+        settings = dict(PLUGIN_PATHS=[self.path('plugins')])
+        plugins = self.plugins + ['recorder']
+        self.build(plugins=plugins, **settings)
+        with open(record) as f:
+            written = sorted(json.loads(line) for line in f)
+        os.remove(record)
+        self.build(plugins=plugins, **settings)
+        with open(record) as f:
+            self.assertEqual(sorted(json.loads(line) for line in f),
+                             written)
+        self.assertIn([os.path.join(self.path('output'), 'feeds',
+                                    'all.atom.xml'), 6], written)
+
+
+class PaginateTest(SiteTestCase):
+
+    def test_paginate(self):
+        self.assertEqual(paginate(list(range(3)), 2), ([0, 1, 2], []))
+        entries, pages = paginate(list(range(9, -1, -1)), 3)
+        self.assertEqual(entries, [9, 8, 7, 6])
+        self.assertEqual(pages, [[2, 1, 0], [5, 4, 3]])
+        self.assertEqual(paginate([1, 2], None), ([1, 2], []))
+
+    def test_page_name(self):
+        self.assertEqual(page_name('feeds/all.atom.xml', 3),
+                         'feeds/all.atom-3.xml')
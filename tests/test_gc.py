@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+
+from pelican_tools import cli, gc
+from tests.support import SiteTestCase
+
+
+class GarbageCollectionTest(SiteTestCase):
+
+    plugins = ['pelican_tools.gc']
+
+    def rename_first_article(self):
+        path = os.path.join(self.content, 'a1.md')
+        with io.open(path, encoding='utf-8') as f:
+            text = f.read()
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text.replace('Slug: a1\n', 'Slug: a1x\n'))
+
+    def test_orphans(self):
+        self.write_articles()
+        output = self.build(plugins=self.plugins)
+        with open(os.path.join(output, 'untracked.txt'), 'w') as f:
+            f.write('not an output')
+        self.rename_first_article()
+        self.build(plugins=self.plugins)
+
+        settings = {'CACHE_PATH': self.path('cache-output')}
+        output_list = gc.OutputList(gc.outputs_path(settings))
+        self.assertEqual(sorted(output_list.orphans), ['a1.html'])
+        self.assertIn('a1x.html', output_list.outputs)
+        self.assertIn('theme/css/main.css', output_list.outputs)
+
+        self.assertEqual(cli.main(['gc', '-s', self.path('output.py')]), 0)
+        self.assertFalse(os.path.exists(os.path.join(output, 'a1.html')))
+        self.assertTrue(os.path.exists(os.path.join(output, 'a1x.html')))
+        self.assertTrue(os.path.exists(os.path.join(output,
+                                                    'untracked.txt')))
+        with io.open(gc.tombstones_path(settings), encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'a1.html\n')
+        self.assertEqual(gc.OutputList(gc.outputs_path(settings)).orphans,
+                         set())
+
+    def test_collect_removes_empty_directories(self):
+        root = self.path('out')
+        os.makedirs(os.path.join(root, 'a', 'b'))
+        os.makedirs(os.path.join(root, 'c'))
+        for rel in ('a/b/x.html', 'a/y.html', 'c/z.html', 'keep.html'):
+            with open(os.path.join(root, *rel.split('/')), 'w') as f:
+                f.write(rel)
+        with open(self.path('outside.html'), 'w') as f:
+            f.write('outside')
+        gc.collect(root, ['c/z.html', 'a/b/x.html', '../outside.html'])
+        self.assertTrue(os.path.exists(self.path('outside.html')))
+        self.assertEqual(sorted(os.listdir(root)), ['a', 'keep.html'])
+        self.assertEqual(os.listdir(os.path.join(root, 'a')), ['y.html'])
+
+    def test_dry_run(self):
+        root = self.path('out')
+        os.makedirs(root)
+        with open(os.path.join(root, 'x.html'), 'w') as f:
+            f.write('x')
+        self.assertEqual(gc.collect(root, ['x.html'], dry_run=True),
+                         ['x.html'])
+        self.assertTrue(os.path.exists(os.path.join(root, 'x.html')))
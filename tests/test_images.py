@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import unittest
+
+from pelican_tools import images
+from tests.support import SiteTestCase
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+needs_pillow = unittest.skipIf(Image is None, 'needs Pillow')
+
+
+def jpeg_data(size=(500, 250)):
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    f = io.BytesIO()
+    image.save(f, 'JPEG')
+    return f.getvalue()
+
+
+class DerivativesTest(unittest.TestCase):
+
+    def test_names(self):
+        self.assertEqual(
+            images.derivatives('images/a.png', [320, 640],
+                               ['original', 'webp'], 80),
+            [('images/a-320w.png', {'width': 320, 'format': 'PNG'}),
+             ('images/a-640w.png', {'width': 640, 'format': 'PNG'}),
+             ('images/a-320w.webp', {'width': 320, 'format': 'WEBP',
+                                     'quality': 80}),
+             ('images/a-640w.webp', {'width': 640, 'format': 'WEBP',
+                                     'quality': 80})])
+
+
+@needs_pillow
+class ImageProcessorTest(SiteTestCase):
+
+    def processor(self, output='output', **options):
+        return images.ImageProcessor(
+            [(self.path('content', 'images'), 'images')], self.path(output),
+            self.path('store'), self.path('%s.json' % output),
+            widths=[200, 320, 640], jobs=1, **options)
+
+    def size(self, rel, output='output'):
+        return Image.open(self.path(output, *rel.split('/'))).size
+
+    def test_widths(self):
+        self.write('images/photo.jpg', jpeg_data())
+        stats = self.processor().run()
+        self.assertEqual((stats['processed'], stats['rendered']), (1, 2))
+        self.assertEqual(self.size('images/photo-200w.jpg'), (200, 100))
+        self.assertEqual(self.size('images/photo-320w.jpg'), (320, 160))
+        # never enlarged
+        self.assertFalse(os.path.exists(
+            self.path('output', 'images', 'photo-640w.jpg')))
+
+        stats = self.processor().run()
+        self.assertEqual((stats['processed'], stats['unchanged']), (0, 1))
+        # another output directory reuses the stored derivatives
+        stats = self.processor('other').run()
+        self.assertEqual((stats['processed'], stats['rendered']), (1, 0))
+        self.assertTrue(os.path.samefile(
+            self.path('output', 'images', 'photo-320w.jpg'),
+            self.path('other', 'images', 'photo-320w.jpg')))
+
+    def test_formats(self):
+        self.write('images/photo.jpg', jpeg_data())
+        self.processor(formats=['original', 'webp']).run()
+        self.assertEqual(Image.open(self.path(
+            'output', 'images', 'photo-320w.webp')).format, 'WEBP')
+        # derivatives no longer configured are removed
+        self.processor().run()
+        self.assertFalse(os.path.exists(
+            self.path('output', 'images', 'photo-320w.webp')))
+        self.assertTrue(os.path.exists(
+            self.path('output', 'images', 'photo-320w.jpg')))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import unittest
+
+from pelican_tools import imgsize
+from tests.support import SiteTestCase, read_tree
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+needs_pillow = unittest.skipIf(Image is None, 'needs Pillow')
+
+
+def image_data(size, fmt, mode='RGB', **options):
+    f = io.BytesIO()
+    Image.new(mode, size, (10, 20, 30)).save(f, fmt, **options)
+    return f.getvalue()
+
+
+@needs_pillow
+class ImageSizeTest(SiteTestCase):
+
+    def assertSize(self, data, size):
+        path = self.write('image', data)
+        self.assertEqual(imgsize.image_size(path), size)
+
+    def test_png(self):
+        self.assertSize(image_data((401, 301), 'PNG'), (401, 301))
+
+    def test_gif(self):
+        self.assertSize(image_data((33, 65), 'GIF'), (33, 65))
+
+    def test_jpeg(self):
+        self.assertSize(image_data((640, 480), 'JPEG'), (640, 480))
+        self.assertSize(image_data((640, 480), 'JPEG', progressive=True),
+                        (640, 480))
+
+    def test_jpeg_orientation(self):
+        for orientation, size in ((1, (64, 48)), (3, (64, 48)),
+                                  (6, (48, 64)), (8, (48, 64))):
+            exif = Image.Exif()
+            exif[0x0112] = orientation
+            self.assertSize(image_data((64, 48), 'JPEG', exif=exif.tobytes()),
+                            size)
+
+    def test_webp(self):
+        self.assertSize(image_data((300, 200), 'WEBP', quality=80),
+                        (300, 200))
+        self.assertSize(image_data((300, 200), 'WEBP', lossless=True),
+                        (300, 200))
+        # alpha channel: extended (VP8X) format
+        self.assertSize(image_data((17, 5000), 'WEBP', mode='RGBA'),
+                        (17, 5000))
+
+    def test_not_an_image(self):
+        self.assertSize(b'<svg></svg>', None)
+        self.assertSize(b'\x89PNG\r\n\x1a\n', None)
+        self.assertSize(b'\xff\xd8\xff\xd9', None)
+
+
+class AnnotateTest(unittest.TestCase):
+
+    def test_annotate(self):
+        sizes = {'images/a.png': (4, 3), 'blog/b.png': (2, 1)}
+        html = ('<p><img src="../images/a.png" alt="a"> '
+                '<img src="b.png"/> <img src="c.png" > '
+                '<img width="9" src="b.png"></p>'
+                '<pre><img src="b.png"></pre>')
+        self.assertEqual(
+            imgsize.annotate(html, 'blog/post.html', sizes.get),
+            '<p><img src="../images/a.png" alt="a" width="4" height="3"> '
+            '<img src="b.png" width="2" height="1"/> <img src="c.png" > '
+            '<img width="9" src="b.png"></p><pre><img src="b.png"></pre>')
+
+
+@needs_pillow
+class IncrementalImageSizeTest(SiteTestCase):
+
+    plugins = ['pelican_tools.writer', 'pelican_tools.incremental',
+               'pelican_tools.imgsize']
+
+    def test_resized_image(self):
+        self.write('images/a.png', image_data((400, 300), 'PNG'))
+        self.write('p.md', 'Title: P\nDate: 2024-01-01\n\n'
+                   '![a]({static}/images/a.png)\n')
+        settings = dict(STATIC_PATHS=['images'])
+        self.build(plugins=self.plugins, **settings)
+        page = os.path.join(self.path('output'), 'p.html')
+        with io.open(page, encoding='utf-8') as f:
+            self.assertIn('width="400" height="300"', f.read())
+
+        self.write('images/a.png', image_data((800, 100), 'PNG'))
+        output = self.build(plugins=self.plugins, **settings)
+        with io.open(page, encoding='utf-8') as f:
+            self.assertIn('width="800" height="100"', f.read())
+        clean = self.build('clean', plugins=['pelican_tools.imgsize'],
+                           **settings)
+        self.assertEqual(read_tree(clean), read_tree(output))
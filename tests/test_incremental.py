@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+
+from tests.support import SiteTestCase, read_tree
+
+
+class IncrementalBuildTest(SiteTestCase):
+    """Incremental builds write the same files as clean builds."""
+
+    plugins = ['pelican_tools.incremental']
+
+    def assertSameAsClean(self, output, stale=()):
+        # Pelican leaves the outputs of removed content behind
+        self.assertSameOutput(self.build('clean'), output, stale)
+
+    def test_unchanged(self):
+        self.write_articles()
+        self.build(plugins=self.plugins)
+        before = read_tree(self.path('output'))
+        output = self.build(plugins=self.plugins)
+        self.assertEqual(before, read_tree(output))
+        self.assertSameAsClean(output)
+
+    def test_edited_article(self):
+        self.write_articles()
+        self.build(plugins=self.plugins)
+        path = os.path.join(self.content, 'a3.md')
+        with open(path, 'a') as f:
+            f.write('\nAnother paragraph.\n')
+        self.assertSameAsClean(self.build(plugins=self.plugins))
+
+    def test_renamed_linked_article(self):
+        self.write_articles()
+        self.build(plugins=self.plugins)
+        path = os.path.join(self.content, 'a1.md')
+        with open(path) as f:
+            text = f.read()
+        with open(path, 'w') as f:
+            f.write(text.replace('Slug: a1\n', 'Slug: a1x\n'))
+        output = self.build(plugins=self.plugins)
+        self.assertSameAsClean(output, stale=['a1.html'])
+
+    def test_renamed_linked_article_minimal_template(self):
+        # the template does not list the articles: only the content of a2
+        # tells that it links to a1
+        templates = self.path('templates')
+        os.makedirs(templates)
+        with open(os.path.join(templates, 'article.html'), 'w') as f:
+            f.write('{{ article.title }}{{ article.content }}')
+        settings = dict(THEME_TEMPLATES_OVERRIDES=[templates])
+        self.write_articles()
+        self.build(plugins=self.plugins, **settings)
+        path = os.path.join(self.content, 'a1.md')
+        with open(path) as f:
+            text = f.read()
+        with open(path, 'w') as f:
+            f.write(text.replace('Slug: a1\n', 'Slug: a1x\n'))
+        output = self.build(plugins=self.plugins, **settings)
+        self.assertSameOutput(self.build('clean', **settings), output,
+                              stale=['a1.html'])
+
+    def test_relative_urls_off(self):
+        self.write_articles()
+        self.build(plugins=self.plugins, RELATIVE_URLS=False,
+                   SITEURL='https://example.com')
+        self.write('a6.md', '''Title: Article 6
+Date: 2024-01-06
+Category: cat0
+
+Sixth.
+''')
+        output = self.build(plugins=self.plugins, RELATIVE_URLS=False,
+                            SITEURL='https://example.com')
+        clean = self.build('clean', RELATIVE_URLS=False,
+                           SITEURL='https://example.com')
+        self.assertSameOutput(clean, output)
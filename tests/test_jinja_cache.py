@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from jinja2 import DictLoader, Environment
+
+from pelican_tools.jinja_cache import SourceHashBytecodeCache
+
+
+class BytecodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pelican-tools-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.templates = {'page.html': '{% for x in items %}{{ x }}'
+                                       '{% endfor %}'}
+
+    def render(self, **options):
+        """Render the template as a new build would, and return the stats
+        of its bytecode cache."""
+        cache = SourceHashBytecodeCache(self.directory)
+        env = Environment(loader=DictLoader(self.templates),
+                          bytecode_cache=cache, **options)
+        self.assertEqual(env.get_template('page.html').render(items=[1, 2]),
+                         '12')
+        return cache.stats()
+
+    def test_hits_across_runs(self):
+        stats = self.render()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 1))
+        self.assertGreater(stats['bytes_written'], 0)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        stats = self.render()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 0))
+        self.assertGreater(stats['bytes_read'], 0)
+        self.assertEqual(stats['bytes_written'], 0)
+
+    def test_keys(self):
+        self.render()
+        # other compilation options get their own entry
+        self.assertEqual(self.render(trim_blocks=True)['misses'], 1)
+        self.assertEqual(self.render(trim_blocks=True)['hits'], 1)
+        self.templates['page.html'] += '{# changed #}'
+        self.assertEqual(self.render()['misses'], 1)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+
+from pelican_tools import manifest
+from tests.support import SiteTestCase
+
+
+class ManifestCommandTest(SiteTestCase):
+
+    def setUp(self):
+        super(ManifestCommandTest, self).setUp()
+        self.write_articles(count=3)
+        self.output = self.build()
+        self.config = self.path('output.py')
+        self.settings = {'CACHE_PATH': self.path('cache-output'),
+                         'MANIFEST_PATH': None}
+
+    def test_build_uses_site_settings(self):
+        self.assertEqual(manifest.main(['build', '-s', self.config]), 0)
+        path = manifest.manifest_path(self.settings)
+        self.assertIn('a1.html', manifest.Manifest.load(path).files)
+        self.assertFalse(os.path.exists(manifest.previous_path(path)))
+
+    def test_build_keeps_previous_manifest(self):
+        manifest.main(['build', '-s', self.config])
+        with io.open(os.path.join(self.output, 'new.html'), 'w') as f:
+            f.write('new')
+        os.remove(os.path.join(self.output, 'a2.html'))
+        manifest.main(['build', '-s', self.config])
+        path = manifest.manifest_path(self.settings)
+        previous = manifest.Manifest.load(manifest.previous_path(path))
+        self.assertIn('a2.html', previous.files)
+        added, changed, removed = previous.diff(manifest.Manifest.load(path))
+        self.assertEqual((added, changed, removed),
+                         (['new.html'], [], ['a2.html']))
+
+    def test_same_manifest_as_plugin(self):
+        self.build(plugins=['pelican_tools.manifest'])
+        path = manifest.manifest_path(self.settings)
+        written = manifest.Manifest.load(path).files
+        manifest.main(['build', '-s', self.config])
+        self.assertEqual(manifest.Manifest.load(path).files, written)
+        self.assertEqual(
+            manifest.Manifest.load(manifest.previous_path(path)).files,
+            written)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from pelican_tools.minify import HTMLMinifier, minify, minify_file
+from tests.support import SiteTestCase, read_tree
+
+PAGE = '''<!DOCTYPE html>
+<html>
+  <head>
+    <title>  A   page </title>
+    <style>
+      p  {  color:  red  }
+    </style>
+  </head>
+  <body>
+    <!-- removed -->
+    <!--[if IE]><p>kept</p><![endif]-->
+    <p class="a  b"
+       id=x>Some   <em>emphasised</em>
+       text,&nbsp; and  more.</p>
+    <p>1 < 2 and 3 > 2, x<y, a </ b</p>
+    <pre>
+  keep   this
+    </pre>
+    <script>if (a < b && c > d) {}</script>
+  </body>
+</html>
+'''
+
+MINIFIED = (
+    '<!DOCTYPE html><html><head><title>A page</title><style>\n'
+    '      p  {  color:  red  }\n'
+    '    </style></head><body><!--[if IE]><p>kept</p><![endif]-->'
+    '<p class="a  b" id=x>Some <em>emphasised</em> text,&nbsp; and  '
+    'more.</p><p>1 < 2 and 3 > 2, x<y, a </ b</p><pre>\n'
+    '  keep   this\n'
+    '    </pre><script>if (a < b && c > d) {}</script></body></html>')
+
+
+class MinifyTest(unittest.TestCase):
+
+    def test_page(self):
+        self.assertEqual(minify(PAGE), MINIFIED)
+
+    def test_idempotent(self):
+        self.assertEqual(minify(MINIFIED), MINIFIED)
+
+    def test_text_lt(self):
+        for html in ('<p>1 < 2 and 3 > 2</p>', '<p>a <= b</p>',
+                     '<p>a << b</p>', '<p>a < </p>', '<p>a <'):
+            self.assertEqual(minify(html), html.replace('< </p>', '<</p>'))
+
+    def test_chunks(self):
+        for size in (1, 2, 3, 7, 64):
+            minifier = HTMLMinifier()
+            out = [minifier.feed(PAGE[i:i + size])
+                   for i in range(0, len(PAGE), size)]
+            out.append(minifier.close())
+            self.assertEqual(''.join(out), MINIFIED, size)
+
+    def test_minify_file(self):
+        root = tempfile.mkdtemp(prefix='pelican-tools-')
+        self.addCleanup(shutil.rmtree, root, True)
+        path = os.path.join(root, 'page.html')
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(PAGE)
+        before, after = minify_file(path, chunk_size=5)
+        with io.open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), MINIFIED)
+        self.assertEqual(after, len(MINIFIED.encode('utf-8')))
+        self.assertGreater(before, after)
+
+
+class MinifyBuildTest(SiteTestCase):
+
+    def test_threaded_build(self):
+        self.write_articles()
+        clean = read_tree(self.build('clean'))
+        output = read_tree(self.build(
+            plugins=['pelican_tools.writer', 'pelican_tools.minify'],
+            MINIFY_JOBS=2))
+        self.assertEqual(sorted(output), sorted(clean))
+        for rel, data in sorted(clean.items()):
+            if rel.endswith('.html'):
+                data = minify(data.decode('utf-8')).encode('utf-8')
+            self.assertEqual(output[rel], data, rel)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import struct
+import unittest
+import zlib
+
+from pelican_tools import optimize
+from tests.support import SiteTestCase
+
+try:
+    from PIL import Image, PngImagePlugin
+except ImportError:  # pragma: no cover
+    Image = PngImagePlugin = None
+
+needs_pillow = unittest.skipIf(Image is None, 'needs Pillow')
+
+
+def png_data(*chunks):
+    info = PngImagePlugin.PngInfo()
+    for chunk in chunks:
+        info.add(*chunk)
+    image = Image.linear_gradient('L').resize((64, 64))
+    f = io.BytesIO()
+    image.save(f, 'PNG', compress_level=0, pnginfo=info)
+    return f.getvalue()
+
+
+def with_chunk(data, cid, chunk):
+    """Return the PNG image ``data`` with a chunk Pillow would not write
+    inserted after its header."""
+    raw = struct.pack('>I4s', len(chunk), cid) + chunk + struct.pack(
+        '>I', zlib.crc32(cid + chunk) & 0xffffffff)
+    return data[:33] + raw + data[33:]
+
+
+def chunks(data):
+    return [(cid, chunk) for cid, chunk, after_idat
+            in optimize.png_chunks(data) if cid != b'IDAT']
+
+
+@needs_pillow
+class OptimizeTest(unittest.TestCase):
+
+    def test_png_chunks(self):
+        data = png_data((b'gAMA', b'\0\0\xb1\x8f'), (b'sRGB', b'\0'),
+                        (b'tEXt', b'Title\0A gradient'),
+                        (b'iTXt', b'Author\0\0\0\0\0Somebody'),
+                        (b'prIv', b'kept'))
+        optimized = optimize.optimize(data, 'PNG')
+        self.assertLess(len(optimized), len(data))
+        self.assertEqual(sorted(chunks(optimized)), sorted(chunks(data)))
+        self.assertEqual(Image.open(io.BytesIO(optimized)).tobytes(),
+                         Image.open(io.BytesIO(data)).tobytes())
+
+    def test_png_unknown_chunks(self):
+        data = with_chunk(png_data(), b'oFFs', b'\0' * 9)
+        self.assertIsNone(optimize.optimize(data, 'PNG'))
+        data = png_data((b'prIV', b'unsafe to copy'))
+        self.assertIsNone(optimize.optimize(data, 'PNG'))
+
+
+@needs_pillow
+class MemoTest(SiteTestCase):
+
+    def test_memo(self):
+        data = png_data()
+        path = self.write('image.png', data)
+        store = self.path('store')
+        before, after, fresh = optimize.optimize_file(path, store)
+        self.assertEqual(before, len(data))
+        self.assertLess(after, before)
+        self.assertTrue(fresh)
+        key = optimize.memo_key(data)
+        blob = os.path.join(store, key[:2], key)
+        with open(path, 'rb') as f:
+            optimized = f.read()
+        with open(blob + '.opt', 'rb') as f:
+            self.assertEqual(f.read(), optimized)
+        new = optimize.memo_key(optimized)
+        self.assertTrue(os.path.exists(os.path.join(store, new[:2],
+                                                    new + '.ok')))
+
+        # the optimized image is known to be optimal
+        self.assertEqual(optimize.optimize_file(path, store),
+                         (after, after, False))
+        # and the original replaced by it without optimizing it again
+        copy = self.write('copy.png', data)
+        self.assertEqual(optimize.optimize_file(copy, store),
+                         (before, after, False))
+        with open(copy, 'rb') as f:
+            self.assertEqual(f.read(), optimized)
+
+    def test_optimal(self):
+        data = with_chunk(png_data(), b'oFFs', b'\0' * 9)
+        path = self.write('image.png', data)
+        store = self.path('store')
+        self.assertEqual(optimize.optimize_file(path, store),
+                         (len(data), len(data), True))
+        key = optimize.memo_key(data)
+        self.assertTrue(os.path.exists(os.path.join(store, key[:2],
+                                                    key + '.ok')))
+        self.assertEqual(optimize.optimize_file(path, store),
+                         (len(data), len(data), False))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+
+from pelican_tools.output import OutputCache
+from tests.support import ARTICLE, SiteTestCase, read_tree
+
+
+class OutputCacheTest(SiteTestCase):
+
+    def test_write(self):
+        cache = OutputCache(self.path('output.json'))
+        path = self.path('page.html')
+        self.assertTrue(cache.write(path, b'page'))
+        os.utime(path, (0, 0))
+        self.assertFalse(cache.write(path, b'page'))
+        self.assertEqual(os.stat(path).st_mtime, 0)
+        self.assertTrue(cache.write(path, b'other page'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'other page')
+        self.assertEqual((cache.written, cache.unchanged), (2, 1))
+
+
+class SkipIdenticalBuildTest(SiteTestCase):
+
+    plugins = ['pelican_tools.output']
+
+    def test_mtimes_kept(self):
+        self.write_articles()
+        output = self.build(plugins=self.plugins)
+        before = read_tree(output)
+        for rel in before:
+            os.utime(os.path.join(output, *rel.split('/')), (0, 0))
+
+        self.write('a1.md', ARTICLE.format(number=1, category=1) + 'More.\n')
+        self.build(plugins=self.plugins)
+        after = read_tree(output)
+        self.assertEqual(sorted(after), sorted(before))
+        changed = set(rel for rel in after if after[rel] != before[rel])
+        self.assertIn('a1.html', changed)
+        for rel in after:
+            if rel.startswith('theme/'):
+                continue  # copied by Pelican, not written
+            mtime = os.stat(os.path.join(output, *rel.split('/'))).st_mtime
+            self.assertEqual(mtime != 0, rel in changed, rel)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import unittest
+
+from pelican.settings import DEFAULT_CONFIG
+
+from pelican_tools import cli
+from pelican_tools.index import index_path
+from pelican_tools.parallel_read import picklable_settings, source_files
+from tests.support import SiteTestCase
+
+RST = '''Article {number}
+##########
+
+:date: 2024-02-{number:02d} 10:00
+:category: rst
+:tags: t{number}, common
+:slug: r{number}
+
+Body of *article* {number}, with a `link <{{filename}}/a1.md>`_.
+'''
+
+
+class PooledBuildTest(SiteTestCase):
+
+    def test_same_output(self):
+        self.write_articles(count=7)
+        for number in range(1, 4):
+            self.write('r%d.rst' % number, RST.format(number=number))
+        self.write('pages/about.md', 'Title: About\n\nAbout the site.\n')
+        output = self.build(plugins=['pelican_tools.parallel_read'],
+                            PARALLEL_READ_JOBS=3,
+                            PARALLEL_READ_CHUNK_SIZE=2)
+        self.assertSameOutput(self.build('clean'), output)
+
+    def test_command(self):
+        self.write_articles(count=3)
+        self.write('r1.rst', RST.format(number=1))
+        self.write('notes.txt', 'Not a source.')
+        self.build()
+        self.assertEqual(cli.main(['read', '-s', self.path('output.py'),
+                                   '-j', '2', '--check']), 0)
+
+    def test_source_files(self):
+        self.write_articles(count=2)
+        self.write('pages/about.md', 'Title: About\n\nAbout.\n')
+        self.write('drafts/a.html', '<html></html>')
+        settings = dict(DEFAULT_CONFIG, PATH=self.content,
+                        CACHE_PATH=self.path('cache'))
+        self.assertEqual(source_files(settings), [
+            os.path.join(self.content, 'a1.md'),
+            os.path.join(self.content, 'a2.md'),
+            os.path.join(self.content, 'pages', 'about.md')])
+        self.assertTrue(os.path.exists(index_path(settings)))
+
+
+class PicklableSettingsTest(unittest.TestCase):
+
+    def test_dropped(self):
+        settings = picklable_settings({'SITENAME': 'Site',
+                                       'JINJA_FILTERS': {'f': lambda x: x}})
+        self.assertEqual(settings, {'SITENAME': 'Site'})
+
+    def test_reader_setting(self):
+        self.assertRaises(ValueError, picklable_settings,
+                          {'MARKDOWN': {'extension_configs': {
+                              'markdown.extensions.toc': {
+                                  'slugify': lambda value, sep: value}}}})
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import base64
+import io
+import os
+import unittest
+
+from pelican_tools import placeholders
+from tests.support import SiteTestCase
+
+np = placeholders.np
+Image = placeholders.Image
+needs_numpy = unittest.skipIf(np is None or Image is None,
+                              'needs numpy and Pillow')
+
+
+def gradient(width=40, height=30):
+    return np.linspace(0, 255, width * height * 3).reshape(
+        height, width, 3).astype(np.uint8)
+
+
+def decode_base83(text):
+    value = 0
+    for char in text:
+        value = value * 83 + placeholders.BASE83.index(char)
+    return value
+
+
+@needs_numpy
+class BlurHashTest(unittest.TestCase):
+
+    def blurhash(self, pixels, components=(4, 3)):
+        return placeholders.blurhash(
+            placeholders.srgb_to_linear(pixels.astype(np.float64)),
+            components)
+
+    def test_reference(self):
+        # as computed by the reference implementation
+        self.assertEqual(self.blurhash(gradient()),
+                         ('LzHV9wj[fQof00ayfQayxuj[fQj[', '#979797'))
+
+    def test_uniform(self):
+        pixels = np.empty((8, 12, 3), np.uint8)
+        pixels[...] = (200, 100, 50)
+        hash_, color = self.blurhash(pixels, (3, 2))
+        self.assertEqual(color, '#c86432')
+        self.assertEqual(len(hash_), 4 + 2 * 3 * 2)
+        self.assertEqual(decode_base83(hash_[0]), 2 + 1 * 9)
+        self.assertEqual(decode_base83(hash_[2:6]), 0xc86432)
+
+    def test_downsample(self):
+        pixels = gradient(100, 30)
+        small = placeholders.downsample(pixels, 16)
+        self.assertEqual(small.shape, (4, 14, 3))
+        self.assertAlmostEqual(float(small[0, 0, 0]),
+                               pixels[:7, :7, 0].mean(), places=3)
+        self.assertEqual(placeholders.downsample(pixels, 100).shape,
+                         pixels.shape)
+        # a side shorter than the block is kept whole
+        self.assertEqual(placeholders.downsample(gradient(200, 3), 16).shape,
+                         (1, 15, 3))
+
+
+@needs_numpy
+class PlaceholderTest(SiteTestCase):
+
+    def test_make_placeholder(self):
+        f = io.BytesIO()
+        Image.fromarray(gradient(400, 300)).save(f, 'JPEG')
+        path = self.write('images/photo.jpg', f.getvalue())
+        placeholder = placeholders.make_placeholder(path)
+        self.assertEqual((placeholder.width, placeholder.height), (400, 300))
+        self.assertTrue(placeholder.lqip.startswith('data:image/png;base64,'))
+        data = base64.b64decode(placeholder.lqip.split(',', 1)[1])
+        tiny = Image.open(io.BytesIO(data))
+        self.assertLessEqual(max(tiny.size), 16)
+        self.assertEqual(placeholder.blurhash[0], placeholders.BASE83[21])
+
+    def test_lookup(self):
+        lookup = placeholders.Placeholders('https://example.com/blog')
+        lookup.entries['images/a.png'] = placeholder = \
+            placeholders.Placeholder(1, 2, '#000000', '', '')
+        self.assertIs(lookup.get('https://example.com/blog/images/a.png'),
+                      placeholder)
+        self.assertIs(lookup['/blog/images/a.png?v=1'], placeholder)
+        self.assertIn('images/a.png', lookup)
+        self.assertIsNone(lookup.get('/images/a.png'))
+        self.assertIsNone(lookup.get('https://elsewhere.com/images/a.png'))
+        self.assertIsNone(lookup.get(None))
+        self.assertRaises(KeyError, lookup.__getitem__, 'images/b.png')
+
+
+@needs_numpy
+class IncrementalPlaceholderTest(SiteTestCase):
+
+    plugins = ['pelican_tools.incremental', 'pelican_tools.placeholders']
+
+    def write_image(self, size):
+        f = io.BytesIO()
+        Image.fromarray(gradient(*size)).save(f, 'PNG')
+        self.write('images/a.png', f.getvalue())
+
+    def test_changed_image(self):
+        overrides = self.path('templates')
+        os.makedirs(overrides)
+        with io.open(os.path.join(overrides, 'article.html'), 'w',
+                     encoding='utf-8') as f:
+            f.write('{% set p = placeholders.get(article.cover) %}'
+                    '{{ p.width }}x{{ p.height }} {{ p.blurhash }}\n')
+        self.write('p.md', 'Title: P\nDate: 2024-01-01\n'
+                   'Cover: images/a.png\n\nText.\n')
+        settings = dict(STATIC_PATHS=['images'],
+                        THEME_TEMPLATES_OVERRIDES=[overrides])
+        page = os.path.join(self.path('output'), 'p.html')
+
+        self.write_image((40, 30))
+        self.build(plugins=self.plugins, **settings)
+        with io.open(page, encoding='utf-8') as f:
+            self.assertTrue(f.read().startswith('40x30 '))
+        self.write_image((20, 60))
+        self.build(plugins=self.plugins, **settings)
+        with io.open(page, encoding='utf-8') as f:
+            self.assertTrue(f.read().startswith('20x60 '))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import time
+import unittest
+
+from pelican_tools import profile
+from tests.support import SiteTestCase
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_nested(self):
+        profiler = profile.Profiler()
+
+        def read():
+            time.sleep(0.05)
+
+        def generate():
+            profiler.measure('reading', 'Generator', read)
+            time.sleep(0.01)
+
+        profiler.measure('context', 'Generator', generate)
+        report = profiler.report()
+        phases = dict((row['name'], row) for row in report['phases'])
+        self.assertEqual([row['name'] for row in report['phases']],
+                         list(profile.PHASES) + ['other'])
+        # reading is not counted again in the context
+        self.assertGreaterEqual(phases['reading']['wall'], 0.05)
+        self.assertLess(phases['context']['wall'], 0.05)
+        self.assertEqual(report['generators'], [dict(
+            [(phase, dict((key, value)
+                          for key, value in phases[phase].items()
+                          if key != 'name'))
+             for phase in ('context', 'reading')], name='Generator')])
+        self.assertEqual(sorted(report['total']), ['cpu', 'peak_rss', 'wall'])
+        self.assertIn('reading', profile.format_report(report))
+
+
+class ProfileBuildTest(SiteTestCase):
+
+    def test_report(self):
+        self.write_articles()
+        self.build(plugins=['pelican_tools.profile'])
+        with open(self.path('cache-output', 'pelican-tools',
+                            'profile.json')) as f:
+            report = json.load(f)
+        self.assertEqual(sorted(report), ['caches', 'generators', 'phases',
+                                          'signals', 'total'])
+        phases = dict((row['name'], row) for row in report['phases'])
+        self.assertEqual(phases['reading']['calls'], 5)
+        self.assertGreater(phases['rendering']['calls'], 5)
+        generators = dict((row['name'], row) for row in report['generators'])
+        self.assertEqual(sorted(generators['ArticlesGenerator']),
+                         ['context', 'name', 'reading', 'rendering',
+                          'writing'])
+        self.assertIn('article_generator_finalized',
+                      [row['name'] for row in report['signals']])
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from pelican_tools import scan
+from tests.support import SiteTestCase
+
+
+class ParserTest(unittest.TestCase):
+
+    def test_markdown(self):
+        self.assertEqual(scan.parse_markdown(
+            'Title: A title\nDate: 2024-01-01\nTags: a, b'),
+            {'title': 'A title', 'date': '2024-01-01', 'tags': 'a, b'})
+        self.assertEqual(scan.parse_markdown(
+            'Title: A title\nSummary: first line\n    second line\n\n'
+            'Author: body'),
+            {'title': 'A title', 'summary': 'first line\nsecond line'})
+
+    def test_yaml(self):
+        self.assertEqual(scan.parse_markdown(
+            '---\ntitle: "A: title"\n# comment\ntags: [a, \'b\']\n'
+            'authors:\n  - Ann\n  - Bob\n---'),
+            {'title': 'A: title', 'tags': ['a', 'b'],
+             'authors': ['Ann', 'Bob']})
+
+    def test_rst(self):
+        self.assertEqual(scan.parse_rst(
+            '=======\nA title\n=======\n\n:date: 2024-01-01\n'
+            ':summary: first line\n    second line\n'),
+            {'title': 'A title', 'date': '2024-01-01',
+             'summary': 'first line second line'})
+
+    def test_html(self):
+        self.assertEqual(scan.parse_html(
+            '<html><head><title> A title </title>'
+            '<meta name="Tags" content="a, b">'
+            '<meta content="2024-01-01" name="date">'),
+            {'title': 'A title', 'tags': 'a, b', 'date': '2024-01-01'})
+
+
+class ScanTest(SiteTestCase):
+
+    def test_header_only(self):
+        self.write('a.md', 'Title: A\nTags: x; y, z\n\nTitle: body\n' +
+                   'text\n' * 2000)
+        self.write('b/c.rst', 'Cee\n===\n\n:tags: c\n\nbody\n')
+        self.write('d.txt', 'Title: not a source\n')
+        self.assertEqual(scan.read_header(self.path('content', 'a.md'),
+                                          'markdown'),
+                         'Title: A\nTags: x; y, z')
+        records = [
+            {'path': 'a.md', 'format': 'markdown',
+             'metadata': {'title': 'A', 'tags': ['x', 'y, z']}},
+            {'path': 'b/c.rst', 'format': 'rst',
+             'metadata': {'title': 'Cee', 'tags': ['c']}}]
+        self.assertEqual(list(scan.scan(self.content)), records)
+        self.assertEqual(list(scan.scan(self.content, jobs=2)), records)
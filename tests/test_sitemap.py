@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import re
+
+from tests.support import SiteTestCase
+
+SITEURL = 'https://example.com/blog'
+
+
+class SitemapTest(SiteTestCase):
+
+    plugins = ['pelican_tools.sitemap']
+
+    def read(self, output, name):
+        with io.open(os.path.join(output, name), encoding='utf-8') as f:
+            return f.read()
+
+    def build_sitemap(self, **settings):
+        return self.build(plugins=self.plugins, SITEURL=SITEURL,
+                          RELATIVE_URLS=False, SITEMAP_GZIP=False, **settings)
+
+    def lastmods(self, output):
+        return dict(re.findall(
+            r'<url><loc>%s/([^<]*)</loc>(?:<lastmod>([^<]*)</lastmod>)?'
+            % re.escape(SITEURL), self.read(output, 'sitemap-1.xml')))
+
+    def test_absolute_urls(self):
+        self.write_articles()
+        output = self.build_sitemap()
+        index = self.read(output, 'sitemap.xml')
+        self.assertIn('<loc>%s/sitemap-1.xml</loc>' % SITEURL, index)
+        locs = re.findall(r'<loc>([^<]*)</loc>',
+                          self.read(output, 'sitemap-1.xml'))
+        self.assertIn('%s/a1.html' % SITEURL, locs)
+        for loc in locs:
+            self.assertTrue(loc.startswith(SITEURL + '/'), loc)
+
+    def test_relative_siteurl(self):
+        self.write_articles()
+        output = self.build(plugins=self.plugins, SITEMAP_GZIP=False)
+        self.assertFalse(os.path.exists(os.path.join(output, 'sitemap.xml')))
+        self.assertFalse(os.path.exists(
+            os.path.join(output, 'sitemap-1.xml')))
+
+    def test_listing_lastmod(self):
+        self.write_articles()
+        lastmods = self.lastmods(self.build_sitemap())
+        # two articles per page, newest first
+        self.assertEqual(lastmods[''], lastmods['a5.html'])
+        self.assertEqual(lastmods['index2.html'], lastmods['a3.html'])
+        self.assertEqual(lastmods['index3.html'], lastmods['a1.html'])
+        self.assertEqual(lastmods['archives.html'], lastmods['a5.html'])
+        self.assertEqual(lastmods['category/cat0.html'], lastmods['a4.html'])
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from pelican_tools.watch import IGNORED, InotifyWatcher, ignore_matcher
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify only')
+class InotifyWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='pelican-tools-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.content = os.path.join(self.root, 'content')
+        self.posts = os.path.join(self.content, 'posts')
+        os.makedirs(self.posts)
+        self.post = os.path.join(self.posts, 'post.md')
+        self.touch(self.post)
+        self.watcher = InotifyWatcher([self.content],
+                                      ignore_matcher(IGNORED))
+        self.addCleanup(self.watcher.close)
+
+    def touch(self, path, data='Title: Post\n'):
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def test_changed_file(self):
+        self.touch(self.post, 'Title: Changed\n')
+        self.touch(os.path.join(self.posts, '.post.md.swp'))
+        self.assertEqual(self.watcher.wait(1), set([self.post]))
+
+    def test_new_directory(self):
+        os.makedirs(os.path.join(self.content, 'new'))
+        self.assertEqual(self.watcher.wait(1), set())
+        new = os.path.join(self.content, 'new', 'post.md')
+        self.touch(new)
+        self.assertEqual(self.watcher.wait(1), set([new]))
+
+    def test_moved_out_directory(self):
+        os.rename(self.posts, os.path.join(self.root, 'posts'))
+        self.assertEqual(self.watcher.wait(1), set([self.posts]))
+        # the directory is not watched any more
+        self.touch(os.path.join(self.root, 'posts', 'post.md'), 'Title: x\n')
+        self.assertEqual(self.watcher.wait(0.2), set())
+
+    def test_removed_directory(self):
+        shutil.rmtree(self.posts)
+        self.assertIn(self.posts, self.watcher.wait(1))
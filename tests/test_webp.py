@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import unittest
+
+from pelican_tools import webp
+from tests.support import SiteTestCase
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+needs_pillow = unittest.skipIf(Image is None, 'needs Pillow')
+
+ARTICLE = '''Title: Photo
+Date: 2024-01-01
+Slug: photo
+
+<img src="{static}/images/photo.jpg" alt="A photo">
+<img src="{static}/images/small.png" alt="A small image">
+'''
+
+
+def jpeg_data(size=(320, 240)):
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    f = io.BytesIO()
+    image.save(f, 'JPEG', quality=95)
+    return f.getvalue()
+
+
+class PageRewriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rewriter = webp.PageRewriter(set(['images/a.jpg',
+                                               'images/b.png']))
+
+    def test_wrap(self):
+        html, refs = self.rewriter.rewrite(
+            '<p><img src="../images/a.jpg" alt=""></p>', 'posts/page.html')
+        self.assertEqual(html, '<p><picture data-webp><source srcset='
+                         '"../images/a.jpg.webp" type="image/webp">'
+                         '<img src="../images/a.jpg" alt=""></picture></p>')
+        self.assertEqual(refs, set(['images/a.jpg']))
+
+    def test_left_alone(self):
+        for html in ('<img src="images/c.jpg">',
+                     '<img src="https://example.com/images/a.jpg">',
+                     '<img src="images/a.jpg?v=2">',
+                     '<img srcset="images/a.jpg 1x, images/c.jpg 2x">',
+                     '<pre><img src="images/a.jpg"></pre>',
+                     '<picture><img src="images/a.jpg"></picture>'):
+            self.assertEqual(self.rewriter.rewrite(html, 'index.html')[0],
+                             html)
+
+    def test_srcset(self):
+        html = self.rewriter.rewrite(
+            '<img srcset="images/a.jpg 1x, images/b.png 2x" sizes="50vw">',
+            'index.html')[0]
+        self.assertIn('<source srcset="images/a.jpg.webp 1x, '
+                      'images/b.png.webp 2x" type="image/webp" '
+                      'sizes="50vw">', html)
+
+    def test_idempotent(self):
+        html = self.rewriter.rewrite('<img src="images/a.jpg">',
+                                     'index.html')[0]
+        self.assertEqual(self.rewriter.rewrite(html, 'index.html')[0], html)
+        # and unwrapped when the copy is gone
+        rewriter = webp.PageRewriter(set())
+        self.assertEqual(rewriter.rewrite(html, 'index.html')[0],
+                         '<img src="images/a.jpg">')
+
+
+@needs_pillow
+class ConvertTest(SiteTestCase):
+
+    def test_margin(self):
+        path = self.write('photo.jpg', jpeg_data())
+        store = self.path('store')
+        options = dict(webp.DEFAULT_OPTIONS, margin=0)
+        entry = webp.convert_file(path, store, options)
+        self.assertTrue(entry['encoded'])
+        self.assertLess(entry['sizes'][1], entry['sizes'][0])
+        self.assertTrue(os.path.exists(path + '.webp'))
+        # never encoded twice
+        self.assertFalse(webp.convert_file(path, store, options)['encoded'])
+
+        os.remove(path + '.webp')
+        options = dict(webp.DEFAULT_OPTIONS, margin=1.0)
+        entry = webp.convert_file(path, store, options)
+        self.assertIsNone(entry['sizes'][1])
+        self.assertIsNone(entry['webp'])
+        self.assertFalse(os.path.exists(path + '.webp'))
+        blob = os.path.join(store, entry['key'][:2], entry['key'])
+        self.assertTrue(os.path.exists(blob + '.no'))
+        self.assertFalse(webp.convert_file(path, store, options)['encoded'])
+
+
+@needs_pillow
+class WebPBuildTest(SiteTestCase):
+
+    plugins = ['pelican_tools.output', 'pelican_tools.webp']
+
+    def build_site(self):
+        return self.build(plugins=self.plugins, STATIC_PATHS=['images'],
+                          WEBP_JOBS=1)
+
+    def read(self, path):
+        with io.open(path, encoding='utf-8') as f:
+            return f.read()
+
+    def test_pages_kept(self):
+        self.write('photo.md', ARTICLE)
+        self.write('images/photo.jpg', jpeg_data())
+        # not an image: left without a copy
+        self.write('images/small.png', b'\x89PNG\r\n\x1a\n' + b'\0' * 4)
+        output = self.build_site()
+        page = os.path.join(output, 'photo.html')
+        html = self.read(page)
+        self.assertIn('<picture data-webp><source srcset="./images/'
+                      'photo.jpg.webp" type="image/webp">', html)
+        self.assertNotIn('small.png.webp', html)
+        self.assertTrue(os.path.exists(
+            os.path.join(output, 'images', 'photo.jpg.webp')))
+
+        os.utime(page, (0, 0))
+        self.build_site()
+        self.assertEqual(self.read(page), html)
+        self.assertEqual(os.stat(page).st_mtime, 0)
+
+    def test_new_image(self):
+        self.write('photo.md', ARTICLE.replace('{static}', 'unknown'))
+        output = self.build_site()
+        page = os.path.join(output, 'photo.html')
+        self.assertNotIn('<picture', self.read(page))
+        self.write('photo.md', ARTICLE)
+        self.write('images/photo.jpg', jpeg_data())
+        self.build_site()
+        self.assertIn('photo.jpg.webp', self.read(page))
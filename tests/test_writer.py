@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from tests.support import SiteTestCase
+
+
+class ThreadedWriterTest(SiteTestCase):
+    """The threaded writer writes the same files as Pelican's writer."""
+
+    plugins = ['pelican_tools.writer']
+
+    def setUp(self):
+        super(ThreadedWriterTest, self).setUp()
+        self.write_articles(count=12, categories=3)
+        self.write('pages/about.md', 'Title: About\n\nSee [an article]'
+                   '({filename}/a2.md).\n')
+
+    def test_relative_urls(self):
+        serial = self.build('serial')
+        threaded = self.build('threaded', plugins=self.plugins,
+                              PARALLEL_WRITE_JOBS=4)
+        self.assertSameOutput(serial, threaded)
+
+    def test_absolute_urls(self):
+        settings = dict(RELATIVE_URLS=False, SITEURL='https://example.com')
+        serial = self.build('serial', **settings)
+        threaded = self.build('threaded', plugins=self.plugins,
+                              PARALLEL_WRITE_JOBS=4, **settings)
+        self.assertSameOutput(serial, threaded)
+
+    def test_incremental(self):
+        plugins = self.plugins + ['pelican_tools.incremental']
+        self.build('threaded', plugins=plugins, PARALLEL_WRITE_JOBS=4)
+        self.write('a13.md', 'Title: Article 13\nDate: 2024-02-01\n'
+                   'Category: cat0\n\nLinks to [a1]({filename}/a1.md).\n')
+        threaded = self.build('threaded', plugins=plugins,
+                              PARALLEL_WRITE_JOBS=4)
+        self.assertSameOutput(self.build('serial'), threaded)